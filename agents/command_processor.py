@@ -1,20 +1,144 @@
 import json
+import re
+import threading
 import traceback
+import logging
 from agents.gemini_agent import call_gemini # Ensure this import is present
+from utils.neo4j_repository import read, read_single
 
-def process_natural_language_command(command: str, driver):
+logger = logging.getLogger(__name__)
+
+# Map common user-friendly report types to the types stored in your database
+type_map = {
+    "lab": "lab", "lab report": "lab", "labs": "lab", "blood report": "lab", "blood test": "lab",
+    "scan": "scan", "x-ray": "scan", "xray": "scan", "chest x-ray": "scan", "chest xray": "scan",
+    "mri": "scan", "ct scan": "scan", "ct": "scan", "radiology": "scan",
+    "prescription": "prescription", "insight": "prescription", "clinical insight": "prescription"
+}
+
+# Commands parsed locally with at least this confidence never reach Gemini
+RULE_CONFIDENCE_THRESHOLD = 0.8
+
+EXPLICIT_CASE_ID_PATTERN = re.compile(r"\bc-?(\d{1,6})\b", re.IGNORECASE)
+CASE_WORD_ID_PATTERN = re.compile(r"\bcase\s*(?:id\s*)?(?:no\.?|number|#)?\s*:?\s*c?-?(\d{1,6})\b", re.IGNORECASE)
+PATIENT_NAME_PATTERN = re.compile(r"\bfor\s+(?:patient\s+)?([A-Z][a-zA-Z'-]+(?:\s+[A-Z][a-zA-Z'-]+)*)")
+REPORT_TYPE_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(type_map, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+# Keyword lexicon for each documented intent
+INTENT_KEYWORDS = {
+    "list_patients": re.compile(r"\b(list|show|display|all|get|view)\b.*\bpatients\b|\bpatients?\s+list\b", re.IGNORECASE),
+    "summarize_case": re.compile(r"\b(summari[sz]e|summary|overview|recap)\b", re.IGNORECASE),
+    "show_report": re.compile(r"\b(show|open|view|display|get|fetch|find|pull up)\b|\breports?\b", re.IGNORECASE),
+}
+
+_parser_stats_lock = threading.Lock()
+_parser_stats = {"rules": 0, "llm": 0}
+
+
+def _extract_case_id(command):
+    """Return a normalized case id (e.g. 'C010') or None."""
+    match = EXPLICIT_CASE_ID_PATTERN.search(command) or CASE_WORD_ID_PATTERN.search(command)
+    if not match:
+        return None
+    return f"C{int(match.group(1)):03d}"
+
+
+def parse_command_locally(command: str):
+    """
+    Deterministic parser for the documented intents (show_report,
+    list_patients, summarize_case) using regexes and a keyword lexicon.
+
+    Returns:
+        dict: The same shape Gemini is asked to produce, plus a "confidence"
+        score between 0 and 1. Confidence is 0 when no rule matched.
+    """
+    text = command.strip()
+    parsed = {"intent": "unknown", "case_id": None, "report_type": None, "patient_name": None, "confidence": 0.0}
+    if not text:
+        return parsed
+
+    case_id = _extract_case_id(text)
+    report_match = REPORT_TYPE_PATTERN.search(text)
+    report_type = report_match.group(1).lower() if report_match else None
+    name_match = PATIENT_NAME_PATTERN.search(text)
+    patient_name = name_match.group(1) if name_match else None
+    if patient_name and patient_name.lower().startswith("case"):
+        patient_name = None
+
+    matched = [intent for intent, pattern in INTENT_KEYWORDS.items() if pattern.search(text)]
+
+    if "list_patients" in matched and not case_id and not report_type:
+        parsed.update(intent="list_patients", confidence=1.0)
+    elif "summarize_case" in matched and not report_type:
+        parsed.update(intent="summarize_case", case_id=case_id, confidence=1.0 if case_id else 0.5)
+    elif report_type and "show_report" in matched:
+        parsed.update(intent="show_report", case_id=case_id, report_type=report_type)
+        if case_id:
+            parsed["confidence"] = 1.0
+        elif patient_name:
+            # Name extraction from free text is heuristic; let Gemini double-check
+            parsed.update(patient_name=patient_name, confidence=0.6)
+        else:
+            parsed["confidence"] = 0.5
+    return parsed
+
+
+def get_parser_stats():
+    """How many commands were handled by the local rules vs. the Gemini fallback."""
+    with _parser_stats_lock:
+        stats = dict(_parser_stats)
+    total = stats["rules"] + stats["llm"]
+    stats["total"] = total
+    stats["llm_fallback_rate"] = stats["llm"] / total if total else 0.0
+    return stats
+
+
+def _record_parser(parser):
+    with _parser_stats_lock:
+        _parser_stats[parser] += 1
+
+
+def process_natural_language_command(command: str, driver=None):
     """
     Processes a natural language command to extract intent and entities,
     then generates and executes a Neo4j Cypher query.
 
+    The local rule-based parser is tried first; Gemini is only called when it
+    is not confident. The returned dict's "parser" key records which path
+    ("rules" or "llm") handled the command.
+
     Args:
         command (str): The natural language command from the user.
-        driver: Neo4j database driver.
+        driver: Neo4j database driver (defaults to the shared driver).
 
     Returns:
         dict: A dictionary containing success status, query, data, or error message.
     """
-    
+    command_parsed = parse_command_locally(command)
+    if command_parsed["confidence"] >= RULE_CONFIDENCE_THRESHOLD:
+        parser = "rules"
+    else:
+        parser = "llm"
+        command_parsed = _parse_command_with_gemini(command)
+    _record_parser(parser)
+    logger.info(f"Command parsed by {parser}: {command_parsed.get('intent')}")
+
+    if command_parsed.get("success") is False:
+        result = command_parsed
+    else:
+        result = _execute_parsed_command(command_parsed, driver)
+    result["parser"] = parser
+    return result
+
+
+def _parse_command_with_gemini(command: str):
+    """
+    Ask Gemini for the intent and entities of `command`.
+    Returns the parsed dict, or an error result dict with success=False.
+    """
     # Step 1: Use Gemini to parse the command and extract intent and entities
     # The prompt instructs Gemini to return a JSON object with intent and entities.
     parsing_prompt = f"""
@@ -57,7 +181,7 @@ def process_natural_language_command(command: str, driver):
         # Strip any leading/trailing whitespace that might remain
         gemini_response_text = gemini_response_text.strip()
 
-        command_parsed = json.loads(gemini_response_text)
+        return json.loads(gemini_response_text)
     except json.JSONDecodeError as e:
         # Include the raw response in the error message for debugging
         return {"success": False, "error": f"AI response was not valid JSON: {e}. Raw response: '{gemini_response_text}'", "suggestion": "Please try rephrasing your command more clearly. Ensure it's concise and specific."}
@@ -70,6 +194,9 @@ def process_natural_language_command(command: str, driver):
             "suggestion": "Ensure the command is clear and simple."
     }
 
+
+def _execute_parsed_command(command_parsed, driver):
+    """Build and run the Cypher query for an already parsed command."""
     intent = command_parsed.get("intent")
     case_id = command_parsed.get("case_id")
     report_type = command_parsed.get("report_type")
@@ -94,12 +221,6 @@ def process_natural_language_command(command: str, driver):
             params["patient_name"] = patient_name
         
         if report_type:
-            # Map common user-friendly report types to the types stored in your database
-            type_map = {
-                "lab": "lab", "lab report": "lab",
-                "scan": "scan", "x-ray": "scan", "chest x-ray": "scan", "mri": "scan", "ct scan": "scan",
-                "prescription": "prescription", "insight": "prescription", "clinical insight": "prescription"
-            }
             mapped_type = type_map.get(report_type.lower())
             if mapped_type:
                 where_clauses.append("r.type = $report_type")
@@ -113,30 +234,24 @@ def process_natural_language_command(command: str, driver):
         query_parts.append("RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at ORDER BY r.uploaded_at DESC")
         cypher_query = "\n".join(query_parts)
 
-        with driver.session() as session:
-            result = session.run(cypher_query, params)
-            data = result.data()
-            return {"success": True, "query": cypher_query, "data": data if data else []}
+        data = read(cypher_query, params, driver=driver)
+        return {"success": True, "query": cypher_query, "data": data if data else []}
 
     elif intent == "list_patients":
         cypher_query = "MATCH (p:Patient) RETURN p.id AS id, p.name AS name"
-        with driver.session() as session:
-            result = session.run(cypher_query)
-            data = result.data()
-            return {"success": True, "query": cypher_query, "data": data if data else []}
+        data = read(cypher_query, driver=driver)
+        return {"success": True, "query": cypher_query, "data": data if data else []}
 
     elif intent == "summarize_case":
         if not case_id:
             return {"success": False, "error": "Missing case ID for 'summarize case' command.", "suggestion": "Please specify a case ID (e.g., 'C010')."}
         
         cypher_query = "MATCH (c:Case {case_id: $case_id}) RETURN c.case_summary AS summary"
-        with driver.session() as session:
-            result = session.run(cypher_query, {"case_id": case_id})
-            summary_data = result.single()
-            if summary_data and summary_data["summary"]:
-                return {"success": True, "query": cypher_query, "data": {"summary": summary_data["summary"]}}
-            else:
-                return {"success": True, "query": cypher_query, "data": None, "error": "No summary found for this case.", "suggestion": "You might need to add a summary for this case."}
+        summary_data = read_single(cypher_query, {"case_id": case_id}, driver=driver)
+        if summary_data and summary_data["summary"]:
+            return {"success": True, "query": cypher_query, "data": {"summary": summary_data["summary"]}}
+        else:
+            return {"success": True, "query": cypher_query, "data": None, "error": "No summary found for this case.", "suggestion": "You might need to add a summary for this case."}
     
     elif intent == "unknown":
         error_msg = command_parsed.get("error", "Could not understand your command.")
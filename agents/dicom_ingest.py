@@ -0,0 +1,198 @@
+"""
+DICOM decoding for scans: metadata, windowing and rasterising for Gemini and thumbnails.
+
+- `read_header` parses only the header (no pixel data), for fast listings;
+  `fetch_header` reads just the first bytes of a stored blob when it can.
+- `rasterize` decodes lazily (large elements are deferred until needed and
+  only the selected frames are decoded), applies the modality LUT (e.g.
+  Hounsfield units) and the VOI window, picks representative slices of a
+  multi-frame series and renders them side by side as one PNG or JPEG.
+- `rasterize_in_pool` / `thumbnail_in_pool` run the heavy decodes in a
+  process pool, off the Streamlit and insight-fetch threads.
+"""
+import os
+from io import BytesIO
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+try:  # pydicom >= 3
+    from pydicom.pixels import apply_modality_lut, apply_voi_lut
+except ImportError:  # pydicom 2.x
+    from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
+
+from utils import blob_store
+from utils.process_pool import SpawnPool
+
+# === Configuration ===
+DICOM_MAX_SLICES = int(os.getenv("DICOM_MAX_SLICES", "3"))  # slices of a series shown to the model
+DICOM_DECODE_WORKERS = int(os.getenv("DICOM_DECODE_WORKERS", "2"))
+DICOM_DECODE_TIMEOUT = float(os.getenv("DICOM_DECODE_TIMEOUT", "60"))  # seconds
+DICOM_HEADER_BYTES = 64 * 1024  # enough for the header of nearly all files
+
+HEADER_FIELDS = (
+    "Modality", "BodyPartExamined", "StudyDescription", "SeriesDescription", "StudyDate",
+    "Rows", "Columns", "NumberOfFrames", "PhotometricInterpretation", "PixelSpacing",
+    "SliceThickness", "WindowCenter", "WindowWidth", "Manufacturer",
+)
+
+_decode_pool = SpawnPool(DICOM_DECODE_WORKERS, name="DICOM decode")
+
+
+def is_dicom(data):
+    """DICOM Part 10 files carry 'DICM' after a 128-byte preamble."""
+    return data[128:132] == b"DICM"
+
+
+def _plain(value):
+    """Header values as JSON-friendly Python types."""
+    if isinstance(value, pydicom.multival.MultiValue):
+        return [_plain(item) for item in value]
+    if isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def _header_fields(ds):
+    header = {field: _plain(ds.get(field)) for field in HEADER_FIELDS if ds.get(field) not in (None, "")}
+    header["NumberOfFrames"] = int(ds.get("NumberOfFrames") or 1)
+    return header
+
+
+def read_header(data):
+    """Header fields of a DICOM file without reading its pixel data."""
+    return _header_fields(pydicom.dcmread(BytesIO(data), stop_before_pixels=True, force=True))
+
+
+def fetch_header(url):
+    """Header of a stored DICOM blob, downloading only its first bytes when the filer honours ranges."""
+    response = blob_store.download(url, headers={"Range": f"bytes=0-{DICOM_HEADER_BYTES - 1}"})
+    response.raise_for_status()
+    try:
+        return read_header(response.content)
+    except Exception:
+        if response.status_code != 206:
+            raise
+        # Header longer than the range: fall back to the whole file
+        full = blob_store.download(url)
+        full.raise_for_status()
+        return read_header(full.content)
+
+
+def representative_frames(frame_count, max_slices=DICOM_MAX_SLICES):
+    """Evenly spaced frame indices, always including the middle slice."""
+    if frame_count <= max_slices:
+        return list(range(frame_count))
+    if max_slices == 1:
+        return [frame_count // 2]
+    step = (frame_count - 1) / (max_slices - 1)
+    indices = {round(i * step) for i in range(max_slices)}
+    indices.add(frame_count // 2)
+    # Replace the index closest to the middle so the count stays at max_slices
+    if len(indices) > max_slices:
+        indices.discard(min(indices - {frame_count // 2}, key=lambda i: abs(i - frame_count // 2)))
+    return sorted(indices)
+
+
+def _decode_frame(ds, index, frame_count):
+    """Pixel array of one frame, decoding only that frame where pydicom supports it."""
+    try:
+        from pydicom.pixels import pixel_array  # pydicom >= 3 decodes a single frame
+        return pixel_array(ds, index=index) if frame_count > 1 else pixel_array(ds)
+    except ImportError:
+        pixels = ds.pixel_array
+        return pixels[index] if frame_count > 1 else pixels
+
+
+def _first(value):
+    """First value of a possibly multi-valued element (e.g. several window presets)."""
+    return float(value[0] if isinstance(value, pydicom.multival.MultiValue) else value)
+
+
+def _window(ds, pixels):
+    """Modality LUT, then VOI window (header window or 1st-99th percentile), scaled to uint8."""
+    if ds.get("PhotometricInterpretation", "").startswith(("RGB", "YBR")) or pixels.ndim == 3:
+        return pixels.astype(np.uint8) if pixels.dtype != np.uint8 else pixels
+
+    values = apply_modality_lut(pixels, ds)
+    if "VOILUTSequence" in ds:
+        # LUT output spans its descriptor's bit depth, not the slice's extremes
+        values = apply_voi_lut(values, ds, index=0)
+        low, high = 0.0, float(2 ** int(ds.VOILUTSequence[0].LUTDescriptor[2]) - 1)
+    elif "WindowCenter" in ds and "WindowWidth" in ds:
+        center, width = _first(ds.WindowCenter), _first(ds.WindowWidth)
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = np.percentile(values, (1, 99))
+    scaled = np.clip((values.astype(np.float32) - low) / max(high - low, 1e-6), 0, 1) * 255
+    image = scaled.astype(np.uint8)
+    if ds.get("PhotometricInterpretation") == "MONOCHROME1":
+        image = 255 - image  # MONOCHROME1 stores bright as low values
+    return image
+
+
+def _montage(images):
+    """Slices side by side, scaled to a common height."""
+    height = min(image.height for image in images)
+    resized = [image.resize((round(image.width * height / image.height), height)) for image in images]
+    montage = Image.new(resized[0].mode, (sum(image.width for image in resized), height))
+    x = 0
+    for image in resized:
+        montage.paste(image, (x, 0))
+        x += image.width
+    return montage
+
+
+def rasterize(data, image_format="PNG", max_slices=DICOM_MAX_SLICES, max_edge=None):
+    """
+    Render a DICOM file as image bytes. Returns (bytes, info) where info holds
+    the header fields, the frames used and the series' frame count.
+    """
+    ds = pydicom.dcmread(BytesIO(data), defer_size="1 KB", force=True)
+    frame_count = int(ds.get("NumberOfFrames") or 1)
+    frames = representative_frames(frame_count, max_slices)
+
+    images = []
+    for index in frames:
+        pixels = _window(ds, _decode_frame(ds, index, frame_count))
+        images.append(Image.fromarray(pixels).convert("RGB" if pixels.ndim == 3 else "L"))
+    image = _montage(images) if len(images) > 1 else images[0]
+    if max_edge and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buffer = BytesIO()
+    if image_format.upper() == "JPEG":
+        image.save(buffer, format="JPEG", quality=85, optimize=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+
+    return buffer.getvalue(), {"header": _header_fields(ds), "frames": frames, "frame_count": frame_count}
+
+
+def thumbnail(data, size=256):
+    """Small JPEG of the middle slice for listings."""
+    thumb, _ = rasterize(data, image_format="JPEG", max_slices=1, max_edge=size)
+    return thumb
+
+
+def describe(info):
+    """One line for the prompt, e.g. 'CT CHEST, slices 1, 60, 120 of 120'."""
+    header = info["header"]
+    parts = [" ".join(str(header[field]) for field in ("Modality", "BodyPartExamined") if header.get(field))]
+    if header.get("SeriesDescription"):
+        parts.append(str(header["SeriesDescription"]))
+    if info["frame_count"] > 1:
+        parts.append(f"slices {', '.join(str(i + 1) for i in info['frames'])} of {info['frame_count']} shown left to right")
+    return ", ".join(part for part in parts if part)
+
+
+# === Process pool ===
+def rasterize_in_pool(data, image_format="PNG", max_slices=DICOM_MAX_SLICES):
+    """`rasterize` in the decode process pool."""
+    return _decode_pool.run(rasterize, data, image_format, max_slices, timeout=DICOM_DECODE_TIMEOUT)
+
+
+def thumbnail_in_pool(data, size=256):
+    """`thumbnail` in the decode process pool."""
+    return _decode_pool.run(thumbnail, data, size, timeout=DICOM_DECODE_TIMEOUT)
@@ -1,36 +1,43 @@
-import fitz  # PyMuPDF
 import pandas as pd
 from PIL import Image
 import base64
 import mimetypes
 
+from agents.image_preprocess import preprocess_image
+from agents.lab_parser import structure_lab_table
+from agents.pdf_extractor import extract_pdf_text
+
 def extract_text_from_pdf(uploaded_file):
-    pdf_text = ""
-    doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-    for page in doc:
-        pdf_text += page.get_text()
-    return pdf_text
+    uploaded_file.seek(0)
+    return extract_pdf_text(uploaded_file.read())
 
 def parse_lab_file(file):
     if file.name.endswith('.csv'):
-        df = pd.read_csv(file)
-        return df.to_string(index=False)
+        df = pd.read_csv(file, dtype=str)
+        return structure_lab_table(df)["text"]
     elif file.name.endswith('.pdf'):
         return extract_text_from_pdf(file)
     return None
 
-def encode_image(file_like):
-    import base64
-    import mimetypes
-
+def encode_image(file_like, preprocess=True):
+    """
+    Inline image part for Gemini. With `preprocess`, the image is oriented,
+    downsized and re-encoded first (see agents.image_preprocess); files Pillow
+    cannot decode are sent unchanged.
+    """
     filename = getattr(file_like, "name", "file.png")
     mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
     file_like.seek(0)
-    encoded = base64.b64encode(file_like.read()).decode("utf-8")
+    data = file_like.read()
+    if preprocess:
+        try:
+            data, mime_type, _ = preprocess_image(data)
+        except Exception as e:
+            print(f"Image preprocessing skipped for {filename}: {e}")
+    encoded = base64.b64encode(data).decode("utf-8")
     return {
         "inline_data": {
             "mime_type": mime_type,
             "data": encoded
         }
     }
-
@@ -1,94 +1,330 @@
+import hashlib
 import os
-import json
-from datetime import datetime
+import threading
+import time
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 import google.generativeai as genai
 from agents.pdf_exporter import generate_pdf_and_save
+from agents.resilience import DeadlineExceededError, ResilientCaller
+from agents.response_cache import ResponseCache, make_cache_key
+from agents.tokens import estimate_request_tokens
+from utils.feedback_store import get_feedback_store
+from utils.single_flight import SingleFlight
 
 # === Configuration ===
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-2.5-flash")
-FEEDBACK_FILE = "feedback_store.jsonl"
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+# Point at a local fake server (e.g. python fake_gemini_server.py) to exercise retries and the breaker
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+if GEMINI_API_ENDPOINT:
+    genai.configure(
+        api_key=os.getenv("GEMINI_API_KEY") or "fake-key",
+        transport="rest",
+        client_options={"api_endpoint": GEMINI_API_ENDPOINT},
+    )
+else:
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+# Shared across sessions so repeated prompts are answered without an API call
+response_cache = ResponseCache()
+# PDF URLs of exported answers, kept apart so they never evict cached answers from the LRU
+pdf_url_cache = ResponseCache(table="gemini_pdf_url_cache")
+
+SAFETY_NOTE = " (Safety reasons: "  # appended by _generate_text when Gemini reports safety feedback
+
+# Rate limits, retries with backoff, per-call deadlines and a circuit breaker for every API call
+gemini_resilience = ResilientCaller()
+
+# Identical concurrent requests (same prompt and images) share one API call;
+# set SINGLE_FLIGHT_DB to also de-duplicate across processes
+gemini_flights = SingleFlight()
+if gemini_flights.db_path and not response_cache.db_path:
+    # A process waiting on another's lease reads the result from the on-disk cache tier;
+    # without one it finds nothing and repeats the call.
+    logger.warning("SINGLE_FLIGHT_DB is set without GEMINI_CACHE_DB: identical calls are only shared within a process.")
+
+# Caps concurrent Gemini requests per process (UI sessions and background jobs alike).
+# A slot is held per attempt only, so a call sleeping before a retry doesn't block others.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "2"))
+_gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+
+def set_gemini_concurrency(limit):
+    """Change the per-process cap (e.g. from a batch CLI) before any calls are in flight."""
+    global _gemini_slots
+    _gemini_slots = threading.BoundedSemaphore(max(1, limit))
+
+
+def set_gemini_rate_limits(requests_per_minute=None, tokens_per_minute=None):
+    """Override GEMINI_RPM / GEMINI_TPM for this process (None keeps a limit, 0 removes it)."""
+    gemini_resilience.limiter.configure(requests_per_minute, tokens_per_minute)
+
+
+def _acquire_slot(timeout):
+    """Wait for a concurrency slot; returns the semaphore to release and the seconds left of `timeout`."""
+    slots = _gemini_slots  # set_gemini_concurrency may replace it; release the one acquired
+    started = time.monotonic()
+    if not slots.acquire(timeout=max(0.0, timeout)):
+        raise DeadlineExceededError("No free Gemini slot before the call deadline.")
+    return slots, timeout - (time.monotonic() - started)
+
+
+def _in_slot(fn):
+    """Wrap `fn(timeout)` for `gemini_resilience.call` so each attempt holds a slot while it runs."""
+    def attempt(timeout):
+        slots, remaining = _acquire_slot(timeout)
+        try:
+            return fn(remaining)
+        finally:
+            slots.release()
+    return attempt
 
 
 # === MAIN FUNCTION ===
-def call_gemini(prompt_text, images=None, case_id=None, doctor_id=None):
+def call_gemini(prompt_text, images=None, case_id=None, doctor_id=None, use_cache=True):
     """
     Call Gemini API and optionally generate PDF and return feedback.
     Handles empty responses or safety blocks from Gemini.
+
+    Successful responses are cached by a hash of the prompt, the image
+    payloads and the model name; answers carrying safety feedback are not.
+    Pass use_cache=False to bypass the cached answer and force a fresh API
+    call (the fresh answer is still stored).
+    Concurrent identical requests wait for the one already in flight.
     """
     parts = [{"text": prompt_text}]
     if images:
         parts.extend(images)
 
     gemini_text = "❌ Gemini returned no output." # Default error message
-    pdf_url = None
-    feedback = None
+    cache_key = make_cache_key(prompt_text, images, GEMINI_MODEL_NAME)
 
     try:
-        response = model.generate_content(parts)
-
-        # === Robust Response Parsing ===
-        if response.text: # Simplest case: direct text attribute
-            gemini_text = response.text
-        elif response.candidates: # Check if there are any candidates
-            # Ensure candidates list is not empty before accessing index 0
-            if response.candidates[0].content and response.candidates[0].content.parts:
-                # Check if the parts list is not empty and has text
-                if response.candidates[0].content.parts[0].text:
-                    gemini_text = response.candidates[0].content.parts[0].text
-                else:
-                    gemini_text = "❌ Gemini returned empty content part."
-            else:
-                gemini_text = "❌ Gemini candidate has no content or parts."
+        cached_text = response_cache.get(cache_key) if use_cache else None
+        if cached_text is not None:
+            gemini_text = cached_text
         else:
-            gemini_text = "❌ Gemini returned no candidates."
+            def generate():
+                text = _generate_text(parts, estimate_request_tokens(prompt_text, images))
+                if not text.startswith("❌") and SAFETY_NOTE not in text:
+                    response_cache.set(cache_key, text)
+                return text
 
-        # Log safety feedback if any, regardless of whether text was generated
-        if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-            # You might want more detailed logging for safety_ratings
-            logger.warning(f"Gemini prompt_feedback: {response.prompt_feedback}")
-            if response.prompt_feedback.safety_ratings:
-                gemini_text += f" (Safety reasons: {response.prompt_feedback.safety_ratings})"
+            gemini_text, shared = gemini_flights.do(cache_key, generate, lookup=lambda: response_cache.get(cache_key))
+            if shared:
+                logger.info(f"Gemini request for case {case_id} shared an identical in-flight call.")
 
+        return _finish_result(gemini_text, case_id, doctor_id, cached=cached_text is not None)
 
-        pdf_url = None
-        if case_id and gemini_text and not gemini_text.startswith("❌"):
+    except Exception as e:
+        return {
+            "text": f"❌ Gemini API Error: {str(e)}",
+            "pdf_url": None,
+            "pdf": None,
+            "feedback": None,
+            "cached": False
+        }
+
+
+def _pdf_cache_key(case_id, gemini_text):
+    return "pdf:" + hashlib.sha256(f"{case_id}\x00{gemini_text}".encode("utf-8")).hexdigest()
+
+
+def _finish_result(gemini_text, case_id, doctor_id, cached=False):
+    """
+    Export the PDF for a successful answer and attach stored feedback. The
+    PDF URL is cached with the answer, so repeating an answer (cache hit or
+    shared in-flight call) for the same case returns the stored PDF instead
+    of uploading another one.
+    """
+    pdf_url = None
+    pdf = None
+    if case_id and gemini_text and not gemini_text.startswith("❌"):
+        pdf_key = _pdf_cache_key(case_id, gemini_text)
+        pdf_url = pdf_url_cache.get(pdf_key)
+        if pdf_url is None:
             try:
-                pdf_url = generate_pdf_and_save(case_id, gemini_text)
+                pdf = generate_pdf_and_save(case_id, gemini_text)
+                pdf_url = pdf["url"]
+                if pdf_url:
+                    pdf_url_cache.set(pdf_key, pdf_url)
             except Exception as pdf_error:
                 print(f"PDF generation failed: {pdf_error}")
 
-        feedback = get_feedback_from_file(case_id, doctor_id) if case_id and doctor_id else None
+    feedback = get_feedback_from_file(case_id, doctor_id) if case_id and doctor_id else None
 
-        return {
-            "text": gemini_text,
-            "pdf_url": pdf_url,
-            "feedback": feedback
-        }
+    return {
+        "text": gemini_text,
+        "pdf_url": pdf_url,
+        "pdf": pdf,  # size_bytes, render_ms, upload_ms of the exported PDF (None when reused)
+        "feedback": feedback,
+        "cached": cached
+    }
 
-    except Exception as e:
-        return {
-            "text": f"❌ Gemini API Error: {str(e)}",
-            "pdf_url": None,
-            "feedback": None
-        }
+
+class GeminiStream:
+    """
+    Iterate to receive the response text chunk by chunk; once iteration
+    finishes, `result` holds the same dict `call_gemini` returns (full text,
+    PDF export, feedback, cached flag) and `error` the exception behind an
+    error result, if any.
+    """
+
+    def __init__(self, prompt_text, images=None, case_id=None, doctor_id=None, use_cache=True):
+        self.prompt_text = prompt_text
+        self.images = images
+        self.case_id = case_id
+        self.doctor_id = doctor_id
+        self.use_cache = use_cache
+        self.result = None
+        self.error = None
+
+    def __iter__(self):
+        parts = [{"text": self.prompt_text}]
+        if self.images:
+            parts.extend(self.images)
+        cache_key = make_cache_key(self.prompt_text, self.images, GEMINI_MODEL_NAME)
+
+        try:
+            cached_text = response_cache.get(cache_key) if self.use_cache else None
+            if cached_text is not None:
+                yield cached_text
+                self.result = _finish_result(cached_text, self.case_id, self.doctor_id, cached=True)
+                return
+
+            with gemini_flights.flight(cache_key, lookup=lambda: response_cache.get(cache_key)) as (flight, leader):
+                if not leader:
+                    # An identical request is already in flight: receive its full text when it completes
+                    gemini_text = flight.wait()
+                    yield gemini_text
+                else:
+                    chunks = []
+                    blocked = False
+                    # Retries only cover opening the stream; a failure after text was shown is reported as-is
+                    slots, response, first_chunk = gemini_resilience.call(
+                        lambda timeout: _open_stream_in_slot(parts, timeout),
+                        tokens=estimate_request_tokens(self.prompt_text, self.images),
+                    )
+                    try:
+                        for chunk in _chain_first(first_chunk, response):
+                            try:
+                                text = chunk.text
+                            except ValueError:
+                                # Chunk without text (e.g. blocked by safety filters)
+                                logger.warning(f"Gemini stream chunk without text: {getattr(chunk, 'prompt_feedback', None)}")
+                                blocked = True
+                                continue
+                            if text:
+                                chunks.append(text)
+                                yield text
+                    finally:
+                        slots.release()  # held from opening the stream until the last chunk
+
+                    gemini_text = "".join(chunks) or "❌ Gemini returned no output."
+                    if not gemini_text.startswith("❌") and not blocked:  # don't keep an answer cut by safety filters
+                        response_cache.set(cache_key, gemini_text)
+                    flight.resolve(gemini_text)
+            self.result = _finish_result(gemini_text, self.case_id, self.doctor_id)
+
+        except Exception as e:
+            self.error = e
+            self.result = {
+                "text": f"❌ Gemini API Error: {str(e)}",
+                "pdf_url": None,
+                "pdf": None,
+                "feedback": None,
+                "cached": False
+            }
+
+
+def call_gemini_stream(prompt_text, images=None, case_id=None, doctor_id=None, use_cache=True):
+    """Streaming variant of `call_gemini`; see GeminiStream."""
+    return GeminiStream(prompt_text, images, case_id, doctor_id, use_cache)
+
+
+def get_cache_stats():
+    """Hit/miss counters of the shared Gemini response cache."""
+    return response_cache.stats()
+
+
+def get_resilience_stats():
+    """Circuit breaker state, rate limiter headroom and retry counters of the Gemini client."""
+    return gemini_resilience.state()
+
+
+def get_single_flight_stats():
+    """How many Gemini calls led, and how many shared an identical in-flight call."""
+    return gemini_flights.stats()
+
+
+def _open_stream(parts, timeout):
+    """Start a streaming request and wait for its first chunk, so connection and quota errors surface here."""
+    response = iter(model.generate_content(parts, stream=True, request_options={"timeout": timeout}))
+    return response, next(response, None)
+
+
+def _open_stream_in_slot(parts, timeout):
+    """`_open_stream` holding a concurrency slot; on success the caller releases it after the last chunk."""
+    slots, remaining = _acquire_slot(timeout)
+    try:
+        return (slots, *_open_stream(parts, remaining))
+    except BaseException:
+        slots.release()
+        raise
+
+
+def _chain_first(first_chunk, response):
+    if first_chunk is None:
+        return
+    yield first_chunk
+    try:
+        yield from response
+    except Exception:
+        gemini_resilience.breaker.record_failure()
+        raise
+
+
+def _generate_text(parts, tokens=0):
+    """Send `parts` to Gemini and extract the response text."""
+    gemini_text = "❌ Gemini returned no output."
+    response = gemini_resilience.call(
+        _in_slot(lambda timeout: model.generate_content(parts, request_options={"timeout": timeout})),
+        tokens=tokens,
+    )
+
+    # === Robust Response Parsing ===
+    if response.text: # Simplest case: direct text attribute
+        gemini_text = response.text
+    elif response.candidates: # Check if there are any candidates
+        # Ensure candidates list is not empty before accessing index 0
+        if response.candidates[0].content and response.candidates[0].content.parts:
+            # Check if the parts list is not empty and has text
+            if response.candidates[0].content.parts[0].text:
+                gemini_text = response.candidates[0].content.parts[0].text
+            else:
+                gemini_text = "❌ Gemini returned empty content part."
+        else:
+            gemini_text = "❌ Gemini candidate has no content or parts."
+    else:
+        gemini_text = "❌ Gemini returned no candidates."
+
+    # Log safety feedback if any, regardless of whether text was generated
+    if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
+        # You might want more detailed logging for safety_ratings
+        logger.warning(f"Gemini prompt_feedback: {response.prompt_feedback}")
+        if response.prompt_feedback.safety_ratings:
+            gemini_text += f"{SAFETY_NOTE}{response.prompt_feedback.safety_ratings})"
+
+    return gemini_text
 
 
 # === FEEDBACK STORE ===
 def store_feedback_to_file(case_id, doctor_id, is_good):
-    entry = {
-        "case_id": case_id,
-        "doctor_id": doctor_id,
-        "is_good": is_good,
-        "timestamp": datetime.now().isoformat()
-    }
     try:
-        with open(FEEDBACK_FILE, "a") as f:
-            f.write(json.dumps(entry) + "\n")
+        get_feedback_store().add(case_id, doctor_id, is_good)
         return True
     except Exception as e:
         print(f"Error writing feedback: {e}")
@@ -96,18 +332,12 @@ def store_feedback_to_file(case_id, doctor_id, is_good):
 
 
 def get_feedback_from_file(case_id, doctor_id):
+    """Latest feedback of `doctor_id` on `case_id` ({is_good, timestamp}) or None."""
     try:
-        with open(FEEDBACK_FILE, "r") as f:
-            for line in f:
-                entry = json.loads(line)
-                if entry["case_id"] == case_id and entry["doctor_id"] == doctor_id:
-                    return {
-                        "is_good": entry["is_good"],
-                        "timestamp": entry["timestamp"]
-                    }
-    except FileNotFoundError:
+        return get_feedback_store().latest(case_id, doctor_id)
+    except Exception as e:
+        print(f"Error reading feedback: {e}")
         return None
-    return None
 
 
 # === OPTIONAL: Send feedback to Gemini (Learning loop) ===
@@ -120,7 +350,10 @@ def send_feedback_to_gemini(feedback_prompt, is_positive=True):
         )
         full_prompt = f"{system_prompt}\n\n{feedback_prompt}"
 
-        response = model.generate_content(full_prompt)
+        response = gemini_resilience.call(
+            _in_slot(lambda timeout: model.generate_content(full_prompt, request_options={"timeout": timeout})),
+            tokens=estimate_request_tokens(full_prompt),
+        )
         response_text = response.text if hasattr(response, 'text') else response.candidates[0].content.parts[0].text
 
         logger.info(f"[GEMINI FEEDBACK - {'POSITIVE' if is_positive else 'NEGATIVE'}] {response_text[:100]}...")
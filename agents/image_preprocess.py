@@ -0,0 +1,175 @@
+"""
+Downsizing and re-encoding of scan images before they are sent inline to Gemini.
+
+Full-resolution PNG scans can be several megabytes each, most of which the
+model never uses. `preprocess_image` applies the EXIF orientation, caps the
+longest edge, converts images that carry no colour information to grayscale
+and re-encodes as JPEG or WebP. Results are cached by a hash of the source
+bytes and the settings (in memory, plus on disk when SCAN_CACHE_DIR is set).
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# === Configuration ===
+SCAN_MAX_EDGE = int(os.getenv("SCAN_MAX_EDGE", "1536"))  # pixels on the longest side
+SCAN_OUTPUT_FORMAT = os.getenv("SCAN_OUTPUT_FORMAT", "JPEG").upper()  # JPEG | WEBP
+SCAN_QUALITY = int(os.getenv("SCAN_QUALITY", "85"))
+SCAN_GRAYSCALE = os.getenv("SCAN_GRAYSCALE", "auto")  # auto | always | never
+SCAN_CACHE_ENTRIES = int(os.getenv("SCAN_CACHE_ENTRIES", "64"))
+SCAN_CACHE_DIR = os.getenv("SCAN_CACHE_DIR")  # optional on-disk tier
+
+GRAYSCALE_TOLERANCE = 8  # max per-pixel channel difference still treated as gray
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_cache = OrderedDict()  # cache key -> (bytes, mime_type, report)
+_cache_lock = threading.Lock()
+_stats = {"images": 0, "cache_hits": 0, "original_bytes": 0, "processed_bytes": 0}
+_stats_lock = threading.Lock()
+
+
+def _settings_key():
+    return f"{SCAN_MAX_EDGE}:{SCAN_OUTPUT_FORMAT}:{SCAN_QUALITY}:{SCAN_GRAYSCALE}"
+
+
+def _is_effectively_grayscale(img):
+    """True when the R, G and B channels are (nearly) identical everywhere."""
+    if img.mode in ("1", "L", "LA", "I", "I;16", "I;16B", "I;16L", "F"):
+        return True
+    sample = img.convert("RGB")
+    sample.thumbnail((256, 256))
+    red, green, blue = sample.split()
+    return (ImageChops.difference(red, green).getextrema()[1] <= GRAYSCALE_TOLERANCE
+            and ImageChops.difference(green, blue).getextrema()[1] <= GRAYSCALE_TOLERANCE)
+
+
+def _to_8bit(img):
+    """Scale 16-bit / float images into 0-255 so they can be saved as JPEG or WebP."""
+    if img.mode.startswith("I;16"):
+        img = img.convert("I")
+    low, high = img.getextrema()
+    scale = 255.0 / (high - low) if high > low else 1.0
+    return img.point(lambda value: value * scale + (-low * scale)).convert("L")
+
+
+def _flatten(img):
+    """Drop alpha by compositing onto black, the background of a scan."""
+    if img.mode == "P":
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new(img.mode[:-1], img.size, 0)
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img
+
+
+def _process(data):
+    with Image.open(BytesIO(data)) as opened:
+        source_format = opened.format
+        img = ImageOps.exif_transpose(opened)
+        img.load()
+    original_size = img.size
+
+    if img.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+        img = _to_8bit(img)
+    img = _flatten(img)
+
+    grayscale = SCAN_GRAYSCALE == "always" or (SCAN_GRAYSCALE == "auto" and _is_effectively_grayscale(img))
+    img = img.convert("L" if grayscale else "RGB")
+
+    if max(img.size) > SCAN_MAX_EDGE:
+        img.thumbnail((SCAN_MAX_EDGE, SCAN_MAX_EDGE), Image.LANCZOS)
+
+    output_format = SCAN_OUTPUT_FORMAT if SCAN_OUTPUT_FORMAT in MIME_TYPES else "JPEG"
+    buffer = BytesIO()
+    img.save(buffer, format=output_format, quality=SCAN_QUALITY, optimize=True)
+    processed = buffer.getvalue()
+    mime_type = MIME_TYPES[output_format]
+
+    # An already-small JPEG/WebP that re-encoding would not shrink is sent as-is
+    if len(processed) >= len(data) and source_format in MIME_TYPES and max(original_size) <= SCAN_MAX_EDGE:
+        processed, mime_type = data, MIME_TYPES[source_format]
+
+    report = {
+        "original_bytes": len(data),
+        "processed_bytes": len(processed),
+        "original_size": original_size,
+        "processed_size": img.size,
+        "format": mime_type,
+        "grayscale": grayscale,
+    }
+    return processed, mime_type, report
+
+
+def _disk_path(key):
+    return os.path.join(SCAN_CACHE_DIR, key) if SCAN_CACHE_DIR else None
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            return entry
+    path = _disk_path(key)
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            processed = f.read()
+        mime_type = "image/webp" if processed[8:12] == b"WEBP" else "image/jpeg"
+        return processed, mime_type, None
+    return None
+
+
+def _cache_set(key, entry):
+    with _cache_lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > SCAN_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    path = _disk_path(key)
+    if path:
+        os.makedirs(SCAN_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(entry[0])
+        os.replace(tmp_path, path)
+
+
+def preprocess_image(data):
+    """
+    Return (bytes, mime_type, report) for raw image bytes; `report` holds the
+    before/after byte counts and dimensions. Raises if Pillow cannot decode it.
+    """
+    key = hashlib.sha256(data).hexdigest() + "-" + hashlib.sha256(_settings_key().encode()).hexdigest()[:12]
+    entry = _cache_get(key)
+    cached = entry is not None
+    if not cached:
+        entry = _process(data)
+        _cache_set(key, entry)
+
+    processed, mime_type, report = entry
+    report = dict(report or {"original_bytes": len(data), "processed_bytes": len(processed), "format": mime_type})
+    report["cached"] = cached
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["cache_hits"] += int(cached)
+        _stats["original_bytes"] += len(data)
+        _stats["processed_bytes"] += len(processed)
+    logger.info(
+        f"Scan image {report['original_bytes'] / 1024:.0f} KB -> {report['processed_bytes'] / 1024:.0f} KB"
+        f" ({mime_type}{', cached' if cached else ''})"
+    )
+    return processed, mime_type, report
+
+
+def get_preprocess_stats():
+    """Totals since startup: images, cache hits and bytes before/after preprocessing."""
+    with _stats_lock:
+        return dict(_stats)
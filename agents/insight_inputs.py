@@ -0,0 +1,112 @@
+"""
+Concurrent loading of the lab report and scan that feed a multimodal insight.
+
+The lab download + parse and the scan download + encode run in parallel on a
+shared thread pool, bounded by an overall deadline. Whatever finishes in time
+is used; anything that fails or times out is reported in `errors` so the
+prompt can still be built from the remaining inputs. Downloads go through the
+local blob cache, so re-analysing a case usually skips the network.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+
+from agents import dicom_ingest
+from agents.file_parser import encode_image, parse_lab_file
+from utils import blob_cache, blob_store
+
+# === Configuration ===
+INSIGHT_FETCH_DEADLINE = float(os.getenv("INSIGHT_FETCH_DEADLINE", "30"))  # seconds for all inputs
+INSIGHT_FETCH_WORKERS = int(os.getenv("INSIGHT_FETCH_WORKERS", "8"))
+
+# Shared across sessions; one insight only ever needs two slots
+_executor = ThreadPoolExecutor(max_workers=INSIGHT_FETCH_WORKERS, thread_name_prefix="insight-fetch")
+
+
+def load_lab_data(url):
+    """Download a lab report (CSV or PDF) and return its parsed text."""
+    file = BytesIO(blob_cache.fetch(url))
+    file.name = blob_store.name_from_url(url)
+    return parse_lab_file(file)
+
+
+def load_scan_image(url):
+    """Download a scan and return (inline image part, description); DICOM is windowed and rasterised to PNG."""
+    file_content = blob_cache.fetch(url)
+
+    if dicom_ingest.is_dicom(file_content):
+        png, info = dicom_ingest.rasterize_in_pool(file_content)
+        buffered = BytesIO(png)
+        buffered.name = "scan.png"
+        details = dicom_ingest.describe(info)
+        return encode_image(buffered), f"Radiology scan (DICOM{': ' + details if details else ''}) image attached."
+
+    # Treat as standard image (jpg, jpeg, png)
+    return encode_image(BytesIO(file_content)), "Radiology scan (image) attached."
+
+
+def input_fingerprint(summary, lab_url=None, scan_url=None):
+    """
+    Fingerprint of everything an insight is generated from: a hash of the
+    summary plus the URL and ETag (or Last-Modified) of each report used.
+    A report replaced under the same URL changes its ETag, and so the
+    fingerprint.
+    """
+    material = {"summary_sha256": hashlib.sha256((summary or "").encode("utf-8")).hexdigest()}
+    for name, url in (("lab", lab_url), ("scan", scan_url)):
+        if not url:
+            continue
+        try:
+            meta = blob_store.metadata(url) or {}
+        except Exception:
+            meta = {}  # filer unreachable: fall back to the URL alone
+        material[name] = {"url": url, "version": meta.get("etag") or meta.get("last_modified")}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prefetch_insight_inputs(latest_lab=None, latest_scan=None, deadline=INSIGHT_FETCH_DEADLINE):
+    """
+    Load the latest lab and scan reports concurrently.
+
+    Returns a dict with lab_data, scan_image, scan_description, errors
+    (input name -> message) and timings (ms per input and in total).
+    """
+    started = time.perf_counter()
+    result = {"lab_data": None, "scan_image": None, "scan_description": None, "errors": {}, "timings": {}}
+
+    def timed(name, loader, url):
+        task_started = time.perf_counter()
+        try:
+            return loader(url)
+        finally:
+            result["timings"][name] = (time.perf_counter() - task_started) * 1000
+
+    futures = {}
+    if latest_lab:
+        futures["lab"] = _executor.submit(timed, "lab", load_lab_data, latest_lab["url"])
+    if latest_scan:
+        futures["scan"] = _executor.submit(timed, "scan", load_scan_image, latest_scan["url"])
+
+    if futures:
+        wait(futures.values(), timeout=deadline)
+
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            result["errors"][name] = f"Timed out after {deadline:.0f}s."
+            continue
+        try:
+            value = future.result()
+        except Exception as e:
+            result["errors"][name] = str(e)
+            continue
+        if name == "lab":
+            result["lab_data"] = value
+        else:
+            result["scan_image"], result["scan_description"] = value
+
+    result["timings"]["total"] = (time.perf_counter() - started) * 1000
+    return result
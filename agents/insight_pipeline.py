@@ -0,0 +1,133 @@
+"""
+The multimodal insight pipeline as a background job.
+
+A job loads the latest lab and scan inputs, builds the prompt, streams the
+Gemini answer (publishing the partial text as job progress so the page can
+render sections while it is generated), exports the PDF and links it to the
+case in Neo4j. The Streamlit page only submits the job and polls it.
+
+Each stored insight carries the fingerprint of its inputs; unless the doctor
+forces a refresh, a job whose inputs match a stored insight returns that
+insight and PDF instead of calling Gemini again.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from agents.gemini_agent import call_gemini_stream
+from agents.insight_inputs import input_fingerprint, prefetch_insight_inputs
+from agents.prompt_builder import build_budgeted_prompt
+from agents.resilience import is_retryable
+from utils.job_queue import JobFailed, get_job_queue
+from utils.neo4j_repository import find_insight_by_fingerprint, link_uploaded_report
+
+# === Configuration ===
+# Each attempt already retries transient API errors (GEMINI_MAX_ATTEMPTS), so the
+# queue only adds a late retry for errors that outlast those
+INSIGHT_JOB_MAX_ATTEMPTS = int(os.getenv("INSIGHT_JOB_MAX_ATTEMPTS", "2"))
+
+INSIGHT_JOB_KIND = "insight"
+PROGRESS_INTERVAL = 0.5  # seconds between partial-text writes to the job table
+
+
+def run_insight_job(payload, job):
+    """Job handler: generate, export and link the clinical insight for one case."""
+    case_id = payload["case_id"]
+    fingerprint = payload.get("fingerprint")
+    force = payload.get("force", False)
+
+    if fingerprint and not force:
+        stored = find_insight_by_fingerprint(case_id, fingerprint)
+        if stored:
+            return {
+                "text": stored["text"],
+                "pdf_url": stored["url"],
+                "cached": False,
+                "reused": True,
+                "reused_from": stored["uploaded_at"],
+                "prompt": {"total_tokens": stored["prompt_tokens"], "trimmed": stored["prompt_trimmed"] or []},
+                "input_errors": {},
+                "timings": {},
+            }
+
+    inputs = prefetch_insight_inputs(payload.get("latest_lab"), payload.get("latest_scan"))
+    job.check_cancelled()
+
+    scan_image = inputs["scan_image"]
+    prompt, prompt_report = build_budgeted_prompt(
+        payload.get("summary") or "", inputs["lab_data"], inputs["scan_description"] if scan_image else None
+    )
+
+    stream = call_gemini_stream(
+        prompt, images=[scan_image] if scan_image else [], case_id=case_id, doctor_id=payload.get("doctor_id"),
+        use_cache=not force,
+    )
+    text = ""
+    last_progress = 0.0
+    for chunk in stream:
+        text += chunk
+        if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            job.update_progress(text)
+            last_progress = time.monotonic()
+            job.check_cancelled()
+
+    result = stream.result
+    if not result["text"] or result["text"].startswith("❌"):
+        if stream.error is not None and is_retryable(stream.error):
+            raise RuntimeError(result["text"])  # transient API error: let the queue retry later
+        # Safety blocks, empty answers, an open circuit or a bad request won't succeed on retry
+        raise JobFailed(result["text"] or "❌ Gemini returned no output.")
+
+    if result["pdf_url"]:
+        link_uploaded_report(case_id, result["pdf_url"], "prescription", {
+            "insight_text": result["text"],
+            "input_fingerprint": fingerprint,
+            "prompt_tokens": prompt_report["total_tokens"],
+            "prompt_trimmed": prompt_report["trimmed"],
+        })
+
+    return {
+        "text": result["text"],
+        "pdf_url": result["pdf_url"],
+        "cached": result["cached"],
+        "reused": False,
+        "prompt": prompt_report,
+        "input_errors": inputs["errors"],
+        "timings": inputs["timings"],
+    }
+
+
+def submit_insight_job(case, doctor_id, force=False):
+    """
+    Queue insight generation for a dashboard case and return the job id.
+
+    The idempotency key covers the doctor and the input fingerprint, so
+    re-clicking while nothing changed returns the same job; `force` always
+    queues a new job that regenerates without the response cache.
+    """
+    latest_lab = next(iter(case["LabReports"]), None)
+    latest_scan = next(iter(case["ScanReports"]), None)
+    summary = case["Summary"] or ""
+    fingerprint = input_fingerprint(
+        summary, latest_lab["url"] if latest_lab else None, latest_scan["url"] if latest_scan else None
+    )
+    payload = {
+        "case_id": case["CaseID"],
+        "doctor_id": doctor_id,
+        "summary": summary,
+        "latest_lab": {"url": latest_lab["url"]} if latest_lab else None,
+        "latest_scan": {"url": latest_scan["url"]} if latest_scan else None,
+        "fingerprint": fingerprint,
+        "force": force,
+    }
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    if force:
+        key += ":" + uuid.uuid4().hex
+    return get_job_queue().submit(
+        INSIGHT_JOB_KIND, payload, idempotency_key=f"{INSIGHT_JOB_KIND}:{key}", max_attempts=INSIGHT_JOB_MAX_ATTEMPTS
+    )
+
+
+get_job_queue().register(INSIGHT_JOB_KIND, run_insight_job)
@@ -0,0 +1,57 @@
+"""
+Splitting Gemini insight text into its `### ` sections, in one go or incrementally.
+
+The incremental parser produces exactly the same pieces as
+`text.split("### ")`, but emits each one as soon as the next heading marker
+has arrived, so a streaming response can be rendered section by section.
+"""
+
+SECTION_MARKER = "### "
+
+
+def parse_section(raw_section):
+    """Return (title, content) for one raw section, or None if it is empty."""
+    if not raw_section.strip():
+        return None
+    lines = raw_section.strip().splitlines()
+    if not lines:
+        return None
+    title = lines[0].strip(":").strip()
+    content = "\n".join(lines[1:]).strip() if len(lines) > 1 else ""
+    return title, content
+
+
+def split_sections(text):
+    """All non-empty (title, content) sections of a complete response."""
+    sections = (parse_section(raw) for raw in text.split(SECTION_MARKER))
+    return [section for section in sections if section]
+
+
+class IncrementalSectionParser:
+    """Feed streamed chunks; get back the sections that are known to be complete."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    @property
+    def pending(self):
+        """Text of the section still being received."""
+        return self._buffer
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        completed = []
+        index = self._buffer.find(SECTION_MARKER)
+        while index != -1:
+            section = parse_section(self._buffer[:index])
+            if section:
+                completed.append(section)
+            self._buffer = self._buffer[index + len(SECTION_MARKER):]
+            index = self._buffer.find(SECTION_MARKER)
+        return completed
+
+    def finish(self):
+        """Flush the last section once the stream has ended."""
+        section = parse_section(self._buffer)
+        self._buffer = ""
+        return [section] if section else []
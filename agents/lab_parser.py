@@ -0,0 +1,142 @@
+"""
+Structured parsing of lab-report tables into a compact prompt representation.
+
+Detects the analyte, value, unit and reference-range columns by header name,
+coerces values to numbers, flags results outside their reference range with
+vectorised comparisons and renders the table as unpadded CSV with the
+abnormal results first. Tables whose columns cannot be recognised are still
+rendered as plain CSV. Token counts of the old padded `to_string()` dump and
+of the compact text are logged per report and totalled in `get_lab_parse_stats()`.
+"""
+import logging
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from agents.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+COLUMN_ALIASES = {
+    "analyte": ("analyte", "test", "test name", "parameter", "investigation", "component", "name", "lab test"),
+    "value": ("value", "result", "results", "observed value", "observation", "reading"),
+    "unit": ("unit", "units", "uom"),
+    "range": ("reference range", "ref range", "reference", "normal range", "range", "reference interval", "biological reference interval"),
+    "low": ("low", "ref low", "lower limit", "min", "reference low"),
+    "high": ("high", "ref high", "upper limit", "max", "reference high"),
+}
+
+NUMBER = r"-?\d+(?:\.\d+)?"
+# A trailing unit is allowed ("3.5-5.0 mmol/L", "13.0 - 17.0 g/dL", "<200 mg/dL")
+RANGE_PATTERN = rf"^\s*(?:(?P<low>{NUMBER})\s*(?:-|–|to)\s*(?P<high>{NUMBER})|(?P<op>[<>≤≥]=?)\s*(?P<limit>{NUMBER}))(?:\s+\S.*|[^\d\s.].*)?\s*$"
+
+_stats = {"reports": 0, "structured": 0, "tokens_before": 0, "tokens_after": 0}
+_stats_lock = threading.Lock()
+
+
+def _normalise(name):
+    return re.sub(r"[\s_\-./()]+", " ", str(name)).strip().lower()
+
+
+def detect_columns(columns):
+    """Map roles (analyte, value, unit, range, low, high) to the table's column names."""
+    normalised = {_normalise(column): column for column in columns}
+    roles = {}
+    for role, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalised and normalised[alias] not in roles.values():
+                roles[role] = normalised[alias]
+                break
+    return roles
+
+
+def to_numeric(series):
+    """Numbers from strings like '5.2', '1,200' or '<0.5' (NaN where there is no number)."""
+    cleaned = series.astype(str).str.replace(",", "", regex=False).str.extract(rf"({NUMBER})", expand=False)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def parse_ranges(series):
+    """Low/high bounds from '3.5-5.0', '3.5 to 5.0 mmol/L', '<200' or '>40' (NaN for open ends)."""
+    parts = series.astype(str).str.replace(",", "", regex=False).str.extract(RANGE_PATTERN)
+    low = pd.to_numeric(parts["low"], errors="coerce")
+    high = pd.to_numeric(parts["high"], errors="coerce")
+    limit = pd.to_numeric(parts["limit"], errors="coerce")
+    is_upper = parts["op"].fillna("").str.startswith(("<", "≤"))
+    is_lower = parts["op"].fillna("").str.startswith((">", "≥"))
+    high = high.where(~is_upper, limit)
+    low = low.where(~is_lower, limit)
+    return low, high
+
+
+def flag_abnormal(values, low, high):
+    """'L' / 'H' where the value is below / above its bounds, '' otherwise (vectorised)."""
+    return pd.Series(np.select([values < low, values > high], ["L", "H"], default=""), index=values.index)
+
+
+def structure_lab_table(df):
+    """
+    Compact representation of a lab table. Returns a dict with `text`,
+    `structured` (columns recognised), `rows`, `abnormal` and the estimated
+    tokens of the padded dump (`tokens_before`) and of `text` (`tokens_after`).
+    """
+    df = df.dropna(how="all")
+    tokens_before = estimate_tokens(df.to_string(index=False))
+    df = df.fillna("")
+    roles = detect_columns(df.columns)
+
+    if "analyte" not in roles or "value" not in roles:
+        text = df.to_csv(index=False).strip()
+        return _report(text, False, len(df), 0, tokens_before)
+
+    table = pd.DataFrame({"analyte": df[roles["analyte"]].astype(str).str.strip()})
+    table["value"] = df[roles["value"]].astype(str).str.strip()
+    table["unit"] = df[roles["unit"]].astype(str).str.strip() if "unit" in roles else ""
+    values = to_numeric(df[roles["value"]])
+
+    if "range" in roles:
+        table["ref"] = df[roles["range"]].astype(str).str.strip()
+        low, high = parse_ranges(df[roles["range"]])
+    elif "low" in roles or "high" in roles:
+        low = to_numeric(df[roles["low"]]) if "low" in roles else pd.Series(np.nan, index=df.index)
+        high = to_numeric(df[roles["high"]]) if "high" in roles else pd.Series(np.nan, index=df.index)
+        table["ref"] = low.map(lambda v: "" if pd.isna(v) else f"{v:g}") + "-" + high.map(lambda v: "" if pd.isna(v) else f"{v:g}")
+    else:
+        low = high = pd.Series(np.nan, index=df.index)
+        table["ref"] = ""
+
+    table["flag"] = flag_abnormal(values, low, high)
+    abnormal = table["flag"] != ""
+    # Abnormal results first; the original order is kept within each group
+    ordered = pd.concat([table[abnormal], table[~abnormal]])
+    ordered = ordered.loc[:, [column for column in ordered.columns if (ordered[column] != "").any()]]
+
+    lines = [f"{int(abnormal.sum())} of {len(table)} results outside the reference range (flag H/L); abnormal listed first."]
+    lines.append(ordered.to_csv(index=False).strip())
+    return _report("\n".join(lines), True, len(table), int(abnormal.sum()), tokens_before)
+
+
+def _report(text, structured, rows, abnormal, tokens_before):
+    tokens_after = estimate_tokens(text)
+    with _stats_lock:
+        _stats["reports"] += 1
+        _stats["structured"] += int(structured)
+        _stats["tokens_before"] += tokens_before
+        _stats["tokens_after"] += tokens_after
+    logger.info(f"Lab report: {rows} rows, {abnormal} abnormal, ~{tokens_before} -> ~{tokens_after} tokens")
+    return {
+        "text": text,
+        "structured": structured,
+        "rows": rows,
+        "abnormal": abnormal,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+    }
+
+
+def get_lab_parse_stats():
+    """Totals since startup: reports parsed, how many were recognised, tokens before/after."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,134 @@
+"""
+Bounded text extraction from PDF lab reports and discharge summaries.
+
+Only the first PDF_MAX_PAGES pages are read and the text is cut at
+PDF_MAX_CHARS, so a document with hundreds of pages parses in bounded time
+and memory. Long documents are split into page ranges extracted in a
+process pool (MuPDF documents cannot be shared between threads); each
+worker opens the document once for its range. Lines repeated at the top or
+bottom of most pages (letterheads, "Page 3 of 40") are stripped; apart from
+page numbers, a line counts as repeated only if it is identical. Results are
+cached by a hash of the file bytes.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+import fitz  # PyMuPDF
+
+from utils.process_pool import SpawnPool
+
+logger = logging.getLogger(__name__)
+
+# === Configuration ===
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "60000"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "4"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))  # smaller documents are read in-process
+PDF_EXTRACT_TIMEOUT = float(os.getenv("PDF_EXTRACT_TIMEOUT", "60"))  # seconds per document
+PDF_CACHE_ENTRIES = int(os.getenv("PDF_CACHE_ENTRIES", "64"))
+
+PAGE_NUMBER = re.compile(r"^(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?$")  # "Page 3 of 40", "3/40", "3"
+EDGE_LINES = 2  # lines at the top and bottom of each page checked for repetition
+REPEATED_FRACTION = 0.5  # an edge line on at least this share of pages is a header/footer
+
+_cache = OrderedDict()  # cache key -> text
+_cache_lock = threading.Lock()
+_extract_pool = SpawnPool(PDF_EXTRACT_WORKERS, name="PDF extraction")
+
+
+def _extract_range(path, start, stop):
+    """Page texts for pages [start, stop), opening the document once."""
+    with fitz.open(path) as doc:
+        return [doc[index].get_text() for index in range(start, stop)]
+
+
+def _extract_pages(data, page_count):
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return [doc[index].get_text() for index in range(page_count)]
+
+    # Workers open the file from disk instead of each receiving a copy of the bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+    try:
+        chunk = -(-page_count // PDF_EXTRACT_WORKERS)
+        calls = [(_extract_range, (tmp.name, start, min(start + chunk, page_count))) for start in range(0, page_count, chunk)]
+        pages = []
+        for chunk_pages in _extract_pool.run_all(calls, timeout=PDF_EXTRACT_TIMEOUT):
+            pages.extend(chunk_pages)
+        return pages
+    finally:
+        os.remove(tmp.name)
+
+
+def _line_signature(line):
+    """
+    Normalised line for repeat detection. Only page numbers are masked, so
+    'Page 3 of 40' and 'Page 4 of 40' match; any other line must repeat
+    exactly, so lab values and dates at page edges are never taken for
+    headers or footers.
+    """
+    normalised = " ".join(line.split()).lower()
+    return "<page number>" if PAGE_NUMBER.match(normalised) else normalised
+
+
+def strip_repeated_lines(pages):
+    """Remove lines that repeat at the top or bottom of most pages."""
+    if len(pages) < 3:
+        return pages
+    page_lines = [[line for line in page.splitlines() if line.strip()] for page in pages]
+    counts = Counter()
+    for lines in page_lines:
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({_line_signature(line) for line in edges})
+    repeated = {signature for signature, count in counts.items() if count >= len(pages) * REPEATED_FRACTION}
+    if not repeated:
+        return pages
+
+    cleaned = []
+    for lines in page_lines:
+        top = [line for line in lines[:EDGE_LINES] if _line_signature(line) not in repeated]
+        middle = lines[EDGE_LINES:-EDGE_LINES] if len(lines) > 2 * EDGE_LINES else []
+        bottom = [line for line in lines[EDGE_LINES:][-EDGE_LINES:] if _line_signature(line) not in repeated]
+        cleaned.append("\n".join(top + middle + bottom))
+    return cleaned
+
+
+def extract_pdf_text(data, max_pages=PDF_MAX_PAGES, max_chars=PDF_MAX_CHARS):
+    """Text of a PDF given its bytes, bounded by `max_pages` and `max_chars`."""
+    key = f"{hashlib.sha256(data).hexdigest()}:{max_pages}:{max_chars}"
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        total_pages = doc.page_count
+    page_count = min(total_pages, max_pages)
+    pages = strip_repeated_lines(_extract_pages(data, page_count))
+
+    parts = []
+    used = 0
+    for number, page in enumerate(pages, start=1):
+        if used + len(page) > max_chars:
+            parts.append(page[:max(0, max_chars - used)])
+            parts.append(f"[... truncated at {max_chars} characters, page {number} of {total_pages}]")
+            break
+        parts.append(page)
+        used += len(page)
+    else:
+        if total_pages > page_count:
+            parts.append(f"[... {total_pages - page_count} more pages not included]")
+    text = "\n".join(parts)
+
+    logger.info(f"PDF text: {page_count}/{total_pages} pages, {len(text)} characters")
+    with _cache_lock:
+        _cache[key] = text
+        while len(_cache) > PDF_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return text
@@ -1,21 +1,32 @@
-def build_multimodal_prompt(case_summary, lab_data=None, scan_description=None):
-    prompt = f"""
-You are a clinical AI assistant. Given the following data, generate a structured SOAP note, differential diagnoses, investigations, treatments, file interpretations, and a confidence score.
-Also make sure that the note generated is HIPAA and GDPR compliant, you're not allowed to disclose patient's PII. It is mandatory for you to respond with a confidence score.
-
-## Subjective (From Doctor Summary)
-{case_summary}
+"""
+Prompt construction for multimodal clinical insights, within a token budget.
 
+The prompt has four sections: the fixed instructions and response format,
+the doctor's case summary, the lab findings and the scan description. The
+budget left after the instructions is shared between the other three
+(PROMPT_BUDGET_SHARES); a section that needs less than its share passes the
+rest on, in priority order summary > scan > labs. Sections over their
+allocation are trimmed: labs keep their first lines (abnormal results come
+first), the summary keeps its beginning and end, and the scan description
+is truncated.
 """
+import os
 
-    if lab_data:
-        prompt += f"\n## Lab Report Findings:\n{lab_data}\n"
+from agents.tokens import CHARS_PER_TOKEN, estimate_tokens
 
-    if scan_description:
-        prompt += f"\n## Radiology Image Analysis:\n{scan_description}\n"
+# === Configuration ===
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))  # text tokens, images not included
+# Shares of the budget left after the instructions: summary, scan description, labs
+PROMPT_BUDGET_SHARES = dict(zip(
+    ("summary", "scan", "labs"),
+    (float(share) for share in os.getenv("PROMPT_BUDGET_SHARES", "0.3,0.1,0.6").split(",")),
+))
+SECTION_PRIORITY = ("summary", "scan", "labs")
+
+INSTRUCTIONS = """You are a clinical AI assistant. Given the following data, generate a structured SOAP note, differential diagnoses, investigations, treatments, file interpretations, and a confidence score.
+Also make sure that the note generated is HIPAA and GDPR compliant, you're not allowed to disclose patient's PII. It is mandatory for you to respond with a confidence score."""
 
-    prompt += """
-Respond in the following format:
+RESPONSE_FORMAT = """Respond in the following format:
 
 ### SOAP Note:
 - Subjective:
@@ -37,7 +48,89 @@ Respond in the following format:
 - Lab Report: 
 - Scan: 
 
-### Confidence Score (0–1):
-"""
+### Confidence Score (0–1):"""
+
+
+def _truncate_lines(text, max_tokens):
+    """Keep whole leading lines that fit; note how many were dropped."""
+    lines = text.splitlines()
+    kept = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line + "\n")
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    omitted = len(lines) - len(kept)
+    return "\n".join(kept + [f"[... {omitted} more lines omitted to fit the prompt budget]"]), f"truncated, {omitted} lines omitted"
+
+
+def _head_and_tail(text, max_tokens):
+    """Keep the beginning and the end, where summaries state the complaint and the latest status."""
+    keep_chars = max(0, max_tokens * CHARS_PER_TOKEN - 60)
+    head = text[:keep_chars * 2 // 3]
+    tail = text[len(text) - keep_chars // 3:] if keep_chars // 3 else ""
+    return f"{head}\n[... middle of the summary omitted to fit the prompt budget ...]\n{tail}", "condensed to beginning and end"
+
+
+def _truncate(text, max_tokens):
+    return text[:max(0, max_tokens * CHARS_PER_TOKEN)] + " [...]", "truncated"
+
 
-    return prompt.strip()
+TRIMMERS = {"summary": _head_and_tail, "scan": _truncate, "labs": _truncate_lines}
+
+
+def allocate_budget(needs, available, shares=PROMPT_BUDGET_SHARES):
+    """Token allocation per section: each gets up to its share, leftovers go out in priority order."""
+    allocation = {name: min(need, int(available * shares.get(name, 0))) for name, need in needs.items()}
+    leftover = available - sum(allocation.values())
+    for name in SECTION_PRIORITY:
+        if name in needs and leftover > 0:
+            extra = min(needs[name] - allocation[name], leftover)
+            allocation[name] += extra
+            leftover -= extra
+    return allocation
+
+
+def build_budgeted_prompt(case_summary, lab_data=None, scan_description=None, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Build the prompt within `token_budget`. Returns (prompt, report) where the
+    report holds the budget, the final token count, tokens per section and a
+    description of every trimmed section.
+    """
+    sections = {"summary": case_summary or ""}
+    if scan_description:
+        sections["scan"] = scan_description
+    if lab_data:
+        sections["labs"] = lab_data
+
+    fixed_tokens = estimate_tokens(INSTRUCTIONS) + estimate_tokens(RESPONSE_FORMAT) + 40  # headings and spacing
+    needs = {name: estimate_tokens(text) for name, text in sections.items()}
+    allocation = allocate_budget(needs, max(0, token_budget - fixed_tokens))
+
+    trimmed = []
+    for name, text in sections.items():
+        if needs[name] > allocation[name]:
+            sections[name], method = TRIMMERS[name](text, allocation[name])
+            trimmed.append(f"{name}: {needs[name]} -> {estimate_tokens(sections[name])} tokens ({method})")
+
+    prompt = f"{INSTRUCTIONS}\n\n## Subjective (From Doctor Summary)\n{sections['summary']}\n\n"
+    if "labs" in sections:
+        prompt += f"\n## Lab Report Findings:\n{sections['labs']}\n"
+    if "scan" in sections:
+        prompt += f"\n## Radiology Image Analysis:\n{sections['scan']}\n"
+    prompt = (prompt + "\n" + RESPONSE_FORMAT).strip()
+
+    report = {
+        "budget": token_budget,
+        "total_tokens": estimate_tokens(prompt),
+        "sections": {"instructions": fixed_tokens, **{name: estimate_tokens(text) for name, text in sections.items()}},
+        "trimmed": trimmed,
+    }
+    return prompt, report
+
+
+def build_multimodal_prompt(case_summary, lab_data=None, scan_description=None):
+    prompt, _ = build_budgeted_prompt(case_summary, lab_data, scan_description)
+    return prompt
@@ -0,0 +1,254 @@
+"""
+Client-side protection around Gemini calls: rate limiting, retries and a
+circuit breaker.
+
+- `RateLimiter`: token buckets for requests per minute and tokens per minute;
+  callers wait for capacity instead of provoking 429s.
+- `RetryPolicy`: exponential backoff with full jitter on retryable errors
+  (429, 5xx, timeouts, dropped connections); other errors fail immediately.
+- `CircuitBreaker`: after `failure_threshold` consecutive retryable failures
+  calls fail fast for `reset_timeout` seconds, then a single probe call
+  decides whether to close again.
+- `ResilientCaller.call(fn, tokens)` combines the three under one per-call
+  deadline; `fn(timeout)` receives the seconds left.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+
+# === Configuration ===
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))  # requests per minute, 0 = unlimited
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "0"))  # input tokens per minute, 0 = unlimited
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))  # seconds
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))  # seconds
+GEMINI_CALL_DEADLINE = float(os.getenv("GEMINI_CALL_DEADLINE", "120"))  # seconds per call, retries included
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))  # consecutive failures
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds open before a probe
+
+# The REST transport (and the fake server behind it) raises requests' own errors, which don't subclass the builtins
+RETRYABLE_EXCEPTIONS = (TimeoutError, ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted", "RetryError",
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the API while the circuit breaker is open."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call (including waiting and retries) ran out of time."""
+
+
+def is_retryable(error):
+    """True for quota, server-side, timeout and connection errors."""
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    """Refills at `per_minute / 60` units per second up to `capacity`."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.per_minute = per_minute
+        self.capacity = capacity or per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` is available (0 = available now)."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # oversized requests wait for a full bucket
+        if self._level >= amount:
+            return 0.0
+        return (amount - self._level) * 60 / self.per_minute
+
+    def take(self, amount):
+        if self.per_minute:
+            self._level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets, taken together."""
+
+    def __init__(self, requests_per_minute=GEMINI_RPM, tokens_per_minute=GEMINI_TPM):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        """Change the limits in place (None keeps a limit, 0 removes it); callers already waiting pick them up."""
+        with self._lock:
+            if requests_per_minute is not None:
+                self.requests = TokenBucket(requests_per_minute)
+            if tokens_per_minute is not None:
+                self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens=0, timeout=None):
+        """Block until one request and `tokens` tokens fit; raise DeadlineExceededError past `timeout`."""
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait == 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                self.waited_seconds += wait
+            if give_up_at is not None and now + wait > give_up_at:
+                raise DeadlineExceededError("Rate limit wait would exceed the call deadline.")
+            time.sleep(wait)
+
+    def state(self):
+        with self._lock:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                "requests_available": round(self.requests._level, 1) if self.requests.per_minute else None,
+                "tokens_available": round(self.tokens._level) if self.tokens.per_minute else None,
+                "waited_seconds": round(self.waited_seconds, 1),
+            }
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=GEMINI_MAX_ATTEMPTS, base_delay=GEMINI_BACKOFF_BASE, max_delay=GEMINI_BACKOFF_MAX):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Full-jitter backoff before retry number `attempt` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=GEMINI_BREAKER_THRESHOLD, reset_timeout=GEMINI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True  # let exactly one probe through
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(f"Gemini API marked unhealthy; retrying in {retry_in:.0f}s.")
+
+    def release(self):
+        """Give back a half-open probe slot that was not used for an API call."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def state(self):
+        with self._lock:
+            state = self._state
+            if state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                state = HALF_OPEN
+            return {"state": state, "consecutive_failures": self._failures, "rejected": self.rejected}
+
+
+class ResilientCaller:
+    def __init__(self, limiter=None, retry=None, breaker=None, deadline=GEMINI_CALL_DEADLINE):
+        self.limiter = limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "deadline_exceeded": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def call(self, fn, tokens=0, deadline=None):
+        """
+        Run `fn(timeout)` under the rate limiter and circuit breaker, retrying
+        retryable errors with backoff until the attempts or the deadline run out.
+        """
+        self._count("calls")
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                self.limiter.acquire(tokens, timeout=deadline_at - time.monotonic())
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceededError("Gemini call deadline exceeded.")
+                result = fn(remaining)
+            except DeadlineExceededError:
+                self.breaker.release()  # ran out of our own budget before calling; says nothing about the API
+                self._count("deadline_exceeded")
+                self._count("failures")
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()  # the API answered; the request itself was bad
+                attempt += 1
+                delay = self.retry.delay(attempt)
+                if not retryable or attempt >= self.retry.max_attempts or time.monotonic() + delay >= deadline_at:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self._count("successes")
+            return result
+
+    def state(self):
+        """Snapshot for dashboards: breaker state, limiter headroom and call counters."""
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, "breaker": self.breaker.state(), "limiter": self.limiter.state()}
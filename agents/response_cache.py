@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# === Configuration ===
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", "86400"))  # seconds
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "256"))
+GEMINI_CACHE_DB = os.getenv("GEMINI_CACHE_DB")  # optional SQLite file for the on-disk tier
+
+
+def make_cache_key(prompt_text, images=None, model_name=""):
+    """
+    Content-addressed key for a Gemini request: SHA-256 over the model name,
+    the prompt text and every inline image payload (mime type + data).
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt_text.encode("utf-8"))
+    for image in images or []:
+        inline = image.get("inline_data", {}) if isinstance(image, dict) else {}
+        digest.update(b"\x00")
+        digest.update(str(inline.get("mime_type", "")).encode("utf-8"))
+        digest.update(b"\x00")
+        data = inline.get("data", "")
+        digest.update(data.encode("utf-8") if isinstance(data, str) else bytes(data))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for Gemini responses.
+
+    The in-memory tier is an LRU bounded by `max_entries`; the optional
+    on-disk tier is a SQLite table shared by every process pointing at the
+    same `db_path`. Both tiers honour a per-entry TTL. Caches sharing a file
+    keep their entries apart by using different `table` names.
+    """
+
+    def __init__(self, max_entries=GEMINI_CACHE_MAX_ENTRIES, ttl=GEMINI_CACHE_TTL, db_path=GEMINI_CACHE_DB,
+                 table="gemini_response_cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.table = table
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "stores": 0, "evictions": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return value
+                if row:
+                    self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self._db.commit()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, value, expires_at):
+        # Called with self._lock held.
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
@@ -0,0 +1,34 @@
+"""
+Token and cost estimates for Gemini calls.
+
+The estimates are deliberately cheap heuristics (no API round trip): about
+four characters per token for English clinical text, and a fixed cost per
+inline image, which is how Gemini bills images up to 384px per side.
+"""
+import math
+import os
+
+# === Configuration ===
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+# USD per million tokens (gemini-2.5-flash list prices by default)
+GEMINI_INPUT_PRICE_PER_MTOK = float(os.getenv("GEMINI_INPUT_PRICE_PER_MTOK", "0.30"))
+GEMINI_OUTPUT_PRICE_PER_MTOK = float(os.getenv("GEMINI_OUTPUT_PRICE_PER_MTOK", "2.50"))
+
+
+def estimate_tokens(text):
+    """Approximate token count of `text`."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_request_tokens(prompt_text, images=None):
+    """Approximate input tokens for a prompt plus inline images."""
+    return estimate_tokens(prompt_text) + IMAGE_TOKENS * len(images or [])
+
+
+def estimate_cost(input_tokens, output_tokens):
+    """Approximate USD cost of a request."""
+    return (input_tokens * GEMINI_INPUT_PRICE_PER_MTOK + output_tokens * GEMINI_OUTPUT_PRICE_PER_MTOK) / 1_000_000
+
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# === Configuration ===
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL", "base")
+WHISPER_IDLE_TTL = float(os.getenv("WHISPER_IDLE_TTL", "1800"))  # seconds before an unused model is unloaded
+SUPPORTED_MODEL_SIZES = ("tiny", "base", "small")
+
+
+class WhisperModelRegistry:
+    """
+    Process-wide cache of loaded Whisper models.
+
+    Each model size is loaded once and kept warm so every Streamlit session in
+    the process can reuse it. Models that have not been used for `idle_ttl`
+    seconds are unloaded by a background janitor thread.
+    """
+
+    def __init__(self, idle_ttl=WHISPER_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._models = {}
+        self._last_used = {}
+        self._load_locks = {}
+        # Whisper installs kv-cache hooks on the model while decoding,
+        # so two transcriptions must not run on the same model at once.
+        self._inference_locks = {}
+        self._janitor = None
+
+    def get_model(self, size=None):
+        size = _resolve_size(size)
+        with self._lock:
+            model = self._models.get(size)
+            if model is not None:
+                self._last_used[size] = time.monotonic()
+                return model
+            load_lock = self._load_locks.setdefault(size, threading.Lock())
+
+        # Only one thread loads a given size; the others wait and reuse it.
+        with load_lock:
+            with self._lock:
+                model = self._models.get(size)
+                if model is not None:
+                    self._last_used[size] = time.monotonic()
+                    return model
+
+            import whisper
+
+            started = time.perf_counter()
+            model = whisper.load_model(size)
+            logger.info(f"Loaded Whisper '{size}' model in {time.perf_counter() - started:.2f}s")
+
+            with self._lock:
+                self._models[size] = model
+                self._last_used[size] = time.monotonic()
+                self._inference_locks.setdefault(size, threading.Lock())
+                self._start_janitor()
+            return model
+
+    def transcribe(self, audio_path, size=None, **options):
+        size = _resolve_size(size)
+        model = self.get_model(size)
+        with self._inference_locks[size]:
+            result = model.transcribe(audio_path, **options)
+        with self._lock:
+            self._last_used[size] = time.monotonic()
+        return result
+
+    def evict_idle(self):
+        """Unload every model that has been idle for longer than `idle_ttl`."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for size, last_used in list(self._last_used.items()):
+                if now - last_used < self.idle_ttl:
+                    continue
+                inference_lock = self._inference_locks.get(size)
+                if inference_lock is not None and inference_lock.locked():
+                    continue
+                self._models.pop(size, None)
+                self._last_used.pop(size, None)
+                evicted.append(size)
+        if evicted:
+            logger.info(f"Evicted idle Whisper models: {evicted}")
+            _release_gpu_memory()
+        return evicted
+
+    def loaded_models(self):
+        with self._lock:
+            return sorted(self._models)
+
+    def _start_janitor(self):
+        # Called with self._lock held.
+        if self._janitor is not None and self._janitor.is_alive():
+            return
+        self._janitor = threading.Thread(target=self._janitor_loop, name="whisper-janitor", daemon=True)
+        self._janitor.start()
+
+    def _janitor_loop(self):
+        interval = max(self.idle_ttl / 2, 1.0)
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+            with self._lock:
+                if not self._models:
+                    self._janitor = None
+                    return
+
+
+def _resolve_size(size):
+    size = size or WHISPER_MODEL_SIZE
+    if size not in SUPPORTED_MODEL_SIZES:
+        logger.warning(f"Unsupported Whisper model '{size}', falling back to 'base'")
+        return "base"
+    return size
+
+
+def _release_gpu_memory():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+# === Shared registry ===
+_registry = WhisperModelRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def transcribe_file(audio_path, size=None, **options):
+    """Transcribe an audio file with the shared, already-warm Whisper model."""
+    return _registry.transcribe(audio_path, size=size, **options)
+
+
+def transcribe_audio_segment(audio, size=None, **options):
+    """
+    Transcribe a pydub AudioSegment (as returned by `audiorecorder`).
+
+    The audio is exported to a temporary WAV file which is always removed,
+    even if transcription fails.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+        temp_path = tmp.name
+    try:
+        audio.export(temp_path, format="wav")
+        return transcribe_file(temp_path, size=size, **options)
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
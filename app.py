@@ -1,13 +1,21 @@
 import streamlit as st
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
-import os
 import pandas as pd
 from audiorecorder import audiorecorder
-from agents.prompt_builder import build_multimodal_prompt
-from agents.file_parser import parse_lab_file, encode_image
+from agents.prompt_builder import build_budgeted_prompt
 from agents.gemini_agent import call_gemini
+from agents.transcriber import transcribe_audio_segment
+from agents.insight_inputs import input_fingerprint, prefetch_insight_inputs
 from agents.pdf_exporter import generate_pdf_and_save
+from utils.neo4j_repository import (
+    get_driver, fetch_all_doctors, get_doctor_profile, doctor_exists, is_doctor_registered,
+    create_doctor_login, validate_doctor_login, fetch_case_dashboard, case_exists, create_case,
+    delete_case, fetch_report_urls_for_case, update_case_summary, fetch_all_reports, link_uploaded_report, delete_uploaded_report,
+    find_insight_by_fingerprint,
+)
+from utils.feedback_store import get_feedback_store
+from utils.schema import ensure_schema
+from utils import blob_store
 from datetime import datetime, date # Import datetime and date for filtering
 from dateutil import parser
 import pytz
@@ -48,10 +56,8 @@ def format_datetime(datetime_value):
 
 # -------- Load env and connect to Neo4j --------
 load_dotenv()
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+driver = get_driver() # Shared, pooled driver; not rebuilt on Streamlit reruns
+ensure_schema(driver) # Applies pending constraint/index migrations once per process
 
 # -------- UI Config --------
 st.set_page_config(page_title="Clinical Assistant", page_icon="🩺", layout="wide")
@@ -211,149 +217,57 @@ def clear_new_case_inputs():
         st.session_state["new_case_summary_input"] = ""
 
 
-def add_new_case_to_neo4j(driver, patient_id, patient_name, case_id, case_summary, doctor_id):
+def add_new_case_to_neo4j(patient_id, patient_name, case_id, case_summary, doctor_id):
     """
     Adds a new case and patient (if new) to Neo4j,
     linked to the specified doctor.
     """
     try:
-        with driver.session() as session:
-            # First, check if the provided case_id already exists
-            existing_case = session.run("MATCH (c:Case {case_id: $case_id}) RETURN c", {"case_id": case_id}).single()
-            if existing_case:
-                return False, f"Case ID '{case_id}' already exists. Please choose a unique Case ID for a new case."
-
-            # If case_id is unique, proceed to create nodes and relationships
-            session.run(
-                """
-                MERGE (d:Doctor {id: $doctor_id}) // Ensure doctor exists or create if not (should exist from login)
-
-                MERGE (p:Patient {id: $patient_id}) // Create Patient if new, or use existing if ID matches
-                ON CREATE SET p.name = $patient_name // Only set name if patient is newly created
-
-                CREATE (c:Case {case_id: $case_id}) // Create a new Case node (ensured unique by check above)
-                SET c.case_summary = $case_summary,
-                    c.created_at = datetime() // Set creation timestamp
-
-                MERGE (d)-[:HANDLES]->(c) // Link Doctor to Case
-                MERGE (c)-[:BELONGS_TO]->(p) // Link Case to Patient
-                """,
-                {
-                    "doctor_id": doctor_id,
-                    "patient_id": patient_id,
-                    "patient_name": patient_name,
-                    "case_id": case_id,
-                    "case_summary": case_summary
-                }
-            )
+        # First, check if the provided case_id already exists
+        if case_exists(case_id):
+            return False, f"Case ID '{case_id}' already exists. Please choose a unique Case ID for a new case."
+
+        # If case_id is unique, proceed to create nodes and relationships
+        create_case(patient_id, patient_name, case_id, case_summary, doctor_id)
         return True, "✅ New case added successfully!"
     except Exception as e:
         return False, f"❌ An error occurred while adding the case: {e}"
 
-def delete_case_from_neo4j(driver, case_id):
+def delete_case_from_neo4j(case_id):
     """
     Deletes a case and all its associated relationships, uploaded reports, and feedback from Neo4j.
     Does NOT delete the patient or doctor if they are associated with other cases.
     """
     try:
-        with driver.session() as session:
-            # Query to find related report URLs to delete from SeaweedFS
-            report_urls = session.run(
-                """
-                MATCH (c:Case {case_id: $case_id})-[r_rel:HAS_REPORT]->(ur:UploadedReport)
-                RETURN ur.url AS url
-                """, {"case_id": case_id}
-            ).data()
-
-            # Delete files from SeaweedFS if they exist
-            if report_urls:
-                import requests
-                for record in report_urls:
-                    file_url = record["url"]
-                    filename = file_url.split("/")[-1]
-                    try:
-                        delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
-                        if delete_res.ok:
-                            st.info(f"🗑️ Deleted file from SeaweedFS: {filename}")
-                        else:
-                            st.warning(f"⚠️ Failed to delete file {filename} from SeaweedFS (Status: {delete_res.status_code}).")
-                    except Exception as e:
-                        st.error(f"❌ Error deleting file {filename} from SeaweedFS: {e}")
-
-            # Cypher query to delete the case node and all its relationships
-            # DETACH DELETE handles all relationships connected to 'c'
-            # Also explicitly delete related UploadedReport and Feedback nodes that are only linked to this case.
-            session.run(
-                """
-                MATCH (c:Case {case_id: $case_id})
-                OPTIONAL MATCH (c)-[rel_report:HAS_REPORT]->(ur:UploadedReport)
-                OPTIONAL MATCH (c)-[rel_feedback:HAS_FEEDBACK]->(f:Feedback)
-                DETACH DELETE c, ur, f
-                """,
-                {"case_id": case_id}
-            )
+        # Query to find related report URLs to delete from SeaweedFS
+        report_urls = fetch_report_urls_for_case(case_id)
+
+        # Delete files from SeaweedFS if they exist
+        if report_urls:
+            for file_url in report_urls:
+                try:
+                    delete_res = blob_store.delete(file_url)
+                    if delete_res.ok:
+                        st.info(f"🗑️ Deleted file from SeaweedFS: {file_url}")
+                    else:
+                        st.warning(f"⚠️ Failed to delete file {file_url} from SeaweedFS (Status: {delete_res.status_code}).")
+                except Exception as e:
+                    st.error(f"❌ Error deleting file {file_url} from SeaweedFS: {e}")
+
+        # Delete the case node, its relationships, and the UploadedReport and Feedback nodes linked to it
+        delete_case(case_id)
         return True, f"✅ Case '{case_id}' and its associated data deleted successfully!"
     except Exception as e:
         return False, f"❌ An error occurred while deleting case '{case_id}': {e}"
 
 
-def fetch_all_doctors():
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor) RETURN d.id AS id, d.name AS name, d.role AS role")
-        return [{"id": r["id"], "name": r["name"], "role": r["role"]} for r in result]
-
-def get_doctor_name(doctor_id):
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d.name AS name", {"doctor_id": doctor_id})
-        r = result.single()
-        return r["name"] if r else "Doctor"
-
 def register_doctor_login(doctor_id, password):
-    with driver.session() as session:
-        if not session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d", {"doctor_id": doctor_id}).single():
-            return False, "Doctor ID not found in system."
-        if session.run("MATCH (d:DoctorLogin {id: $doctor_id}) RETURN d", {"doctor_id": doctor_id}).single():
-            return False, "Doctor already registered."
-        session.run("CREATE (d:DoctorLogin {id: $doctor_id, password: $password})", {"doctor_id": doctor_id, "password": password})
-        return True, "Registration successful!"
-
-def validate_doctor_login(doctor_id, password):
-    with driver.session() as session:
-        return session.run(
-            "MATCH (d:DoctorLogin {id: $doctor_id, password: $password}) RETURN d",
-            {"doctor_id": doctor_id, "password": password}
-        ).single() is not None
-
-def fetch_cases_for_doctor(doctor_id):
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
-            RETURN c.case_id AS CaseID,
-                   p.id AS PatientID,
-                   p.name AS PatientName,
-                   c.case_summary AS Summary,
-                   c.created_at AS CreatedAt
-            ORDER BY c.created_at DESC
-        """, {"doctor_id": doctor_id})
-        return [r.data() for r in result]
-
-def fetch_feedback_summary():
-    """
-    Fetches the total count of good and poor responses from Neo4j.
-    """
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (f:Feedback)
-            RETURN f.is_good_response AS is_good, COUNT(f) AS count
-            ORDER BY is_good DESC
-        """)
-        summary = {"good": 0, "poor": 0}
-        for record in result:
-            if record["is_good"]:
-                summary["good"] = record["count"]
-            else:
-                summary["poor"] = record["count"]
-        return summary
+    if not doctor_exists(doctor_id):
+        return False, "Doctor ID not found in system."
+    if is_doctor_registered(doctor_id):
+        return False, "Doctor already registered."
+    create_doctor_login(doctor_id, password)
+    return True, "Registration successful!"
 
 
 # -------- Streamlit App UI --------
@@ -374,16 +288,13 @@ if "logged_in_doctor" not in st.session_state:
         login_id = st.text_input("Doctor ID")
         login_password = st.text_input("Password", type="password")
         if st.button("Login"):
-            with driver.session() as session:
-                registered = session.run("MATCH (d:DoctorLogin {id: $doctor_id}) RETURN d", {"doctor_id": login_id}).single()
-
-                if not registered:
-                    st.warning("⚠️ Doctor not registered. Please register before logging in.")
-                elif validate_doctor_login(login_id, login_password):
-                    st.session_state.logged_in_doctor = login_id
-                    st.rerun()
-                else:
-                    st.error("❌ Incorrect password. Please try again.")
+            if not is_doctor_registered(login_id):
+                st.warning("⚠️ Doctor not registered. Please register before logging in.")
+            elif validate_doctor_login(login_id, login_password):
+                st.session_state.logged_in_doctor = login_id
+                st.rerun()
+            else:
+                st.error("❌ Incorrect password. Please try again.")
 
     with tabs[1]:
         st.subheader("Register")
@@ -399,11 +310,9 @@ if "logged_in_doctor" not in st.session_state:
 # Show dashboard if logged in
 else:
     doctor_id = st.session_state.logged_in_doctor
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d.name AS name, d.role AS role", {"doctor_id": doctor_id})
-        record = result.single()
-        doctor_name = record["name"] if record else "Unknown"
-        doctor_role = record["role"] if record else "Unknown"
+    record = get_doctor_profile(doctor_id)
+    doctor_name = record["name"] if record else "Unknown"
+    doctor_role = record["role"] if record else "Unknown"
 
     st.success(f"👋 Welcome, {doctor_name} ({doctor_role}, {doctor_id})")
 
@@ -439,7 +348,7 @@ else:
 
 
     # -------- Assigned Cases (now with filtering) --------
-    cases = fetch_cases_for_doctor(doctor_id)
+    cases = fetch_case_dashboard(doctor_id) # Cases with summaries and reports in one query
     if cases:
         df_all_cases = pd.DataFrame(cases)
         # Convert 'CreatedAt' to datetime objects for proper comparison
@@ -499,7 +408,7 @@ else:
             if 'confirm_delete_case_id' in st.session_state and st.session_state['confirm_delete_case_id']:
                 case_id_to_delete = st.session_state['confirm_delete_case_id']
                 if st.button(f"Confirm Delete Case '{case_id_to_delete}'", key=f"confirm_delete_{case_id_to_delete}"):
-                    success, message = delete_case_from_neo4j(driver, case_id_to_delete)
+                    success, message = delete_case_from_neo4j(case_id_to_delete)
                     if success:
                         st.success(message)
                         del st.session_state['confirm_delete_case_id'] # Clear confirmation state
@@ -537,7 +446,6 @@ else:
                     logged_in_doctor_id = st.session_state.logged_in_doctor
                     
                     success, message = add_new_case_to_neo4j(
-                        driver,
                         new_patient_id.strip(), # .strip() to remove leading/trailing whitespace
                         new_patient_name.strip(),
                         new_case_id.strip(),
@@ -577,24 +485,14 @@ else:
             st.rerun()
 
     elif command_mode == "🎤 Dictate with Mic":
-        import whisper
-        import tempfile
-        import os
-
         audio = audiorecorder("🎤 Click to Record", "🛑 Stop Recording", key="cmd_audio_recorder_global")
 
         if len(audio) > 0:
             st.audio(audio.export().read(), format="audio/wav")
 
             if st.button("📝 Transcribe & Run Command", key="run_mic_cmd_global"):
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-                    audio.export(tmp.name, format="wav")
-                    temp_path = tmp.name
-
                 with st.spinner("Transcribing audio..."):
-                    model = whisper.load_model("base")
-                    result = model.transcribe(temp_path)
-                    os.remove(temp_path)
+                    result = transcribe_audio_segment(audio)
                     transcription = result["text"]
                 
                 st.success("✅ Transcription complete!")
@@ -621,6 +519,7 @@ else:
                     command=user_command_to_execute,
                     driver=driver
                 )
+                st.caption("⚡ Parsed locally" if result.get("parser") == "rules" else "🤖 Parsed with Gemini")
                 
                 if result['success']:
                     
@@ -683,13 +582,7 @@ else:
 
     st.markdown("## 📁 All Uploaded Reports & Clinical Insights")
 
-    with driver.session() as session:
-        reports = session.run("""
-            MATCH (p:Patient)<-[:BELONGS_TO]-(c:Case)-[:HAS_REPORT]->(r:UploadedReport)
-            RETURN p.name AS PatientName, p.id AS PatientID, c.case_id AS CaseID, 
-                r.type AS Type, r.url AS URL, r.uploaded_at AS UploadedAt
-            ORDER BY r.uploaded_at DESC
-        """).data()
+    reports = fetch_all_reports()
 
     if reports:
         lab_reports = []
@@ -701,13 +594,11 @@ else:
 
             patient_info = f"👤 **{r['PatientName']}** (`{r['PatientID']}`) - Case `{r['CaseID']}`"
             link = f"[📂 View Report]({r['URL']})"
-            filename = r['URL'].split("/")[-1]
             
             # Create entry with delete button data
             entry = {
                 "display": f"{patient_info}  \n🕒 `{uploaded_at}` — {link}",
                 "url": r['URL'],
-                "filename": filename,
                 "patient_id": r['PatientID'],
                 "case_id": r['CaseID'],
                 "type": r['Type']
@@ -730,17 +621,11 @@ else:
                     st.markdown(report["display"])
                     
                     # Delete button for lab reports
-                    if st.button(f"🗑️ Delete Lab Report", key=f"del_lab_{report['filename']}"):
+                    if st.button(f"🗑️ Delete Lab Report", key=f"del_lab_{report['url']}"):
                         try:
-                            import requests
-                            delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{report['filename']}")
+                            delete_res = blob_store.delete(report['url'])
                             if delete_res.ok:
-                                with driver.session() as session:
-                                    session.run("""
-                                        MATCH (r:UploadedReport {url: $url})
-                                        OPTIONAL MATCH (r)<-[rel]-()
-                                        DELETE rel, r
-                                    """, {"url": report["url"]})
+                                delete_uploaded_report(report["url"])
                                 st.success("✅ Lab Report deleted successfully.")
                                 st.rerun()
                             else:
@@ -759,17 +644,11 @@ else:
                     st.markdown(report["display"])
                     
                     # Delete button for scan reports
-                    if st.button(f"🗑️ Delete Scan Report", key=f"del_scan_{report['filename']}"):
+                    if st.button(f"🗑️ Delete Scan Report", key=f"del_scan_{report['url']}"):
                         try:
-                            import requests
-                            delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{report['filename']}")
+                            delete_res = blob_store.delete(report['url'])
                             if delete_res.ok:
-                                with driver.session() as session:
-                                    session.run("""
-                                        MATCH (r:UploadedReport {url: $url})
-                                        OPTIONAL MATCH (r)<-[rel]-()
-                                        DELETE rel, r
-                                    """, {"url": report["url"]})
+                                delete_uploaded_report(report["url"])
                                 st.success("✅ Scan Report deleted successfully.")
                                 st.rerun()
                             else:
@@ -788,17 +667,11 @@ else:
                     st.markdown(insight["display"])
                     
                     # Delete button for clinical insights
-                    if st.button(f"🗑️ Delete Clinical Insight", key=f"del_insight_{insight['filename']}"):
+                    if st.button(f"🗑️ Delete Clinical Insight", key=f"del_insight_{insight['url']}"):
                         try:
-                            import requests
-                            delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{insight['filename']}")
+                            delete_res = blob_store.delete(insight['url'])
                             if delete_res.ok:
-                                with driver.session() as session:
-                                    session.run("""
-                                        MATCH (r:UploadedReport {url: $url})
-                                        OPTIONAL MATCH (r)<-[rel]-()
-                                        DELETE rel, r
-                                    """, {"url": insight["url"]})
+                                delete_uploaded_report(insight["url"])
                                 st.success("✅ Clinical Insight deleted successfully.")
                                 st.rerun()
                             else:
@@ -814,14 +687,11 @@ else:
 
     # -------- Feedback Dashboard --------
     st.markdown("## ✨ Feedback Dashboard")
-    feedback_summary = fetch_feedback_summary()
+    feedback_summary = get_feedback_store().summary()  # incrementally maintained rollup
     st.markdown(f"**👍 Good Responses:** {feedback_summary['good']}")
     st.markdown(f"**👎 Poor Responses:** {feedback_summary['poor']}")
-    if feedback_summary['good'] + feedback_summary['poor'] > 0:
-        total_feedback = feedback_summary['good'] + feedback_summary['poor']
-        good_percentage = (feedback_summary['good'] / total_feedback) * 100
-        poor_percentage = (feedback_summary['poor'] / total_feedback) * 100
-        st.info(f"Overall satisfaction: {good_percentage:.1f}% positive ({total_feedback} total feedback points)")
+    if feedback_summary['total'] > 0:
+        st.info(f"Overall satisfaction: {feedback_summary['good_rate'] * 100:.1f}% positive ({feedback_summary['total']} total feedback points)")
     else:
         st.info("No feedback recorded yet.")
 
@@ -844,13 +714,7 @@ else:
                 )
 
                 if summary_mode == "📖 View Saved Summary":
-                    with driver.session() as session:
-                        result = session.run("""
-                            MATCH (c:Case {case_id: $case_id})
-                            RETURN c.case_summary AS summary
-                        """, {"case_id": case["CaseID"]})
-                        record = result.single()
-                        saved_summary = record["summary"] if record and record["summary"] else "⚠️ No summary saved yet."
+                    saved_summary = case["Summary"] or "⚠️ No summary saved yet."
                     st.text_area("📄 Saved Summary", value=saved_summary, height=200, disabled=True)
                     # continue
 
@@ -863,64 +727,40 @@ else:
                 if mode == "🧾 Type Summary":
                     typed_summary = st.text_area("Enter case summary manually", height=150, key=f"typed_summary_{case['CaseID']}")
                     if st.button("💾 Save Typed Summary", key=f"save_typed_{case['CaseID']}"):
-                        with driver.session() as session:
-                            session.run("""
-                                MATCH (c:Case {case_id: $case_id})
-                                SET c.case_summary = $summary
-                            """, {"case_id": case["CaseID"], "summary": typed_summary})
+                        update_case_summary(case["CaseID"], typed_summary)
                         st.success("📝 Summary saved to Neo4j.")
                         st.rerun()
 
                 elif mode == "🎤 Dictate with Mic":
-                    import whisper
-                    import tempfile
-                    import os
-
                     audio = audiorecorder("🎤 Click to Record", "🛑 Stop Recording", key=f"audio_recorder_{case['CaseID']}") # ADDED UNIQUE KEY HERE
 
                     if len(audio) > 0:
                         st.audio(audio.export().read(), format="audio/wav")
 
                         if st.button("📝 Transcribe & Save", key=f"mic_save_{case['CaseID']}"):
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-                                audio.export(tmp.name, format="wav")
-                                temp_path = tmp.name
-
                             with st.spinner("Transcribing..."):
-                                model = whisper.load_model("base")
-                                result = model.transcribe(temp_path)
-                                os.remove(temp_path)
+                                result = transcribe_audio_segment(audio)
                                 transcription = result["text"]
 
                             st.success("✅ Transcription complete!")
                             st.text_area("🧾 Transcribed Summary", value=transcription, height=150)
 
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (c:Case {case_id: $case_id})
-                                    SET c.case_summary = $summary
-                                """, {"case_id": case["CaseID"], "summary": transcription})
+                            update_case_summary(case["CaseID"], transcription)
 
                             st.success("📝 Summary saved to Neo4j.")
                             st.rerun()
 
                 
                 # ---- Uploaded Files for this Case ----
-                with driver.session() as session:
-                    result = session.run("""
-                        MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport)
-                        RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at
-                        ORDER BY r.uploaded_at DESC
-                    """, {"case_id": case["CaseID"]})
-                    report_records = result.data()
+                report_records = case["Reports"]
 
                 if report_records:
                     st.markdown("### 📂 All Reports for This Case")
                     
-                    # Separate reports by type
-                    lab_reports = [r for r in report_records if r["type"] == "lab"]
-                    scan_reports = [r for r in report_records if r["type"] == "scan"]
-                    clinical_insights = [r for r in report_records if r["type"] == "prescription"]
+                    # Reports arrive already grouped by type from the dashboard query
+                    lab_reports = case["LabReports"]
+                    scan_reports = case["ScanReports"]
+                    clinical_insights = case["Insights"]
                     
                     # Display in organized sections
                     report_cols = st.columns(3)
@@ -932,22 +772,15 @@ else:
                             for report in lab_reports:
                                 file_url = report["url"]
                                 uploaded_at = format_datetime(report.get("uploaded_at"))
-                                filename = file_url.split("/")[-1]
                                 
                                 st.markdown(f"🕒 `{uploaded_at}`")
                                 st.markdown(f"[📂 View Lab Report]({file_url})")
                                 
-                                if st.button(f"🗑️ Delete", key=f"del_case_lab_{case['CaseID']}_{filename}"):
+                                if st.button(f"🗑️ Delete", key=f"del_case_lab_{case['CaseID']}_{file_url}"):
                                     try:
-                                        import requests
-                                        delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
+                                        delete_res = blob_store.delete(file_url)
                                         if delete_res.ok:
-                                            with driver.session() as session:
-                                                session.run("""
-                                                    MATCH (r:UploadedReport {url: $url})
-                                                    OPTIONAL MATCH (r)<-[rel]-()
-                                                    DELETE rel, r
-                                                """, {"url": file_url})
+                                            delete_uploaded_report(file_url)
                                             st.success("✅ Lab Report deleted.")
                                             st.rerun()
                                         else:
@@ -965,22 +798,15 @@ else:
                             for report in scan_reports:
                                 file_url = report["url"]
                                 uploaded_at = format_datetime(report.get("uploaded_at"))
-                                filename = file_url.split("/")[-1]
                                 
                                 st.markdown(f"🕒 `{uploaded_at}`")
                                 st.markdown(f"[📂 View Scan]({file_url})")
                                 
-                                if st.button(f"🗑️ Delete", key=f"del_case_scan_{case['CaseID']}_{filename}"):
+                                if st.button(f"🗑️ Delete", key=f"del_case_scan_{case['CaseID']}_{file_url}"):
                                     try:
-                                        import requests
-                                        delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
+                                        delete_res = blob_store.delete(file_url)
                                         if delete_res.ok:
-                                            with driver.session() as session:
-                                                session.run("""
-                                                    MATCH (r:UploadedReport {url: $url})
-                                                    OPTIONAL MATCH (r)<-[rel]-()
-                                                    DELETE rel, r
-                                                """, {"url": file_url})
+                                            delete_uploaded_report(file_url)
                                             st.success("✅ Scan Report deleted.")
                                             st.rerun()
                                         else:
@@ -998,22 +824,15 @@ else:
                             for report in clinical_insights:
                                 file_url = report["url"]
                                 uploaded_at = format_datetime(report.get("uploaded_at"))
-                                filename = file_url.split("/")[-1]
                                 
                                 st.markdown(f"🕒 `{uploaded_at}`")
                                 st.markdown(f"[📂 View Insight PDF]({file_url})")
                                 
-                                if st.button(f"🗑️ Delete", key=f"del_case_insight_{case['CaseID']}_{filename}"):
+                                if st.button(f"🗑️ Delete", key=f"del_case_insight_{case['CaseID']}_{file_url}"):
                                     try:
-                                        import requests
-                                        delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
+                                        delete_res = blob_store.delete(file_url)
                                         if delete_res.ok:
-                                            with driver.session() as session:
-                                                session.run("""
-                                                    MATCH (r:UploadedReport {url: $url})
-                                                    OPTIONAL MATCH (r)<-[rel]-()
-                                                    DELETE rel, r
-                                                """, {"url": insight["url"]})
+                                            delete_uploaded_report(file_url)
                                             st.success("✅ Clinical Insight deleted.")
                                             st.rerun()
                                         else:
@@ -1032,145 +851,123 @@ else:
                 # --- Run Multimodal Gemini Agent ---
                 st.markdown("### 🤖 Generate AI Clinical Insight")
 
-                if st.button(f"💡 Generate Multimodal Insight", key=f"gen_insight_{case['CaseID']}"):
+                generate_col, refresh_col = st.columns(2)
+                generate = generate_col.button(f"💡 Generate Multimodal Insight", key=f"gen_insight_{case['CaseID']}")
+                force = refresh_col.button("🔄 Force refresh", key=f"force_insight_{case['CaseID']}")
+                if generate or force:
                     # with st.spinner("🧠 Analyzing case with Gemini 2.5 Flash..."):
 
-                        # 1. Fetch saved summary from Neo4j
-                        with driver.session() as session:
-                            result = session.run("""
-                                MATCH (c:Case {case_id: $case_id})
-                                RETURN c.case_summary AS summary
-                            """, {"case_id": case["CaseID"]})
-                            record = result.single()
-                            summary = record["summary"] if record and record["summary"] else ""
-
-                        # 2. Fetch latest lab & scan reports from UploadedReport nodes
-                        with driver.session() as session:
-                            result = session.run("""
-                                MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport)
-                                RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at
-                                ORDER BY r.uploaded_at DESC
-                            """, {"case_id": case["CaseID"]})
-                            reports = result.data()
-
-                        latest_lab = next((r for r in reports if r["type"] == "lab"), None)
-                        latest_scan = next((r for r in reports if r["type"] == "scan"), None)
-
-                        import requests
-                        from io import BytesIO
-
-                        lab_data = None
-                        scan_image = None
-
-                        # 3. Load and parse lab report (CSV or PDF)
-                        if latest_lab:
-                            try:
-                                response = requests.get(latest_lab["url"])
-                                if response.ok:
-                                    file = BytesIO(response.content)
-                                    file.name = latest_lab["url"].split("/")[-1]
-                                    lab_data = parse_lab_file(file)
-                                else:
-                                    st.warning("⚠️ Couldn't fetch the lab report file.")
-                            except Exception as e:
-                                st.error(f"⚠️ Failed to load lab report: {e}")
-
-                        # 4. Load scan image and encode
-                        if latest_scan:
-                            try:
-                                response = requests.get(latest_scan["url"])
-                                if response.ok:
-                                    file_content = response.content
-                                    # Check for DICOM magic word (DICM)
-                                    if file_content[128:132] == b'DICM':
-                                        st.warning("DICOM files require specialized handling and cannot be directly displayed as images or processed by the current image encoder.")
-                                        scan_image = None # Set to None as it's not a displayable image for current setup
-                                    else:
-                                        scan_image = encode_image(BytesIO(file_content))
-                                else:
-                                    st.warning("⚠️ Couldn't fetch the scan image file.")
-                            except Exception as e:
-                                st.error(f"⚠️ Failed to load scan image: {e}")
+                        # 1. Saved summary (already loaded with the case)
+                        summary = case["Summary"] or ""
 
-                        # 5. Build multimodal prompt & call Gemini
-                        prompt = build_multimodal_prompt(summary, lab_data, "Radiology image attached." if scan_image else None)
+                        # 2. Latest lab & scan reports (already loaded and sorted newest first)
+                        latest_lab = next(iter(case["LabReports"]), None)
+                        latest_scan = next(iter(case["ScanReports"]), None)
+                        fingerprint = input_fingerprint(
+                            summary, latest_lab["url"] if latest_lab else None, latest_scan["url"] if latest_scan else None
+                        )
 
-                        # 6. Run Gemini Agent and Show Result
                         st.markdown("## 🧾 Gemini AI Output")
 
-                        # Call Gemini once and also generate PDF
-                        with st.spinner("💬 Generating clinical insight with Gemini..."):
-                            gemini_text, pdf_url = call_gemini(prompt, images=[scan_image] if scan_image else [], case_id=case["CaseID"])
-
-                            if not gemini_text or gemini_text.startswith("❌"):
-                                st.error(gemini_text)
-                            else:
-                                # Display all sections
-                                sections = gemini_text.split("### ")
-                                for idx, section in enumerate(sections):
-                                    if not section.strip():
-                                        continue
-
-                                    lines = section.strip().splitlines()
-                                    title = lines[0].strip(":").strip()
-                                    content = "\n".join(lines[1:]).strip()
-
-                                    if title.lower().startswith("soap note"):
-                                        st.markdown(f"### 🩺 **{title}**")
-                                        st.markdown(content)
-
-                                    elif title.lower().startswith("differential diagnoses"):
-                                        st.markdown(f"### 🧠 **{title}**")
-                                        st.markdown(content)
-
-                                    elif title.lower().startswith("recommended investigations"):
-                                        st.markdown(f"### 🔬 **{title}**")
-                                        st.markdown(content)
-
-                                    elif title.lower().startswith("treatment suggestions"):
-                                        st.markdown(f"### 💊 **{title}**")
-                                        st.markdown(content)
-
-                                    elif title.lower().startswith("file interpretations"):
-                                        st.markdown("### 📂 **File Interpretations**")
-                                        st.markdown(content)
-
-                                    elif title.lower().startswith("confidence score"):
-                                        if content:
-                                            st.success(f"✅ Confidence Score: {content}")
-                                        else:
-                                            next_idx = idx + 1
-                                            if next_idx < len(sections):
-                                                next_lines = sections[next_idx].strip().splitlines()
-                                                next_content = "\n".join(next_lines).strip()
-                                                if not next_lines[0].lower().startswith("###"):
-                                                    st.success(f"✅ Confidence Score: {next_content}")
-                                                else:
-                                                    st.info("ℹ️ Confidence score not provided.")
+                        # Unchanged summary and reports: show the stored insight instead of calling Gemini again
+                        stored = None if force else find_insight_by_fingerprint(case["CaseID"], fingerprint)
+                        if stored:
+                            st.info(f"♻️ Reused insight from {format_datetime(stored['uploaded_at'])} — the summary and reports are unchanged. Use Force refresh to regenerate.")
+                            gemini_text = stored["text"]
+                            pdf_url = stored["url"]
+                        else:
+                            # 3-4. Download + parse the lab report and download + encode the scan in parallel
+                            inputs = prefetch_insight_inputs(latest_lab, latest_scan)
+                            lab_data = inputs["lab_data"]
+                            scan_image = inputs["scan_image"]
+                            if "lab" in inputs["errors"]:
+                                st.warning(f"⚠️ Failed to load lab report: {inputs['errors']['lab']}")
+                            if "scan" in inputs["errors"]:
+                                st.warning(f"⚠️ Failed to load scan image: {inputs['errors']['scan']}")
+
+                            # 5. Build multimodal prompt within the token budget
+                            prompt, prompt_report = build_budgeted_prompt(
+                                summary, lab_data, inputs["scan_description"] if scan_image else None
+                            )
+                            st.caption(f"🧮 Prompt: ~{prompt_report['total_tokens']:,} tokens"
+                                       + (f" · trimmed {'; '.join(prompt_report['trimmed'])}" if prompt_report["trimmed"] else ""))
+
+                            # 6. Call Gemini once and also generate PDF
+                            with st.spinner("💬 Generating clinical insight with Gemini..."):
+                                result = call_gemini(
+                                    prompt, images=[scan_image] if scan_image else [], case_id=case["CaseID"], use_cache=not force
+                                )
+                            gemini_text = result["text"]
+                            pdf_url = result["pdf_url"]
+
+                            # Save PDF URL in Neo4j with the fingerprint of its inputs, so unchanged cases can reuse it
+                            if pdf_url and gemini_text and not gemini_text.startswith("❌"):
+                                link_uploaded_report(case["CaseID"], pdf_url, "prescription", {
+                                    "insight_text": gemini_text,
+                                    "input_fingerprint": fingerprint,
+                                    "prompt_tokens": prompt_report["total_tokens"],
+                                    "prompt_trimmed": prompt_report["trimmed"],
+                                })
+
+                        if not gemini_text or gemini_text.startswith("❌"):
+                            st.error(gemini_text)
+                        else:
+                            # Display all sections
+                            sections = gemini_text.split("### ")
+                            for idx, section in enumerate(sections):
+                                if not section.strip():
+                                    continue
+
+                                lines = section.strip().splitlines()
+                                title = lines[0].strip(":").strip()
+                                content = "\n".join(lines[1:]).strip()
+
+                                if title.lower().startswith("soap note"):
+                                    st.markdown(f"### 🩺 **{title}**")
+                                    st.markdown(content)
+
+                                elif title.lower().startswith("differential diagnoses"):
+                                    st.markdown(f"### 🧠 **{title}**")
+                                    st.markdown(content)
+
+                                elif title.lower().startswith("recommended investigations"):
+                                    st.markdown(f"### 🔬 **{title}**")
+                                    st.markdown(content)
+
+                                elif title.lower().startswith("treatment suggestions"):
+                                    st.markdown(f"### 💊 **{title}**")
+                                    st.markdown(content)
+
+                                elif title.lower().startswith("file interpretations"):
+                                    st.markdown("### 📂 **File Interpretations**")
+                                    st.markdown(content)
+
+                                elif title.lower().startswith("confidence score"):
+                                    if content:
+                                        st.success(f"✅ Confidence Score: {content}")
+                                    else:
+                                        next_idx = idx + 1
+                                        if next_idx < len(sections):
+                                            next_lines = sections[next_idx].strip().splitlines()
+                                            next_content = "\n".join(next_lines).strip()
+                                            if not next_lines[0].lower().startswith("###"):
+                                                st.success(f"✅ Confidence Score: {next_content}")
                                             else:
                                                 st.info("ℹ️ Confidence score not provided.")
-                                    else:
-                                        st.markdown(f"### {title}")
-                                        st.markdown(content)
-
-                                # 7. Save PDF URL in Neo4j + Show Download Button
-                                if pdf_url:
-                                    with driver.session() as session:
-                                        session.run("""
-                                            MATCH (c:Case {case_id: $case_id})-[:BELONGS_TO]->(p:Patient)
-                                            CREATE (r:UploadedReport {
-                                                url: $url,
-                                                type: "prescription",
-                                                uploaded_at: datetime()
-                                            })
-                                            MERGE (c)-[:HAS_REPORT]->(r)
-                                            MERGE (p)-[:HAS_UPLOADED]->(r)
-                                        """, {"case_id": case["CaseID"], "url": pdf_url})
-                                    
-                                    st.success("✅ Clinical Insight PDF exported, uploaded, and saved in Neo4j!")
-                                    st.markdown(f"🔗 [⬇️ Click to Download Clinical Insight PDF]({pdf_url})")
+                                        else:
+                                            st.info("ℹ️ Confidence score not provided.")
                                 else:
-                                    st.warning("⚠️ Clinical Insight PDF export failed. Please try again.")
+                                    st.markdown(f"### {title}")
+                                    st.markdown(content)
+
+                            # 7. Show Download Button
+                            if pdf_url:
+                                if not stored:
+                                    st.success("✅ Clinical Insight PDF exported, uploaded, and saved in Neo4j!")
+                                st.markdown(f"🔗 [⬇️ Click to Download Clinical Insight PDF]({pdf_url})")
+                            else:
+                                st.warning("⚠️ Clinical Insight PDF export failed. Please try again.")
+
 
                         # # 8. Feedback
                         # col1, col2 = st.columns(2)
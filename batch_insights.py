@@ -0,0 +1,180 @@
+"""
+Nightly batch generation of clinical insights for every open case.
+
+Walks all cases that have a summary or reports, skips those whose newest
+insight was generated from the same inputs (same input fingerprint), and generates the rest with a
+bounded number of concurrent Gemini calls. `--tpm` / `--rpm` set the limits
+of the shared Gemini rate limiter (GEMINI_TPM / GEMINI_RPM by default).
+Each result is exported as a PDF and stored as a `prescription`
+UploadedReport (with the insight text on the node).
+
+Progress is checkpointed to a JSON file after every case, so an interrupted
+run can be resumed: cases already completed with the same inputs are
+skipped.
+
+    python batch_insights.py --concurrency 4 --tpm 200000
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from agents.gemini_agent import call_gemini, get_resilience_stats, set_gemini_concurrency, set_gemini_rate_limits
+from agents.insight_inputs import input_fingerprint, prefetch_insight_inputs
+from agents.prompt_builder import build_budgeted_prompt
+from agents.tokens import estimate_cost, estimate_request_tokens, estimate_tokens
+from utils.neo4j_repository import fetch_cases_for_insights, link_uploaded_report
+
+CHECKPOINT_FILE = "batch_insights_checkpoint.json"
+
+
+class Checkpoint:
+    """case_id -> {fingerprint, status, pdf_url, finished_at}, rewritten atomically after each case."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_done(self, case_id, fingerprint):
+        entry = self.entries.get(case_id)
+        return bool(entry and entry["status"] == "done" and entry["fingerprint"] == fingerprint)
+
+    def record(self, case_id, fingerprint, status, pdf_url=None):
+        with self._lock:
+            self.entries[case_id] = {
+                "fingerprint": fingerprint,
+                "status": status,
+                "pdf_url": pdf_url,
+                "finished_at": time.time(),
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class BatchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.counts = {"generated": 0, "cached": 0, "skipped": 0, "failed": 0}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.waited_at_start = get_resilience_stats()["limiter"]["waited_seconds"]
+
+    def add(self, outcome, input_tokens=0, output_tokens=0):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        processed = self.counts["generated"] + self.counts["cached"]
+        print("\n=== Batch insight run ===")
+        print(f"Cases: {self.counts}")
+        print(f"Elapsed: {elapsed:.1f}s — {processed / elapsed * 60 if elapsed else 0:.1f} insights/min")
+        print(f"Tokens (est.): {self.input_tokens} in / {self.output_tokens} out "
+              f"({(self.input_tokens + self.output_tokens) / elapsed * 60 if elapsed else 0:,.0f} tokens/min)")
+        print(f"Rate limiter wait: {get_resilience_stats()['limiter']['waited_seconds'] - self.waited_at_start:.1f}s")
+        print(f"Estimated cost: ${estimate_cost(self.input_tokens, self.output_tokens):.4f}")
+
+
+def generate_case_insight(case, stats, checkpoint, fingerprint, force=False):
+    case_id = case["CaseID"]
+    inputs = prefetch_insight_inputs(
+        {"url": case["LabUrl"]} if case["LabUrl"] else None,
+        {"url": case["ScanUrl"]} if case["ScanUrl"] else None,
+    )
+    for input_name, error in inputs["errors"].items():
+        print(f"  {case_id}: ⚠️ {input_name} input unavailable: {error}")
+
+    scan_image = inputs["scan_image"]
+    images = [scan_image] if scan_image else []
+    prompt, prompt_report = build_budgeted_prompt(
+        case["Summary"] or "", inputs["lab_data"], inputs["scan_description"] if scan_image else None
+    )
+    for trimmed in prompt_report["trimmed"]:
+        print(f"  {case_id}: ✂️ {trimmed}")
+    input_tokens = estimate_request_tokens(prompt, images)
+
+    result = call_gemini(prompt, images=images, case_id=case_id, use_cache=not force)
+    if result["text"].startswith("❌") or not result["pdf_url"]:
+        raise RuntimeError(result["text"] if result["text"].startswith("❌") else "PDF export failed")
+
+    link_uploaded_report(case_id, result["pdf_url"], "prescription", {
+        "insight_text": result["text"],
+        "input_fingerprint": fingerprint,
+        "prompt_tokens": prompt_report["total_tokens"],
+        "prompt_trimmed": prompt_report["trimmed"],
+        "source": "batch",
+    })
+    checkpoint.record(case_id, fingerprint, "done", result["pdf_url"])
+
+    if result["cached"]:
+        stats.add("cached")  # no tokens spent
+    else:
+        stats.add("generated", input_tokens, estimate_tokens(result["text"]))
+    print(f"  {case_id}: ✅ {result['pdf_url']}{' (cached)' if result['cached'] else ''}")
+
+
+def run_batch(concurrency=2, tokens_per_minute=None, checkpoint_path=CHECKPOINT_FILE, force=False, limit=None,
+              requests_per_minute=None):
+    set_gemini_concurrency(concurrency)
+    set_gemini_rate_limits(requests_per_minute, tokens_per_minute)
+    checkpoint = Checkpoint(checkpoint_path)
+    stats = BatchStats()
+
+    pending = []
+    for case in fetch_cases_for_insights():
+        fingerprint = input_fingerprint(case["Summary"], case["LabUrl"], case["ScanUrl"])
+        if case["InsightFingerprint"]:
+            unchanged = case["InsightFingerprint"] == fingerprint
+        else:
+            unchanged = not case["NeedsInsight"]  # insight stored before fingerprints existed
+        if not force and (unchanged or checkpoint.is_done(case["CaseID"], fingerprint)):
+            stats.add("skipped")
+            continue
+        pending.append((case, fingerprint))
+    if limit:
+        pending = pending[:limit]
+    print(f"🗂️ {len(pending)} case(s) need an insight, {stats.counts['skipped']} unchanged.")
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-insight") as executor:
+        futures = {
+            executor.submit(generate_case_insight, case, stats, checkpoint, fingerprint, force): (case, fingerprint)
+            for case, fingerprint in pending
+        }
+        for future in as_completed(futures):
+            case, fingerprint = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                checkpoint.record(case["CaseID"], fingerprint, "failed")
+                stats.add("failed")
+                print(f"  {case['CaseID']}: ❌ {e}")
+
+    stats.report()
+    return stats
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate clinical insights for every case with changed inputs.")
+    arg_parser.add_argument("--concurrency", type=int, default=2, help="concurrent Gemini calls")
+    arg_parser.add_argument("--tpm", type=int, help="input tokens per minute limit (default GEMINI_TPM, 0 = unlimited)")
+    arg_parser.add_argument("--rpm", type=int, help="requests per minute limit (default GEMINI_RPM, 0 = unlimited)")
+    arg_parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="checkpoint file used to resume runs")
+    arg_parser.add_argument("--force", action="store_true", help="regenerate even when inputs are unchanged")
+    arg_parser.add_argument("--limit", type=int, help="process at most this many cases")
+    args = arg_parser.parse_args()
+    run_batch(args.concurrency, args.tpm, args.checkpoint, args.force, args.limit, args.rpm)
@@ -0,0 +1,144 @@
+"""
+Local stand-in for the Gemini REST API, for exercising the client's rate
+limiter, retries and circuit breaker without spending quota.
+
+    python fake_gemini_server.py --port 8765 --error-rate 0.3 --latency 0.5
+    GEMINI_API_ENDPOINT=http://localhost:8765 streamlit run home.py
+
+Serves `models/*:generateContent` and `models/*:streamGenerateContent` with a
+canned insight. Failures are injected as 429 (over --rpm), 503 (--error-rate,
+--fail-first) or slow responses (--latency, --hang-rate).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_INSIGHT = """### SOAP Note:
+S: Summary received by the fake Gemini server.
+O: No real model was called.
+A: Test response.
+P: None.
+
+### Differential Diagnoses:
+- Not applicable (fake response)
+
+### Recommended Investigations:
+- None
+
+### Treatment Suggestions:
+- None
+
+### File Interpretations:
+- Inputs were not analysed.
+
+### Confidence Score (0–1):
+0.0
+"""
+
+
+class FakeGeminiState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.requests = deque()  # timestamps within the last minute
+        self.served = 0
+
+    def fault(self):
+        """Status code to fail this request with, or None to answer it."""
+        with self.lock:
+            self.served += 1
+            now = time.monotonic()
+            while self.requests and now - self.requests[0] >= 60:
+                self.requests.popleft()
+            self.requests.append(now)
+            if self.args.rpm and len(self.requests) > self.args.rpm:
+                return 429
+            if self.served <= self.args.fail_first or random.random() < self.args.error_rate:
+                return 503
+        return None
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if state.args.latency:
+                time.sleep(state.args.latency)
+            if random.random() < state.args.hang_rate:
+                time.sleep(3600)  # let the client's deadline fire
+
+            status = state.fault()
+            if status:
+                reason = "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"
+                self._send_json(status, {"error": {"code": status, "message": f"Fake {reason}", "status": reason}})
+                return
+
+            if ":streamGenerateContent" in self.path:
+                self._stream()
+            elif ":generateContent" in self.path:
+                self._send_json(200, _response(CANNED_INSIGHT))
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def _stream(self):
+            # The REST transport reads a streamed JSON array of responses
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            pieces = CANNED_INSIGHT.split("### ")
+            chunks = [pieces[0]] + ["### " + piece for piece in pieces[1:]]
+            for index, text in enumerate(chunk for chunk in chunks if chunk):
+                self._write_chunk(("[" if index == 0 else ",") + json.dumps(_response(text)))
+                time.sleep(state.args.chunk_delay)
+            self._write_chunk("]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            if not state.args.quiet:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def _response(text):
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(text) // 4},
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fake Gemini REST API with injectable failures.")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    arg_parser.add_argument("--chunk-delay", type=float, default=0.2, help="seconds between streamed chunks")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    arg_parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of requests that never answer")
+    arg_parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with 503")
+    arg_parser.add_argument("--rpm", type=int, default=0, help="answer with 429 beyond this many requests per minute")
+    arg_parser.add_argument("--quiet", action="store_true")
+    args = arg_parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(FakeGeminiState(args)))
+    print(f"🧪 Fake Gemini API on http://127.0.0.1:{args.port} (set GEMINI_API_ENDPOINT to use it)")
+    server.serve_forever()
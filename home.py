@@ -1,17 +1,24 @@
 import streamlit as st
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
-import os
 import pandas as pd
 from audiorecorder import audiorecorder
-from agents.prompt_builder import build_multimodal_prompt
-from agents.file_parser import parse_lab_file, encode_image
-from agents.gemini_agent import call_gemini
-from agents.gemini_agent import store_feedback_to_file
+from agents.insight_pipeline import submit_insight_job
+from agents.insight_sections import IncrementalSectionParser, split_sections
+from agents.transcriber import transcribe_audio_segment
+from agents.gemini_agent import store_feedback_to_file, get_resilience_stats, get_single_flight_stats
+from utils.neo4j_repository import (
+    get_driver, fetch_all_doctors, get_doctor_profile, doctor_exists, is_doctor_registered,
+    create_doctor_login, validate_doctor_login, fetch_case_dashboard, update_case_summary,
+    fetch_all_reports, link_uploaded_report, delete_uploaded_report,
+)
+from utils.schema import ensure_schema
+from utils.job_queue import get_job_queue, QUEUED, RUNNING, DONE, FAILED, FINISHED_STATUSES
+from utils import blob_cache, blob_store
+from agents import dicom_ingest
 from datetime import datetime, date # Import datetime and date for filtering
 from dateutil import parser
 import pytz # Ensure pytz is imported at the top level
-import requests # Added for SeaweedFS deletion
+import requests # ConnectionError raised by SeaweedFS calls
 import re
 import torch
 
@@ -42,10 +49,8 @@ def format_datetime(datetime_value):
 
 # -------- Load env and connect to Neo4j --------
 load_dotenv()
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+driver = get_driver() # Shared, pooled driver; not rebuilt on Streamlit reruns
+ensure_schema(driver) # Applies pending constraint/index migrations once per process
 
 # -------- UI Config --------
 st.set_page_config(page_title="Clinical Assistant", page_icon="🩺", layout="wide")
@@ -78,45 +83,166 @@ body {
 
 # -------- Utility Functions (keep these here for app.py's own use) --------
 # The add_new_case_to_neo4j and delete_case_from_neo4j will be moved to the new page.
-def fetch_all_doctors():
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor) RETURN d.id AS id, d.name AS name, d.role AS role")
-        return [{"id": r["id"], "name": r["name"], "role": r["role"]} for r in result]
+def register_doctor_login(doctor_id, password):
+    if not doctor_exists(doctor_id):
+        return False, "Doctor ID not found in system."
+    if is_doctor_registered(doctor_id):
+        return False, "Doctor already registered."
+    create_doctor_login(doctor_id, password)
+    return True, "Registration successful!"
+
+
+def render_insight_section(title, content):
+    """Render one `### ` section of the Gemini insight with its icon and formatting."""
+    # Handle different sections with appropriate icons and formatting
+    title_lower = title.lower()
+    if "soap note" in title_lower:
+        st.markdown(f"### 🩺 **{title}**")
+        st.markdown(content)
+    elif "differential diagnos" in title_lower:
+        st.markdown(f"### 🧠 **{title}**")
+        st.markdown(content)
+    elif "recommended investigation" in title_lower or "investigation" in title_lower:
+        st.markdown(f"### 🔬 **{title}**")
+        st.markdown(content)
+    elif "treatment" in title_lower:
+        st.markdown(f"### 💊 **{title}**")
+        st.markdown(content)
+    elif "file interpretation" in title_lower:
+        st.markdown("### 📂 **File Interpretations**")
+        st.markdown(content)
+    elif "confidence" in title_lower:
+        # Simplified confidence score handling
+        if content.strip():
+            # Extract numeric confidence if present
+            confidence_match = re.search(r'(\d+(?:\.\d+)?%?)', content)
+            if confidence_match:
+                confidence_value = confidence_match.group(1)
+                st.success(f"✅ **Confidence Score:** {confidence_value}")
+            else:
+                st.success(f"✅ **Confidence Score:** {content}")
+        else:
+            # If no content, try to find it in the title itself
+            confidence_match = re.search(r'(\d+(?:\.\d+)?%?)', title)
+            if confidence_match:
+                confidence_value = confidence_match.group(1)
+                st.success(f"✅ **Confidence Score:** {confidence_value}")
+            else:
+                st.info("ℹ️ Confidence score not provided.")
+    else:
+        # Generic section
+        st.markdown(f"### 📋 **{title}**")
+        if content:
+            st.markdown(content)
+        else:
+            st.info("No additional details provided for this section.")
 
-def get_doctor_name(doctor_id):
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d.name AS name", {"doctor_id": doctor_id})
-        r = result.single()
-        return r["name"] if r else "Doctor"
 
-def register_doctor_login(doctor_id, password):
-    with driver.session() as session:
-        if not session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d", {"doctor_id": doctor_id}).single():
-            return False, "Doctor ID not found in system."
-        if session.run("MATCH (d:DoctorLogin {id: $doctor_id}) RETURN d", {"doctor_id": doctor_id}).single():
-            return False, "Doctor already registered."
-        session.run("CREATE (d:DoctorLogin {id: $doctor_id, password: $password})", {"doctor_id": doctor_id, "password": password})
-        return True, "Registration successful!"
+def render_dicom_caption(data):
+    """One-line DICOM metadata from the header of an already downloaded file."""
+    header = dicom_ingest.read_header(data)
+    details = [str(header[field]) for field in ("Modality", "BodyPartExamined", "StudyDate") if header.get(field)]
+    st.caption(" · ".join(details + [f"{header['NumberOfFrames']} frame(s)"]))
+
+
+def render_scan_preview(file_url):
+    """Thumbnail of a scan, fetched only when the preview is opened; DICOM files are rasterised in the decode pool."""
+    try:
+        data = blob_cache.fetch(file_url)
+        if dicom_ingest.is_dicom(data):
+            render_dicom_caption(data)
+            st.image(dicom_ingest.thumbnail_in_pool(data), width=256)
+        else:
+            st.image(data, width=256)
+    except Exception as e:
+        st.warning(f"⚠️ Preview unavailable: {e}")
+
+
+def _render_job_view(job, case_id):
+    """Show status, live sections and the result of a background insight job."""
+    job_queue = get_job_queue()
+    job_id = job["id"]
+    st.markdown("## 🧾 Gemini AI Output")
+    status = job["status"]
+
+    if status in (QUEUED, RUNNING):
+        if status == QUEUED:
+            st.info("⏳ Insight request queued...")
+        else:
+            st.info(f"💬 Generating clinical insight with Gemini... (attempt {job['attempts']}/{job['max_attempts']})")
+        # Sections whose next heading has already arrived are complete
+        section_parser = IncrementalSectionParser()
+        for title, content in section_parser.feed(job["progress"] or ""):
+            render_insight_section(title, content)
+        if section_parser.pending:
+            st.markdown(section_parser.pending)
+        if st.button("✖️ Cancel", key=f"cancel_insight_{case_id}"):
+            job_queue.cancel(job_id)
+            st.rerun()
+        if not POLL_WITH_FRAGMENT and st.button("🔄 Refresh status", key=f"refresh_insight_{case_id}"):
+            st.rerun()
+
+    elif status == DONE:
+        result = job["result"]
+        for input_name, error in (result.get("input_errors") or {}).items():
+            st.warning(f"⚠️ Failed to load {input_name} report: {error}")
+        if result.get("reused"):
+            st.info(f"♻️ Reused insight from {format_datetime(result.get('reused_from'))} — the summary and reports are unchanged. Use Force refresh to regenerate.")
+        elif result.get("cached"):
+            st.caption("⚡ Served from the response cache (no new Gemini call).")
+        else:
+            st.caption("✨ Freshly generated.")
+        prompt_report = result.get("prompt") or {}
+        if prompt_report.get("total_tokens"):
+            st.caption(f"🧮 Prompt: ~{prompt_report['total_tokens']:,} tokens"
+                       + (f" · trimmed {'; '.join(prompt_report['trimmed'])}" if prompt_report.get("trimmed") else ""))
+        for title, content in split_sections(result["text"]):
+            render_insight_section(title, content)
+        # The job already linked the PDF to the case as a prescription report
+        if result.get("reused") and result.get("pdf_url"):
+            st.markdown(f"🔗 [⬇️ Click to Download Clinical Insight PDF]({result['pdf_url']})")
+        elif result.get("pdf_url"):
+            st.success("✅ Clinical Insight PDF exported, uploaded, and saved in Neo4j!")
+            st.markdown(f"🔗 [⬇️ Click to Download Clinical Insight PDF]({result['pdf_url']})")
+        else:
+            st.warning("⚠️ Clinical Insight PDF export failed. Please try again.")
+
+    else:
+        if status == FAILED:
+            st.error(job["error"] or "❌ Insight generation failed.")
+        else:
+            st.info("Insight generation was cancelled.")
+        if st.button("🔁 Retry", key=f"retry_insight_{case_id}"):
+            job_queue.retry(job_id)
+            st.rerun()
+
+
+# Poll running jobs in place when this Streamlit version supports fragments
+POLL_WITH_FRAGMENT = hasattr(st, "fragment")
+
+
+def _poll_insight_job(job_id, case_id):
+    job = get_job_queue().get_job(job_id)
+    if job is None:
+        return
+    if job["status"] in FINISHED_STATUSES:
+        st.rerun()  # re-render the page once so the finished job is shown without polling
+    _render_job_view(job, case_id)
 
-def validate_doctor_login(doctor_id, password):
-    with driver.session() as session:
-        return session.run(
-            "MATCH (d:DoctorLogin {id: $doctor_id, password: $password}) RETURN d",
-            {"doctor_id": doctor_id, "password": password}
-        ).single() is not None
 
-def fetch_cases_for_doctor(doctor_id):
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
-            RETURN c.case_id AS CaseID,
-                   p.id AS PatientID,
-                   p.name AS PatientName,
-                   c.case_summary AS Summary,
-                   c.created_at AS CreatedAt
-            ORDER BY c.created_at DESC
-        """, {"doctor_id": doctor_id})
-        return [r.data() for r in result]
+if POLL_WITH_FRAGMENT:
+    _poll_insight_job = st.fragment(run_every=2)(_poll_insight_job)
+
+
+def render_insight_job(job_id, case_id):
+    """Render a job; only queued or running jobs are polled, finished ones are static."""
+    job = get_job_queue().get_job(job_id)
+    if job is None:
+        return
+    if job["status"] in FINISHED_STATUSES or not POLL_WITH_FRAGMENT:
+        _render_job_view(job, case_id)
+    else:
+        _poll_insight_job(job_id, case_id)
 
 
 # -------- Streamlit App UI --------
@@ -134,15 +260,13 @@ if "logged_in_doctor" not in st.session_state:
         login_id = st.text_input("Doctor ID")
         login_password = st.text_input("Password", type="password")
         if st.button("Login"):
-            with driver.session() as session:
-                registered = session.run("MATCH (d:DoctorLogin {id: $login_id}) RETURN d", {"login_id": login_id}).single()
-                if not registered:
-                    st.warning("⚠️ Doctor not registered. Please register before logging in.")
-                elif validate_doctor_login(login_id, login_password):
-                    st.session_state.logged_in_doctor = login_id
-                    st.rerun()
-                else:
-                    st.error("❌ Incorrect password. Please try again.")
+            if not is_doctor_registered(login_id):
+                st.warning("⚠️ Doctor not registered. Please register before logging in.")
+            elif validate_doctor_login(login_id, login_password):
+                st.session_state.logged_in_doctor = login_id
+                st.rerun()
+            else:
+                st.error("❌ Incorrect password. Please try again.")
 
     with tabs[1]:
         st.subheader("Register")
@@ -159,12 +283,22 @@ if "logged_in_doctor" not in st.session_state:
 else:
     doctor_id = st.session_state.logged_in_doctor
 
-    with driver.session() as session:
-        result = session.run("MATCH (d:Doctor {id: $doctor_id}) RETURN d.name AS name, d.role AS role", {"doctor_id": doctor_id})
-        record = result.single()
-        doctor_name = record["name"] if record else "Unknown"
-        doctor_role = record["role"] if record else "Unknown"
+    record = get_doctor_profile(doctor_id)
+    doctor_name = record["name"] if record else "Unknown"
+    doctor_role = record["role"] if record else "Unknown"
     st.success(f"👋 Welcome, {doctor_name} ({doctor_role}, {doctor_id})")
+
+    gemini_health = get_resilience_stats()
+    if gemini_health["breaker"]["state"] != "closed":
+        st.warning("⚠️ The Gemini API is currently failing; insight requests fail fast until it recovers.")
+    with st.expander("🩺 Gemini API health"):
+        col_state, col_calls, col_retries, col_wait = st.columns(4)
+        col_state.metric("Circuit", gemini_health["breaker"]["state"])
+        col_calls.metric("Calls (ok / failed)", f"{gemini_health['successes']} / {gemini_health['failures']}")
+        col_retries.metric("Retries", gemini_health["retries"])
+        col_wait.metric("Rate-limit wait", f"{gemini_health['limiter']['waited_seconds']}s")
+        flights = get_single_flight_stats()
+        st.caption(f"Identical requests served by an in-flight call: {flights['shared'] + flights['shared_across_processes']}")
     st.markdown("---") # Separator
 
 
@@ -194,7 +328,7 @@ else:
             st.session_state["date_end_filter"] = None
             st.rerun()
     # -------- Assigned Cases (now with filtering) --------
-    cases = fetch_cases_for_doctor(doctor_id)
+    cases = fetch_case_dashboard(doctor_id) # Cases with summaries and reports in one query
     if cases:
         df_all_cases = pd.DataFrame(cases)
         # Convert 'CreatedAt' to datetime objects for proper comparison
@@ -245,24 +379,14 @@ else:
             st.rerun()
 
     elif command_mode == "🎤 Dictate with Mic":
-        import whisper
-        import tempfile
-        import os
-
         audio = audiorecorder("🎤 Click to Record", "🛑 Stop Recording", key="cmd_audio_recorder_global")
 
         if len(audio) > 0:
             st.audio(audio.export().read(), format="audio/wav")
 
             if st.button("📝 Transcribe & Run Command", key="run_mic_cmd_global"):
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-                    audio.export(tmp.name, format="wav")
-                    temp_path = tmp.name
-
                 with st.spinner("Transcribing audio..."):
-                    model = whisper.load_model("base")
-                    result = model.transcribe(temp_path)
-                    os.remove(temp_path)
+                    result = transcribe_audio_segment(audio)
                     transcription = result["text"]
                     st.json(result)
                 
@@ -290,6 +414,7 @@ else:
                     command=user_command_to_execute,
                     driver=driver
                 )
+                st.caption("⚡ Parsed locally" if result.get("parser") == "rules" else "🤖 Parsed with Gemini")
                 
                 if result['success']:
                     
@@ -351,13 +476,7 @@ else:
 
     # -------- Patient-wise Report Viewer --------
     st.markdown("## 📁 All Uploaded Reports & Clinical Insights")
-    with driver.session() as session:
-        reports = session.run("""
-            MATCH (p:Patient)<-[:BELONGS_TO]-(c:Case)-[:HAS_REPORT]->(r:UploadedReport)
-            RETURN p.name AS PatientName, p.id AS PatientID, c.case_id AS CaseID,
-                r.type AS Type, r.url AS URL, r.uploaded_at AS UploadedAt
-            ORDER BY r.uploaded_at DESC
-        """).data()
+    reports = fetch_all_reports()
     if reports:
         lab_reports = []
         scan_reports = []
@@ -391,37 +510,25 @@ else:
                         st.info(f"Attempting to delete Lab Report URL: `{report['url']}`")
                         try:
                             # Delete from SeaweedFS
-                            seaweed_response = requests.delete(report['url'])
+                            seaweed_response = blob_store.delete(report['url'])
                             if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                 st.success(f"✅ File deleted from SeaweedFS: {report['url']}")
                             else:
                                 st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: `{seaweed_response.status_code}`, Response: `{seaweed_response.text}`). Neo4j deletion only.")
                             # Delete from Neo4j
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "lab")
                             st.success("✅ Lab report deleted from Neo4j!")
                             st.rerun()
                         except requests.exceptions.ConnectionError:
                             st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "lab")
                             st.success("✅ Lab report deleted from Neo4j!")
                             st.rerun()
                         except Exception as e:
                             st.error(f"❌ An error occurred during deletion: {e}")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "lab")
                             st.success("✅ Lab report deleted from Neo4j!")
                             st.rerun()
                     st.markdown("---")
@@ -437,37 +544,25 @@ else:
                         st.info(f"Attempting to delete Scan Report URL: `{report['url']}`")
                         try:
                             # Delete from SeaweedFS
-                            seaweed_response = requests.delete(report['url'])
+                            seaweed_response = blob_store.delete(report['url'])
                             if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                 st.success(f"✅ File deleted from SeaweedFS: {report['url']}")
                             else:
                                 st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: `{seaweed_response.status_code}`, Response: `{seaweed_response.text}`). Neo4j deletion only.")
                             # Delete from Neo4j
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "scan")
                             st.success("✅ Scan report deleted from Neo4j!")
                             st.rerun()
                         except requests.exceptions.ConnectionError:
                             st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "scan")
                             st.success("✅ Scan report deleted from Neo4j!")
                             st.rerun()
                         except Exception as e:
                             st.error(f"❌ An error occurred during deletion: {e}")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                    DETACH DELETE r
-                                """, {"url": report['url']})
+                            delete_uploaded_report(report['url'], "scan")
                             st.success("✅ Scan report deleted from Neo4j!")
                             st.rerun()
                     st.markdown("---")
@@ -483,37 +578,25 @@ else:
                         st.info(f"Attempting to delete Clinical Insight URL: `{insight['url']}`")
                         try:
                             # Delete from SeaweedFS
-                            seaweed_response = requests.delete(insight['url'])
+                            seaweed_response = blob_store.delete(insight['url'])
                             if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                 st.success(f"✅ File deleted from SeaweedFS: {insight['url']}")
                             else:
                                 st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: `{seaweed_response.status_code}`, Response: `{seaweed_response.text}`). Neo4j deletion only.")
                             # Delete from Neo4j
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                    DETACH DELETE r
-                                """, {"url": insight['url']})
+                            delete_uploaded_report(insight['url'], "prescription")
                             st.success("✅ Clinical Insight deleted from Neo4j!")
                             st.rerun()
                         except requests.exceptions.ConnectionError:
                             st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                    DETACH DELETE r
-                                """, {"url": insight['url']})
+                            delete_uploaded_report(insight['url'], "prescription")
                             st.success("✅ Clinical Insight deleted from Neo4j!")
                             st.rerun()
                         except Exception as e:
                             st.error(f"❌ An error occurred during deletion: {e}")
                             st.info("Attempting to delete from Neo4j only...")
-                            with driver.session() as session:
-                                session.run("""
-                                    MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                    DETACH DELETE r
-                                """, {"url": insight['url']})
+                            delete_uploaded_report(insight['url'], "prescription")
                             st.success("✅ Clinical Insight deleted from Neo4j!")
                             st.rerun()
                     st.markdown("---")
@@ -546,43 +629,17 @@ else:
                     key=f"scan_{case['CaseID']}"
                 )
 
-                def upload_to_seaweed(file, filename):
-                    import requests
-                    files = {'file': (filename, file)}
-                    res = requests.post("http://localhost:8888/seaweedfs/" + filename, files=files)
-                    if res.status_code == 201:
-                        return f"http://localhost:8888/seaweedfs/{filename}"
-                    return None
-
                 if lab_file and st.button(f"Submit Lab Report", key=f"lab_submit_{case['CaseID']}"):
-                    file_url = upload_to_seaweed(lab_file, f"{case['CaseID']}_lab_{lab_file.name}")
+                    file_url = blob_store.upload(f"{case['CaseID']}_lab_{lab_file.name}", lab_file)
                     if file_url:
-                        with driver.session() as session:
-                            session.run("""
-                                MATCH (c:Case {case_id: $case_id})-[:BELONGS_TO]->(p:Patient)
-                                CREATE (r:UploadedReport {url: $url, type: "lab", uploaded_at: datetime()})
-                                MERGE (c)-[:HAS_REPORT]->(r)
-                                MERGE (p)-[:HAS_UPLOADED]->(r)
-                            """, {
-                                "case_id": case["CaseID"],
-                                "url": file_url
-                            })
+                        link_uploaded_report(case["CaseID"], file_url, "lab")
                         st.success("✅ Lab Report uploaded and linked to both Case and Patient.")
                         st.rerun()
 
                 if scan_file and st.button(f"Submit Radiology Scan", key=f"scan_submit_{case['CaseID']}"):
-                    file_url = upload_to_seaweed(scan_file, f"{case['CaseID']}_scan_{scan_file.name}")
+                    file_url = blob_store.upload(f"{case['CaseID']}_scan_{scan_file.name}", scan_file)
                     if file_url:
-                        with driver.session() as session:
-                            session.run("""
-                                MATCH (c:Case {case_id: $case_id})-[:BELONGS_TO]->(p:Patient)
-                                CREATE (r:UploadedReport {url: $url, type: "scan", uploaded_at: datetime()})
-                                MERGE (c)-[:HAS_REPORT]->(r)
-                                MERGE (p)-[:HAS_UPLOADED]->(r)
-                            """, {
-                                "case_id": case["CaseID"],
-                                "url": file_url
-                            })
+                        link_uploaded_report(case["CaseID"], file_url, "scan")
                         st.success("✅ Scan uploaded and linked to both Case and Patient.")
                         st.rerun()
 
@@ -594,13 +651,7 @@ else:
                     key=f"summary_mode_{case['CaseID']}"
                 )
                 if summary_mode == "📖 View Saved Summary":
-                    with driver.session() as session:
-                        result = session.run("""
-                            MATCH (c:Case {case_id: $case_id})
-                            RETURN c.case_summary AS summary
-                        """, {"case_id": case["CaseID"]})
-                        record = result.single()
-                        saved_summary = record["summary"] if record and record["summary"] else "⚠️ No summary saved yet."
+                    saved_summary = case["Summary"] or "⚠️ No summary saved yet."
                     st.text_area("📄 Saved Summary", value=saved_summary, height=200, disabled=True)
 
 
@@ -610,56 +661,32 @@ else:
                 if mode == "🧾 Type Summary":
                     typed_summary = st.text_area("Enter case summary manually", height=150, key=f"typed_summary_{case['CaseID']}")
                     if st.button("💾 Save Typed Summary", key=f"save_typed_{case['CaseID']}"):
-                        with driver.session() as session:
-                            session.run("""
-                                MATCH (c:Case {case_id: $case_id})
-                                SET c.case_summary = $summary,
-                                    c.modified_at = datetime()
-                            """, {"case_id": case["CaseID"], "summary": typed_summary})
+                        update_case_summary(case["CaseID"], typed_summary)
 
                         st.success("📝 Summary saved to Neo4j.")
                         st.rerun()
                 elif mode == "🎤 Dictate with Mic":
-                    import whisper
-                    import tempfile
-                    import os
                     audio = audiorecorder("🎤 Click to Record", "🛑 Stop Recording", key=f"audio_recorder_{case['CaseID']}")
                     if len(audio) > 0:
                         st.audio(audio.export().read(), format="audio/wav")
                         if st.button("📝 Transcribe & Save", key=f"mic_save_{case['CaseID']}"):
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-                                audio.export(tmp.name, format="wav")
-                                temp_path = tmp.name
                             with st.spinner("Transcribing..."):
-                                model = whisper.load_model("base")
-                                result = model.transcribe(temp_path)
-                                os.remove(temp_path)
+                                result = transcribe_audio_segment(audio)
                                 transcription = result["text"]
                                 st.json(result)
                             st.success("✅ Transcription complete!")
                             st.text_area("🧾 Transcribed Summary", value=transcription, height=150)
-                            with driver.session() as session:
-                                session.run("""
-                                MATCH (c:Case {case_id: $case_id})
-                                SET c.case_summary = $summary,
-                                    c.modified_at = datetime()
-                            """, {"case_id": case["CaseID"], "summary": transcription})
+                            update_case_summary(case["CaseID"], transcription)
                             st.success("📝 Summary saved to Neo4j.")
                             st.rerun()
                 # ---- Uploaded Files for this Case ----
-                with driver.session() as session:
-                    result = session.run("""
-                        MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport)
-                        RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at
-                        ORDER BY r.uploaded_at DESC
-                    """, {"case_id": case["CaseID"]})
-                    report_records = result.data()
+                report_records = case["Reports"]
                 if report_records:
                     st.markdown("### 📂 All Reports for This Case")
-                    # Separate reports by type
-                    lab_reports = [r for r in report_records if r["type"] == "lab"]
-                    scan_reports = [r for r in report_records if r["type"] == "scan"]
-                    clinical_insights = [r for r in report_records if r["type"] == "prescription"]
+                    # Reports arrive already grouped by type from the dashboard query
+                    lab_reports = case["LabReports"]
+                    scan_reports = case["ScanReports"]
+                    clinical_insights = case["Insights"]
                     # Display in organized sections
                     report_cols = st.columns(3)
                     # Lab Reports Column
@@ -674,37 +701,25 @@ else:
                                 if st.button(f"🗑️ Delete", key=f"delete_case_lab_report_{file_url}"):
                                     try:
                                         # Delete from SeaweedFS
-                                        seaweed_response = requests.delete(file_url)
+                                        seaweed_response = blob_store.delete(file_url)
                                         if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                             st.success(f"✅ File deleted from SeaweedFS: {file_url}")
                                         else:
                                             st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: {seaweed_response.status_code}). Neo4j deletion only.")
                                         # Delete from Neo4j
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "lab")
                                         st.success("✅ Lab report deleted from Neo4j!")
                                         st.rerun()
                                     except requests.exceptions.ConnectionError:
                                         st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                                         st.info("Attempting to delete from Neo4j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "lab")
                                         st.success("✅ Lab report deleted from Neo4j!")
                                         st.rerun()
                                     except Exception as e:
                                         st.error(f"❌ An error occurred during deletion: {e}")
                                         st.info("Attempting to delete from Neo44j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "lab"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "lab")
                                         st.success("✅ Lab report deleted from Neo4j!")
                                         st.rerun()
                                 st.markdown("---")
@@ -719,40 +734,30 @@ else:
                                 uploaded_at = format_datetime(report.get("uploaded_at"))
                                 st.markdown(f"🕒 `{uploaded_at}`")
                                 st.markdown(f"[📂 View Scan]({file_url})")
+                                if st.toggle("🖼️ Preview", key=f"preview_scan_{file_url}"):
+                                    render_scan_preview(file_url)
                                 if st.button(f"🗑️ Delete", key=f"delete_case_scan_report_{file_url}"):
                                     try:
                                         # Delete from SeaweedFS
-                                        seaweed_response = requests.delete(file_url)
+                                        seaweed_response = blob_store.delete(file_url)
                                         if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                             st.success(f"✅ File deleted from SeaweedFS: {file_url}")
                                         else:
                                             st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: {seaweed_response.status_code}). Neo4j deletion only.")
                                         # Delete from Neo4j
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "scan")
                                         st.success("✅ Scan report deleted from Neo4j!")
                                         st.rerun()
                                     except requests.exceptions.ConnectionError:
                                         st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                                         st.info("Attempting to delete from Neo4j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "scan")
                                         st.success("✅ Scan report deleted from Neo4j!")
                                         st.rerun()
                                     except Exception as e:
                                         st.error(f"❌ An error occurred during deletion: {e}")
                                         st.info("Attempting to delete from Neo4j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "scan"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "scan")
                                         st.success("✅ Scan report deleted from Neo4j!")
                                         st.rerun()
                                 st.markdown("---")
@@ -770,37 +775,25 @@ else:
                                 if st.button(f"🗑️ Delete", key=f"delete_case_clinical_insight_{file_url}"):
                                     try:
                                         # Delete from SeaweedFS
-                                        seaweed_response = requests.delete(file_url)
+                                        seaweed_response = blob_store.delete(file_url)
                                         if seaweed_response.status_code == 200 or seaweed_response.status_code == 204:
                                             st.success(f"✅ File deleted from SeaweedFS: {file_url}")
                                         else:
                                             st.warning(f"⚠️ Failed to delete file from SeaweedFS (Status: {seaweed_response.status_code}). Neo4j deletion only.")
                                         # Delete from Neo4j
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "prescription")
                                         st.success("✅ Clinical Insight deleted from Neo4j!")
                                         st.rerun()
                                     except requests.exceptions.ConnectionError:
                                         st.error("❌ Could not connect to SeaweedFS. Please ensure it is running.")
                                         st.info("Attempting to delete from Neo4j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "prescription")
                                         st.success("✅ Clinical Insight deleted from Neo4j!")
                                         st.rerun()
                                     except Exception as e:
                                         st.error(f"❌ An error occurred during deletion: {e}")
                                         st.info("Attempting to delete from Neo4j only...")
-                                        with driver.session() as session_delete:
-                                            session_delete.run("""
-                                                MATCH (r:UploadedReport {url: $url, type: "prescription"})
-                                                DETACH DELETE r
-                                            """, {"url": file_url})
+                                        delete_uploaded_report(file_url, "prescription")
                                         st.success("✅ Clinical Insight deleted from Neo4j!")
                                         st.rerun()
                                 st.markdown("---")
@@ -810,170 +803,16 @@ else:
                     st.info("ℹ️ No reports uploaded for this case.")
                 # --- Run Multimodal Gemini Agent ---
                 st.markdown("### 🤖 Generate AI Clinical Insight")
-                if st.button(f"💡 Generate Multimodal Insight", key=f"gen_insight_{case['CaseID']}"):
-                    # with st.spinner("🧠 Analyzing case with Gemini 2.5 Flash..."):
-                    
-                        # 1. Fetch saved summary from Neo4j
-
-                        with driver.session() as session:
-                            result = session.run("""
-                                MATCH (c:Case {case_id: $case_id})
-                                RETURN c.case_summary AS summary
-                            """, {"case_id": case["CaseID"]})
-                            record = result.single()
-                            saved_summary_from_db = record["summary"] if record and record["summary"] else "" # Renamed var
-
-                        # 2. Fetch latest lab & scan reports from UploadedReport nodes
-
-                        with driver.session() as session:
-                            result = session.run("""
-                                MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport)
-                                RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at
-                                ORDER BY r.uploaded_at DESC
-                            """, {"case_id": case["CaseID"]})
-                            reports_for_agent = result.data() # Renamed var
-                        latest_lab = next((r for r in reports_for_agent if r["type"] == "lab"), None)
-                        latest_scan = next((r for r in reports_for_agent if r["type"] == "scan"), None)
-                        import requests
-                        from io import BytesIO
-                        lab_data = None
-                        scan_image = None
-                        # 3. Load and parse lab report (CSV or PDF)
-                        
-                        if latest_lab:
-                            try:
-                                response = requests.get(latest_lab["url"])
-                                if response.ok:
-                                    file = BytesIO(response.content)
-                                    file.name = latest_lab["url"].split("/")[-1]
-                                    lab_data = parse_lab_file(file)
-                                else:
-                                    st.warning("⚠️ Couldn't fetch the lab report file.")
-                            except Exception as e:
-                                st.error(f"⚠️ Failed to load lab report: {e}")
-                        # 4. Load scan image and encode
-                        import pydicom
-                        import matplotlib.pyplot as plt
-                        from PIL import Image
-                        import io
-
-                        scan_image = None
-                        scan_description = None
-
-                        if latest_scan:
-                            try:
-                                response = requests.get(latest_scan["url"])
-                                if response.ok:
-                                    file_content = response.content
-                                    # Check if it's a DICOM file
-                                    if file_content[128:132] == b'DICM':
-                                        dicom_file = BytesIO(file_content)
-                                        ds = pydicom.dcmread(dicom_file)
-
-                                        # Convert pixel array to a PIL image
-                                        img = Image.fromarray(ds.pixel_array).convert("L")  # Grayscale
-                                        buffered = io.BytesIO()
-                                        img.save(buffered, format="PNG")
-                                        buffered.seek(0)
-
-                                        scan_image = encode_image(buffered)
-                                        scan_description = "Radiology scan (DICOM) image attached."
-                                    else:
-                                        # Treat as standard image (jpg, jpeg, png)
-                                        scan_image = encode_image(BytesIO(file_content))
-                                        scan_description = "Radiology scan (image) attached."
-                                else:
-                                    st.warning("⚠️ Couldn't fetch the scan image file.")
-                            except Exception as e:
-                                st.error(f"⚠️ Failed to load scan file: {e}")
-
-
-                        # 5. Build multimodal prompt & call Gemini
-                        prompt = build_multimodal_prompt(saved_summary_from_db, lab_data, scan_description if scan_image else None)
-
-                        # 6. Run Gemini Agent and Show Result
-                        st.markdown("## 🧾 Gemini AI Output")
-
-                        # Call Gemini once and also generate PDF
-                        with st.spinner("💬 Generating clinical insight with Gemini..."):
-                            result = call_gemini(prompt, images=[scan_image] if scan_image else [], case_id=case["CaseID"], doctor_id=doctor_id)
-                            gemini_text = result["text"]
-                            pdf_url = result["pdf_url"]
-
-                            if not gemini_text or gemini_text.startswith("❌"):
-                                st.error(gemini_text)
-                            else:
-                                # Display all sections
-                                sections = gemini_text.split("### ")
-                                for idx, section in enumerate(sections):
-                                    if not section.strip():
-                                        continue
-                                    lines = section.strip().splitlines()
-                                    if not lines:
-                                        continue
-                                    title = lines[0].strip(":").strip()
-                                    content = "\n".join(lines[1:]).strip() if len(lines) > 1 else ""
-                                    # Handle different sections with appropriate icons and formatting
-                                    title_lower = title.lower()
-                                    if "soap note" in title_lower:
-                                        st.markdown(f"### 🩺 **{title}**")
-                                        st.markdown(content)
-                                    elif "differential diagnos" in title_lower:
-                                        st.markdown(f"### 🧠 **{title}**")
-                                        st.markdown(content)
-                                    elif "recommended investigation" in title_lower or "investigation" in title_lower:
-                                        st.markdown(f"### 🔬 **{title}**")
-                                        st.markdown(content)
-                                    elif "treatment" in title_lower:
-                                        st.markdown(f"### 💊 **{title}**")
-                                        st.markdown(content)
-                                    elif "file interpretation" in title_lower:
-                                        st.markdown("### 📂 **File Interpretations**")
-                                        st.markdown(content)
-                                    elif "confidence" in title_lower:
-                                        # Simplified confidence score handling
-                                        if content.strip():
-                                            # Extract numeric confidence if present
-                                            confidence_match = re.search(r'(\d+(?:\.\d+)?%?)', content)
-                                            if confidence_match:
-                                                confidence_value = confidence_match.group(1)
-                                                st.success(f"✅ **Confidence Score:** {confidence_value}")
-                                            else:
-                                                st.success(f"✅ **Confidence Score:** {content}")
-                                        else:
-                                            # If no content, try to find it in the title itself
-                                            confidence_match = re.search(r'(\d+(?:\.\d+)?%?)', title)
-                                            if confidence_match:
-                                                confidence_value = confidence_match.group(1)
-                                                st.success(f"✅ **Confidence Score:** {confidence_value}")
-                                            else:
-                                                st.info("ℹ️ Confidence score not provided.")
-                                    else:
-                                        # Generic section
-                                        st.markdown(f"### 📋 **{title}**")
-                                        if content:
-                                            st.markdown(content)
-                                        else:
-                                            st.info("No additional details provided for this section.")
-
-                                            
-                                # 7. Save PDF URL in Neo4j + Show Download Button
-                                if pdf_url:
-                                    with driver.session() as session:
-                                        session.run("""
-                                            MATCH (c:Case {case_id: $case_id})-[:BELONGS_TO]->(p:Patient)
-                                            CREATE (r:UploadedReport {
-                                                url: $url,
-                                                type: "prescription",
-                                                uploaded_at: datetime()
-                                            })
-                                            MERGE (c)-[:HAS_REPORT]->(r)
-                                            MERGE (p)-[:HAS_UPLOADED]->(r)
-                                        """, {"case_id": case["CaseID"], "url": pdf_url})
-                                    st.success("✅ Clinical Insight PDF exported, uploaded, and saved in Neo4j!")
-                                    st.markdown(f"🔗 [⬇️ Click to Download Clinical Insight PDF]({pdf_url})")
-                                else:
-                                    st.warning("⚠️ Clinical Insight PDF export failed. Please try again.")
+                insight_job_key = f"insight_job_{case['CaseID']}"
+                generate_col, refresh_col = st.columns([3, 1])
+                if generate_col.button(f"💡 Generate Multimodal Insight", key=f"gen_insight_{case['CaseID']}"):
+                    # Runs on the background job queue; reuses the stored insight if inputs are unchanged
+                    st.session_state[insight_job_key] = submit_insight_job(case, doctor_id)
+                if refresh_col.button("🔄 Force refresh", key=f"force_insight_{case['CaseID']}"):
+                    st.session_state[insight_job_key] = submit_insight_job(case, doctor_id, force=True)
+
+                if st.session_state.get(insight_job_key):
+                    render_insight_job(st.session_state[insight_job_key], case["CaseID"])
 
                 # Add feedback section - store in session state to persist across reruns
                 feedback_key = f"show_feedback_{case['CaseID']}"
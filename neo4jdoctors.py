@@ -1,37 +1,47 @@
-import pandas as pd
-from neo4j import GraphDatabase
-import os
+import argparse
 from dotenv import load_dotenv
 
+from utils.bulk_ingest import DEFAULT_BATCH_SIZE, IngestStats, iter_csv_batches, write_batches
+from utils.neo4j_repository import get_driver
+
 # Load credentials from .env
 load_dotenv()
 
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USER = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-
-# Neo4j connection
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+CSV_FILE = "sample_doctor.csv"
 
-# Read doctors.csv
-df = pd.read_csv("sample_doctor.csv")
 
 # Define Cypher upload logic
-def upload_doctors(tx, doctor_id, name, role):
+def upload_doctors(tx, rows):
     tx.run(
         """
-        MERGE (d:Doctor {id: $doctor_id})
-        SET d.name = $name,
-            d.role = $role
+        UNWIND $rows AS row
+        MERGE (d:Doctor {id: row.doctor_id})
+        SET d.name = row.doctor_name,
+            d.role = row.role
         """,
-        doctor_id=doctor_id,
-        name=name,
-        role=role,
+        rows=[{"doctor_id": r["doctor_id"], "doctor_name": r["doctor_name"], "role": r["role"]} for r in rows],
+    )
+
+
+def upload_doctors_to_neo4j(csv_file, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """Stream doctors from `csv_file` into Neo4j in UNWIND batches of `batch_size` rows."""
+    stats = IngestStats("Doctors")
+    result = write_batches(
+        get_driver(),
+        upload_doctors,
+        iter_csv_batches(csv_file, batch_size),
+        stats,
+        workers=workers,
+        partition_key="doctor_id",
     )
+    print("✅ Doctors uploaded successfully.")
+    return result
 
-# Write to Neo4j
-with driver.session() as session:
-    for _, row in df.iterrows():
-        session.execute_write(upload_doctors, row['doctor_id'], row['doctor_name'], row['role'])
 
-print("✅ Doctors uploaded successfully.")
\ No newline at end of file
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Bulk load doctors into Neo4j.")
+    arg_parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per UNWIND transaction")
+    arg_parser.add_argument("--workers", type=int, default=1, help="parallel writers, partitioned by doctor_id")
+    args = arg_parser.parse_args()
+    upload_doctors_to_neo4j(args.csv_file, batch_size=args.batch_size, workers=args.workers)
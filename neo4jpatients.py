@@ -1,67 +1,88 @@
-import os
-import pandas as pd
+import argparse
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+
+from utils.bulk_ingest import DEFAULT_BATCH_SIZE, IngestStats, iter_csv_batches, write_batches
+from utils.neo4j_repository import get_driver
+from utils.schema import ensure_schema
 
 # Load environment variables
 load_dotenv()
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 
 CSV_FILE = "sample_patient.csv"
 
-def upload_cases_to_neo4j(csv_file):
-    df = pd.read_csv(csv_file)
-    df.fillna("", inplace=True)
-
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
-
-    with driver.session() as session:
-        for _, row in df.iterrows():
-            session.run(
-                """
-                MERGE (d:Doctor {id: $doctor_id})
-
-                MERGE (p:Patient {id: $patient_id})
-                ON CREATE SET p.name = $patient_name
-
-                MERGE (c:Case {case_id: $case_id})
-                SET c.case_summary = $case_summary,
-                    c.created_at = datetime()
-
-                MERGE (d)-[:HANDLES]->(c)
-                MERGE (c)-[:BELONGS_TO]->(p)
-
-                WITH c, p, $lab_report_link AS lab_url, $scan_link AS scan_url
-
-                FOREACH (_ IN CASE WHEN lab_url <> "" THEN [1] ELSE [] END |
-                    CREATE (r1:Report {url: lab_url, type: "lab", uploaded_at: datetime()})
-                    MERGE (c)-[:HAS_REPORT]->(r1)
-                    CREATE (ur1:UploadedReport {url: lab_url, type: "lab", uploaded_at: datetime()})
-                    MERGE (p)-[:HAS_UPLOADED]->(ur1)
-                )
-
-                FOREACH (_ IN CASE WHEN scan_url <> "" THEN [1] ELSE [] END |
-                    CREATE (r2:Report {url: scan_url, type: "scan", uploaded_at: datetime()})
-                    MERGE (c)-[:HAS_REPORT]->(r2)
-                    CREATE (ur2:UploadedReport {url: scan_url, type: "scan", uploaded_at: datetime()})
-                    MERGE (p)-[:HAS_UPLOADED]->(ur2)
-                )
-                """,
-                {
-                    "case_id": row["case_id"],
-                    "patient_id": row["patient_id"],
-                    "patient_name": row["patient_name"],
-                    "doctor_id": row["doctor_id"],
-                    "lab_report_link": row["lab_report_link"],
-                    "scan_link": row["scan_link"],
-                    "case_summary": row["case_summary"]
-                }
-            )
-
-    driver.close()
+CASE_COLUMNS = ["case_id", "patient_id", "patient_name", "doctor_id", "lab_report_link", "scan_link", "case_summary"]
+
+
+def merge_case_batch(tx, rows):
+    """MERGE one batch of CSV rows (doctor, patient, case and report links) with a single UNWIND; safe to re-run."""
+    tx.run(
+        """
+        UNWIND $rows AS row
+        MERGE (d:Doctor {id: row.doctor_id})
+
+        MERGE (p:Patient {id: row.patient_id})
+        ON CREATE SET p.name = row.patient_name
+
+        MERGE (c:Case {case_id: row.case_id})
+        SET c.case_summary = row.case_summary,
+            c.created_at = datetime()
+
+        MERGE (d)-[:HANDLES]->(c)
+        MERGE (c)-[:BELONGS_TO]->(p)
+
+        WITH c, p, row.lab_report_link AS lab_url, row.scan_link AS scan_url
+
+        FOREACH (_ IN CASE WHEN lab_url <> "" THEN [1] ELSE [] END |
+            MERGE (r1:Report {url: lab_url})
+            ON CREATE SET r1.type = "lab", r1.uploaded_at = datetime()
+            MERGE (c)-[:HAS_REPORT]->(r1)
+            MERGE (ur1:UploadedReport {url: lab_url})
+            SET ur1.type = "lab", ur1.uploaded_at = datetime()
+            MERGE (p)-[:HAS_UPLOADED]->(ur1)
+        )
+
+        FOREACH (_ IN CASE WHEN scan_url <> "" THEN [1] ELSE [] END |
+            MERGE (r2:Report {url: scan_url})
+            ON CREATE SET r2.type = "scan", r2.uploaded_at = datetime()
+            MERGE (c)-[:HAS_REPORT]->(r2)
+            MERGE (ur2:UploadedReport {url: scan_url})
+            SET ur2.type = "scan", ur2.uploaded_at = datetime()
+            MERGE (p)-[:HAS_UPLOADED]->(ur2)
+        )
+        """,
+        rows=[{column: row.get(column, "") for column in CASE_COLUMNS} for row in rows],
+    )
+
+
+def upload_cases_to_neo4j(csv_file, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """
+    Stream `csv_file` into Neo4j in batches of `batch_size` rows.
+
+    With workers > 1, rows are partitioned by patient_id across parallel
+    writers: a patient's node and report URLs are only ever merged by one
+    worker. Doctors are shared across partitions, so the schema's uniqueness
+    constraints are applied first (MERGE then cannot create duplicates) and
+    lock conflicts on Doctor nodes are retried by `execute_write`.
+    """
+    driver = get_driver()
+    ensure_schema(driver)
+    stats = IngestStats("Cases")
+    result = write_batches(
+        driver,
+        merge_case_batch,
+        iter_csv_batches(csv_file, batch_size),
+        stats,
+        workers=workers,
+        partition_key="patient_id",
+    )
     print("✅ All cases and uploaded reports saved to Neo4j.")
+    return result
+
 
 if __name__ == "__main__":
-    upload_cases_to_neo4j(CSV_FILE)
+    arg_parser = argparse.ArgumentParser(description="Bulk load patients and cases into Neo4j.")
+    arg_parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per UNWIND transaction")
+    arg_parser.add_argument("--workers", type=int, default=1, help="parallel writers, partitioned by patient_id")
+    args = arg_parser.parse_args()
+    upload_cases_to_neo4j(args.csv_file, batch_size=args.batch_size, workers=args.workers)
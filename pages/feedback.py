@@ -1,28 +1,36 @@
 import streamlit as st
-import json
 import pandas as pd
 
-# Load feedback.jsonl
-feedback_file = "feedback_store.jsonl"
+from utils.feedback_store import get_feedback_store
 
-data = []
-with open(feedback_file, "r", encoding="utf-8") as f:
-    for line in f:
-        data.append(json.loads(line))
+RAW_PAGE_SIZE = 100
+TREND_WEEKS = 12
 
-if not data:
+store = get_feedback_store()
+summary = store.summary()  # read from the per-day rollup, not the individual events
+
+if not summary["total"]:
     st.warning("No feedback data found.")
 else:
-    df = pd.DataFrame(data)
-
     st.title("Feedback Responses Visualization")
 
-    # Bar chart: Count of good vs bad feedback
-    if "is_good" in df.columns:
-        feedback_counts = df["is_good"].value_counts()
-        st.subheader("Good vs Bad Feedback Count")
-        st.bar_chart(feedback_counts)
+    # Bar chart: Count of good vs poor feedback
+    st.subheader("Good vs Poor Feedback Count")
+    st.bar_chart(pd.Series({"good": summary["good"], "poor": summary["poor"]}, name="count"))
+    st.info(f"Overall satisfaction: {summary['good_rate'] * 100:.1f}% positive ({summary['total']} total feedback points)")
+
+    # Weekly good-rate per doctor
+    st.subheader(f"Good-rate per Week (last {TREND_WEEKS} weeks)")
+    trend = pd.DataFrame(store.weekly_trend(weeks=TREND_WEEKS))
+    if trend.empty:
+        st.caption("No feedback in this period.")
+    else:
+        st.line_chart(trend.pivot(index="week", columns="doctor_id", values="good_rate"))
+
+    st.subheader("By Doctor")
+    st.dataframe(pd.DataFrame(store.summary_by_doctor()), hide_index=True)
 
-    # Show raw data
+    # Show raw data, newest first, one page at a time
     if st.checkbox("Show raw data"):
-        st.write(df)
+        page = st.number_input("Page", min_value=1, max_value=max(1, -(-summary["total"] // RAW_PAGE_SIZE)), value=1)
+        st.write(pd.DataFrame(store.recent(limit=RAW_PAGE_SIZE, offset=(page - 1) * RAW_PAGE_SIZE)))
@@ -1,12 +1,18 @@
 import streamlit as st
-from neo4j import GraphDatabase
 from dotenv import load_dotenv
-import os
 import pandas as pd
 from datetime import datetime, date
 from dateutil import parser
 import pytz # Ensure pytz is imported at the top level
-import requests # Needed for SeaweedFS deletion
+from utils.neo4j_repository import (
+    get_driver, case_exists, create_case, delete_case, delete_patient,
+    fetch_report_urls_for_case, fetch_report_urls_for_patient, fetch_cases_for_doctor,
+    fetch_all_patients as repository_fetch_patients,
+    fetch_all_patients_with_cases as repository_fetch_patients_with_cases,
+)
+from utils import blob_store
+from utils import blob_cache  # noqa: F401 - registers cache invalidation on blob uploads/deletes
+from utils.id_allocator import next_case_id, next_patient_id, preview_case_id, preview_patient_id
 
 
 # --------- Date-Time Parser (Copy from app.py) --------------------
@@ -41,12 +47,9 @@ def format_datetime(datetime_value):
         return str(datetime_value)
 
 
-# -------- Load env and connect to Neo4j (Copy from app.py) --------
+# -------- Load env and connect to Neo4j --------
 load_dotenv()
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+driver = get_driver() # Shared with home.py; one pooled driver per process
 
 # -------- Utility Functions for Case Management --------
 # --- Handle form clearing flag ---
@@ -74,207 +77,73 @@ def clear_new_case_inputs():
     st.rerun()
 
     
-def _get_next_case_id(driver):
-    """
-    Generates the next available case ID based on existing case IDs (e.g., C001, C002, ...)
-    without using APOC.
-    """
-    with driver.session() as session:
-        # Fetch all case_ids that start with 'C'
-        result = session.run("""
-            MATCH (c:Case)
-            WHERE c.case_id STARTS WITH 'C'
-            RETURN c.case_id AS case_id
-        """)
-        
-        max_num = 0
-        for record in result:
-            case_id_str = record["case_id"]
-            try:
-                # Attempt to extract numeric part after 'C' and convert to int
-                num_part = int(case_id_str[1:])
-                max_num = max(max_num, num_part)
-            except ValueError:
-                # Ignore case_ids that do not follow the C### numeric format
-                continue # Skip invalid IDs and continue processing
-        
-        next_num = max_num + 1
-        return f"C{next_num:03d}" # Format as C001, C010, C123
-
-
-def _get_next_patient_id(driver):
-    """
-    Generates the next available patient ID based on existing patient IDs (e.g., P001, P002, ...)
-    without using APOC.
-    """
-    with driver.session() as session:
-        # Fetch all patient_ids that start with 'P'
-        result = session.run("""
-            MATCH (p:Patient)
-            WHERE p.id STARTS WITH 'P'
-            RETURN p.id AS patient_id
-        """)
-        
-        max_num = 0
-        for record in result:
-            patient_id_str = record["patient_id"]
-            try:
-                # Attempt to extract numeric part after 'P' and convert to int
-                num_part = int(patient_id_str[1:])
-                max_num = max(max_num, num_part)
-            except ValueError:
-                # Ignore patient_ids that do not follow the P### numeric format
-                continue # Skip invalid IDs and continue processing
-        
-        next_num = max_num + 1
-        return f"P{next_num:03d}" # Format as P001, P010, P123
-
-
-def fetch_patient_name_by_id(driver, patient_id):
-    """Fetches patient name given patient ID."""
-    with driver.session() as session:
-        result = session.run("MATCH (p:Patient {id: $patient_id}) RETURN p.name AS name", {"patient_id": patient_id})
-        record = result.single()
-        return record["name"] if record else None
-
-
-def add_new_case_to_neo4j(driver, patient_id, patient_name, case_id, case_summary, doctor_id):
+def add_new_case_to_neo4j(patient_id, patient_name, case_id, case_summary, doctor_id):
     """
     Adds a new case and patient (if new) to Neo4j,
     linked to the specified doctor.
     """
     try:
-        with driver.session() as session:
-            # First, check if the provided case_id already exists
-            existing_case = session.run("MATCH (c:Case {case_id: $case_id}) RETURN c", {"case_id": case_id}).single()
-            if existing_case:
-                return False, f"Case ID '{case_id}' already exists. Please choose a unique Case ID for a new case."
-
-            # If case_id is unique, proceed to create nodes and relationships
-            session.run(
-                """
-                MERGE (d:Doctor {id: $doctor_id}) // Ensure doctor exists or create if not (should exist from login)
-
-                MERGE (p:Patient {id: $patient_id}) // Create Patient if new, or use existing if ID matches
-                ON CREATE SET p.name = $patient_name // Only set name if patient is newly created
-
-                CREATE (c:Case {case_id: $case_id}) // Create a new Case node (ensured unique by check above)
-                SET c.case_summary = $case_summary,
-                    c.created_at = datetime() // Set creation timestamp
-
-                MERGE (d)-[:HANDLES]->(c) // Link Doctor to Case
-                MERGE (c)-[:BELONGS_TO]->(p) // Link Case to Patient
-                """,
-                {
-                    "doctor_id": doctor_id,
-                    "patient_id": patient_id,
-                    "patient_name": patient_name,
-                    "case_id": case_id,
-                    "case_summary": case_summary
-                }
-            )
-        return True, "✅ New case added successfully!"
+        # First, check if the provided case_id already exists
+        if case_exists(case_id):
+            return False, f"Case ID '{case_id}' already exists. Please choose a unique Case ID for a new case."
+
+        # If case_id is unique, proceed to create nodes and relationships
+        create_case(patient_id, patient_name, case_id, case_summary, doctor_id)
+        return True, f"✅ New case {case_id} added successfully!"
     except Exception as e:
         return False, f"❌ An error occurred while adding the case: {e}"
 
-def delete_case_from_neo4j(driver, case_id):
+def delete_case_from_neo4j(case_id):
     """
     Deletes a case and its associated reports and feedback from Neo4j.
     Does NOT delete the patient.
     """
     try:
-        with driver.session() as session:
-            # Query to find related report URLs to delete from SeaweedFS
-            report_urls_result = session.run(
-                """
-                MATCH (c:Case {case_id: $case_id})-[r_rel:HAS_REPORT]->(ur:UploadedReport)
-                RETURN ur.url AS url
-                """, {"case_id": case_id}
-            ).data()
-
-            # Delete files from SeaweedFS if they exist
-            if report_urls_result:
-                for record in report_urls_result:
-                    file_url = record["url"]
-                    if file_url: # Ensure URL is not empty
-                        filename = file_url.split("/")[-1]
-                        try:
-                            # Note: Ensure your SeaweedFS access is correctly configured (e.g., firewall)
-                            delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
-                            if delete_res.ok:
-                                st.info(f"🗑️ Deleted file from SeaweedFS: {filename}")
-                            else:
-                                st.warning(f"⚠️ Failed to delete file {filename} from SeaweedFS (Status: {delete_res.status_code}).")
-                        except Exception as e:
-                            st.error(f"❌ Error deleting file {filename} from SeaweedFS: {e}")
-
-            # Delete the case, its uploaded reports, and feedback nodes
-            session.run(
-                """
-                MATCH (c:Case {case_id: $case_id})
-                OPTIONAL MATCH (c)-[:HAS_REPORT]->(ur:UploadedReport)
-                OPTIONAL MATCH (c)-[:HAS_FEEDBACK]->(f:Feedback)
-                DETACH DELETE c, ur, f
-                """,
-                {"case_id": case_id}
-            )
+        # Find related report URLs to delete from SeaweedFS
+        report_urls = fetch_report_urls_for_case(case_id)
+
+        # Delete files from SeaweedFS if they exist
+        for file_url in report_urls:
+            try:
+                # Note: Ensure your SeaweedFS access is correctly configured (e.g., firewall)
+                delete_res = blob_store.delete(file_url)
+                if delete_res.ok:
+                    st.info(f"🗑️ Deleted file from SeaweedFS: {file_url}")
+                else:
+                    st.warning(f"⚠️ Failed to delete file {file_url} from SeaweedFS (Status: {delete_res.status_code}).")
+            except Exception as e:
+                st.error(f"❌ Error deleting file {file_url} from SeaweedFS: {e}")
+
+        # Delete the case, its uploaded reports, and feedback nodes
+        delete_case(case_id)
 
         return True, f"✅ Case '{case_id}' and its associated data deleted successfully!"
     except Exception as e:
         return False, f"❌ An error occurred while deleting case '{case_id}': {e}"
 
 
-def delete_patient_from_neo4j(driver, patient_id):
+def delete_patient_from_neo4j(patient_id):
     """
     Deletes a patient and ALL their associated cases, reports, and feedback from Neo4j.
     Also deletes files from SeaweedFS.
     """
     try:
-        with driver.session() as session:
-            # First, get all report URLs associated with this patient's cases
-            report_urls_result = session.run(
-                """
-                MATCH (p:Patient {id: $patient_id})<-[:BELONGS_TO]-(c:Case)-[:HAS_REPORT]->(ur:UploadedReport)
-                RETURN ur.url AS url
-                """, {"patient_id": patient_id}
-            ).data()
-
-            # Delete files from SeaweedFS if they exist
-            if report_urls_result:
-                for record in report_urls_result:
-                    file_url = record["url"]
-                    if file_url: # Ensure URL is not empty
-                        filename = file_url.split("/")[-1]
-                        try:
-                            delete_res = requests.delete(f"http://localhost:8888/seaweedfs/{filename}")
-                            if delete_res.ok:
-                                st.info(f"🗑️ Deleted file from SeaweedFS: {filename}")
-                            else:
-                                st.warning(f"⚠️ Failed to delete file {filename} from SeaweedFS (Status: {delete_res.status_code}).")
-                        except Exception as e:
-                            st.error(f"❌ Error deleting file {filename} from SeaweedFS: {e}")
-
-            # Get count of cases that will be deleted
-            case_count_result = session.run(
-                """
-                MATCH (p:Patient {id: $patient_id})<-[:BELONGS_TO]-(c:Case)
-                RETURN count(c) AS case_count
-                """, {"patient_id": patient_id}
-            ).single()
-            
-            case_count = case_count_result["case_count"] if case_count_result else 0
-
-            # Delete the patient and all associated cases, reports, and feedback
-            session.run(
-                """
-                MATCH (p:Patient {id: $patient_id})
-                OPTIONAL MATCH (p)<-[:BELONGS_TO]-(c:Case)
-                OPTIONAL MATCH (c)-[:HAS_REPORT]->(ur:UploadedReport)
-                OPTIONAL MATCH (c)-[:HAS_FEEDBACK]->(f:Feedback)
-                DETACH DELETE p, c, ur, f
-                """,
-                {"patient_id": patient_id}
-            )
+        # First, get all report URLs associated with this patient's cases
+        report_urls = fetch_report_urls_for_patient(patient_id)
+
+        # Delete files from SeaweedFS if they exist
+        for file_url in report_urls:
+            try:
+                delete_res = blob_store.delete(file_url)
+                if delete_res.ok:
+                    st.info(f"🗑️ Deleted file from SeaweedFS: {file_url}")
+                else:
+                    st.warning(f"⚠️ Failed to delete file {file_url} from SeaweedFS (Status: {delete_res.status_code}).")
+            except Exception as e:
+                st.error(f"❌ Error deleting file {file_url} from SeaweedFS: {e}")
+
+        # Delete the patient and all associated cases, reports, and feedback
+        case_count = delete_patient(patient_id)
 
         return True, f"✅ Patient '{patient_id}' and all {case_count} associated cases deleted successfully!"
     except Exception as e:
@@ -289,33 +158,7 @@ def fetch_all_patients_with_cases():
     if "logged_in_doctor" not in st.session_state or not st.session_state.logged_in_doctor:
         return []
 
-    doctor_id = st.session_state.logged_in_doctor
-
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
-            WHERE p.id IS NOT NULL AND p.name IS NOT NULL AND trim(p.name) <> ''
-            RETURN p.id AS patient_id, 
-                   p.name AS patient_name,
-                   collect(DISTINCT {case_id: c.case_id, summary: c.case_summary, created_at: c.created_at}) AS cases
-            ORDER BY p.name
-        """, {"doctor_id": doctor_id})
-        
-        patients_data = []
-        for record in result:
-            # Additional safety check in Python
-            patient_id = record["patient_id"]
-            patient_name = record["patient_name"]
-            
-            if patient_id and patient_name and patient_name.strip():
-                patient_data = {
-                    "id": patient_id,
-                    "name": patient_name.strip(),
-                    "cases": record["cases"]
-                }
-                patients_data.append(patient_data)
-        
-        return patients_data
+    return repository_fetch_patients_with_cases(st.session_state.logged_in_doctor)
 
 
 def fetch_all_patients():
@@ -326,43 +169,7 @@ def fetch_all_patients():
     if "logged_in_doctor" not in st.session_state or not st.session_state.logged_in_doctor:
         return []
 
-    doctor_id = st.session_state.logged_in_doctor
-
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
-            WHERE p.id IS NOT NULL AND p.name IS NOT NULL AND trim(p.name) <> ''
-            RETURN DISTINCT p.id AS id, p.name AS name
-            ORDER BY p.name
-        """, {"doctor_id": doctor_id})
-        
-        patients = []
-        for r in result:
-            patient_id = r["id"]
-            patient_name = r["name"]
-            
-            # Additional safety check
-            if patient_id and patient_name and patient_name.strip():
-                patients.append({"id": patient_id, "name": patient_name.strip()})
-        
-        return patients
-
-def fetch_cases_for_doctor(doctor_id): # Copied from app.py
-    """
-    Fetches all cases assigned to a specific doctor.
-    This ensures that only cases the logged-in doctor handles are displayed.
-    """
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
-            RETURN c.case_id AS CaseID,
-                   p.id AS PatientID,
-                   p.name AS PatientName,
-                   c.case_summary AS Summary,
-                   c.created_at AS CreatedAt
-            ORDER BY c.created_at DESC
-        """, {"doctor_id": doctor_id})
-        return [r.data() for r in result]
+    return repository_fetch_patients(st.session_state.logged_in_doctor)
 
 # -------- Streamlit Page UI --------
 st.set_page_config(page_title="Manage Cases", page_icon="⚙️", layout="wide")
@@ -466,9 +273,9 @@ with add_case_tabs[0]: # Add for Existing Patient
             else:
                 st.markdown("*No existing cases found for this patient.*")
 
-        # Auto-generate Case ID
-        auto_generated_case_id = _get_next_case_id(driver)
-        st.text_input("New Case ID (Auto-generated)", value=auto_generated_case_id, disabled=True, key="auto_case_id_existing")
+        # Preview the next Case ID; the real one is allocated on submit
+        st.session_state["auto_case_id_existing"] = preview_case_id()  # a keyed widget ignores later `value=` changes
+        st.text_input("New Case ID (Auto-generated)", disabled=True, key="auto_case_id_existing")
         
         new_case_summary_existing = st.text_area("Case Summary", height=100, key="new_case_summary_input_add_case_existing",
                                                   value=st.session_state.get("new_case_summary_input_add_case_existing", ""))
@@ -478,10 +285,9 @@ with add_case_tabs[0]: # Add for Existing Patient
                 st.warning("⚠️ Please select a patient and provide a case summary.")
             else:
                 success, message = add_new_case_to_neo4j(
-                    driver,
                     patient_data['id'],
                     patient_data['name'], 
-                    auto_generated_case_id,
+                    next_case_id(),
                     new_case_summary_existing.strip(),
                     doctor_id
                 )
@@ -495,16 +301,16 @@ with add_case_tabs[0]: # Add for Existing Patient
 with add_case_tabs[1]: # Add for New Patient
     st.markdown("### For a New Patient")
 
-    # Auto-generate Patient ID
-    auto_generated_patient_id = _get_next_patient_id(driver)
-    st.text_input("New Patient ID (Auto-generated)", value=auto_generated_patient_id, disabled=True, key="auto_patient_id_new")
+    # Preview the next Patient ID; the real one is allocated on submit
+    st.session_state["auto_patient_id_new"] = preview_patient_id()  # a keyed widget ignores later `value=` changes
+    st.text_input("New Patient ID (Auto-generated)", disabled=True, key="auto_patient_id_new")
     
     new_patient_name = st.text_input("New Patient Name (e.g., John Doe)", key="new_patient_name_input_add_case",
                                      value=st.session_state.get("new_patient_name_input_add_case", ""))
     
-    # Auto-generate Case ID
-    auto_generated_case_id_new = _get_next_case_id(driver)
-    st.text_input("New Case ID (Auto-generated)", value=auto_generated_case_id_new, disabled=True, key="auto_case_id_new")
+    # Preview the next Case ID; the real one is allocated on submit
+    st.session_state["auto_case_id_new"] = preview_case_id()  # a keyed widget ignores later `value=` changes
+    st.text_input("New Case ID (Auto-generated)", disabled=True, key="auto_case_id_new")
     
     new_case_summary_new = st.text_area("Case Summary", height=100, key="new_case_summary_input_add_case_new",
                                         value=st.session_state.get("new_case_summary_input_add_case_new", ""))
@@ -514,10 +320,9 @@ with add_case_tabs[1]: # Add for New Patient
             st.warning("⚠️ Please fill in the patient name and case summary.")
         else:
             success, message = add_new_case_to_neo4j(
-                driver,
-                auto_generated_patient_id,
+                next_patient_id(),
                 new_patient_name.strip(),
-                auto_generated_case_id_new,
+                next_case_id(),
                 new_case_summary_new.strip(),
                 doctor_id
             )
@@ -578,7 +383,7 @@ with delete_tabs[0]: # Delete Cases
                 
                 with col_confirm:
                     if st.button(f"**Confirm Delete Case '{case_id}'**", key=f"confirm_delete_case_action_{case_id}"):
-                        success, message = delete_case_from_neo4j(driver, case_id)
+                        success, message = delete_case_from_neo4j(case_id)
                         if success:
                             st.success(message)
                             del st.session_state[confirm_state_key] # Clear confirmation state
@@ -636,7 +441,7 @@ with delete_tabs[1]: # Delete Patients
                 
                 with col_confirm:
                     if st.button(f"**CONFIRM DELETE PATIENT '{patient_name}'**", key=f"confirm_delete_patient_action_{patient_id}"):
-                        success, message = delete_patient_from_neo4j(driver, patient_id)
+                        success, message = delete_patient_from_neo4j(patient_id)
                         if success:
                             st.success(message)
                             del st.session_state[confirm_state_key]
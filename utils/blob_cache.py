@@ -0,0 +1,221 @@
+"""
+Read-through on-disk cache for SeaweedFS blobs.
+
+Blob bodies are stored as files in BLOB_CACHE_DIR, with a small SQLite index
+holding each entry's ETag / Last-Modified, size and last access time.
+
+- Entries are keyed by their full filer URL, so blobs with the same name in
+  different directories never share an entry.
+- Every read revalidates with a conditional GET (If-None-Match /
+  If-Modified-Since); a 304 keeps the local copy and skips the body
+  transfer. BLOB_CACHE_MAX_AGE > 0 allows serving entries validated within
+  that many seconds without a request (off by default: a report re-uploaded
+  under the same name must never be served stale).
+- Files are written to a temp name and moved into place with os.replace,
+  so readers never see a partially written entry.
+- When the cache grows past BLOB_CACHE_MAX_BYTES, least recently used
+  entries are evicted.
+
+Importing this module registers `invalidate` as a blob_store upload and
+delete hook, so replacing or deleting a blob through blob_store also drops
+its cached copy.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from utils import blob_store
+
+# === Configuration ===
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "clinical_blob_cache"))
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+BLOB_CACHE_MAX_AGE = float(os.getenv("BLOB_CACHE_MAX_AGE", "0"))  # seconds served without revalidating
+
+_lock = threading.Lock()
+_db = None
+_stats = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def _cache_key(url):
+    return blob_store.url_for(url)
+
+
+def _path_for(key):
+    return os.path.join(BLOB_CACHE_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def _get_db():
+    # Called with _lock held.
+    global _db
+    if _db is None:
+        os.makedirs(BLOB_CACHE_DIR, exist_ok=True)
+        _db = sqlite3.connect(os.path.join(BLOB_CACHE_DIR, "index.sqlite3"), check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS blob_cache (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        _db.execute("CREATE INDEX IF NOT EXISTS blob_cache_last_access ON blob_cache (last_access)")
+        _db.commit()
+    return _db
+
+
+def fetch(url):
+    """Return the blob's bytes, from the local cache when it is still valid."""
+    key = _cache_key(url)
+    path = _path_for(key)
+    now = time.time()
+
+    with _lock:
+        row = _get_db().execute(
+            "SELECT etag, last_modified, validated_at FROM blob_cache WHERE key = ?", (key,)
+        ).fetchone()
+    if row and not os.path.exists(path):
+        row = None  # index entry without a file (e.g. cleaned tmp dir)
+
+    if row and BLOB_CACHE_MAX_AGE > 0 and now - row[2] < BLOB_CACHE_MAX_AGE:
+        data = _read(path)
+        if data is not None:
+            _touch(key, validated=False)
+            _count("hits")
+            return data
+
+    headers = {}
+    if row:
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+
+    response = blob_store.download(url, headers=headers)
+    if response.status_code == 304 and row:
+        data = _read(path)
+        if data is not None:
+            _touch(key, validated=True)
+            _count("revalidated")
+            return data
+        response = blob_store.download(url)  # local copy vanished; fetch unconditionally
+
+    if not response.ok:
+        raise RuntimeError(f"Couldn't fetch {key} (status {response.status_code}).")
+
+    data = response.content
+    _count("misses")
+    _store(key, path, data, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return data
+
+
+def invalidate(url):
+    """Drop the cached copy of `url`, if any."""
+    key = _cache_key(url)
+    with _lock:
+        _get_db().execute("DELETE FROM blob_cache WHERE key = ?", (key,))
+        _get_db().commit()
+        _stats["invalidations"] += 1
+    _remove(_path_for(key))
+
+
+def clear():
+    with _lock:
+        keys = [r[0] for r in _get_db().execute("SELECT key FROM blob_cache").fetchall()]
+        _get_db().execute("DELETE FROM blob_cache")
+        _get_db().commit()
+    for key in keys:
+        _remove(_path_for(key))
+
+
+def stats():
+    with _lock:
+        entries, size = _get_db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blob_cache").fetchone()
+        result = dict(_stats)
+    result.update({"entries": entries, "size_bytes": size, "max_bytes": BLOB_CACHE_MAX_BYTES})
+    return result
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _touch(key, validated):
+    now = time.time()
+    with _lock:
+        if validated:
+            _get_db().execute("UPDATE blob_cache SET last_access = ?, validated_at = ? WHERE key = ?", (now, now, key))
+        else:
+            _get_db().execute("UPDATE blob_cache SET last_access = ? WHERE key = ?", (now, key))
+        _get_db().commit()
+
+
+def _store(key, path, data, etag, last_modified):
+    if len(data) > BLOB_CACHE_MAX_BYTES:
+        return  # would evict everything else and still not fit
+
+    os.makedirs(BLOB_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_CACHE_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # atomic on the same filesystem
+    except OSError as e:
+        _remove(tmp_path)
+        print(f"Blob cache write failed for {key}: {e}")
+        return
+
+    now = time.time()
+    with _lock:
+        db = _get_db()
+        db.execute(
+            "INSERT OR REPLACE INTO blob_cache (key, etag, last_modified, size, validated_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, etag, last_modified, len(data), now, now),
+        )
+        db.commit()
+        evicted = _evict_locked(db)
+    for evicted_key in evicted:
+        _remove(_path_for(evicted_key))
+
+
+def _evict_locked(db):
+    """Remove least recently used index rows until the cache fits; return their keys."""
+    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blob_cache").fetchone()[0]
+    evicted = []
+    if total <= BLOB_CACHE_MAX_BYTES:
+        return evicted
+    for key, size in db.execute("SELECT key, size FROM blob_cache ORDER BY last_access ASC").fetchall():
+        if total <= BLOB_CACHE_MAX_BYTES:
+            break
+        db.execute("DELETE FROM blob_cache WHERE key = ?", (key,))
+        total -= size
+        evicted.append(key)
+    db.commit()
+    _stats["evictions"] += len(evicted)
+    return evicted
+
+
+blob_store.register_upload_hook(invalidate)
+blob_store.register_delete_hook(invalidate)
@@ -0,0 +1,175 @@
+"""
+Client for the SeaweedFS filer that stores uploaded reports and generated PDFs.
+
+All filer traffic goes through one pooled keep-alive `requests.Session` with
+connect/read timeouts and retry-with-backoff on connection errors and 5xx
+responses. Functions accept either a blob name ("C001_lab_cbc.csv") or a
+full filer URL, so URLs already stored in Neo4j keep working.
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# === Configuration ===
+SEAWEEDFS_FILER_URL = os.getenv("SEAWEEDFS_FILER_URL", "http://localhost:8888/seaweedfs/").rstrip("/") + "/"
+BLOB_CONNECT_TIMEOUT = float(os.getenv("BLOB_CONNECT_TIMEOUT", "3.05"))  # seconds
+BLOB_READ_TIMEOUT = float(os.getenv("BLOB_READ_TIMEOUT", "30"))  # seconds
+BLOB_MAX_RETRIES = int(os.getenv("BLOB_MAX_RETRIES", "3"))
+BLOB_BACKOFF_FACTOR = float(os.getenv("BLOB_BACKOFF_FACTOR", "0.5"))  # 0.5s, 1s, 2s, ...
+BLOB_POOL_SIZE = int(os.getenv("BLOB_POOL_SIZE", "20"))
+
+LATENCY_SAMPLES = 500  # recent samples kept per operation for percentiles
+
+_session = None
+_session_lock = threading.Lock()
+_upload_hooks = []
+_delete_hooks = []
+_latency = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+_counts = defaultdict(lambda: {"calls": 0, "errors": 0})
+_stats_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session, created on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=BLOB_MAX_RETRIES,
+                    connect=BLOB_MAX_RETRIES,
+                    read=BLOB_MAX_RETRIES,
+                    status=BLOB_MAX_RETRIES,
+                    backoff_factor=BLOB_BACKOFF_FACTOR,
+                    status_forcelist=(500, 502, 503, 504),
+                    # Filer writes and deletes are keyed by path, so they are safe to repeat.
+                    allowed_methods=frozenset({"GET", "HEAD", "POST", "PUT", "DELETE"}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def url_for(name_or_url):
+    """Full filer URL for a blob name; full URLs are returned unchanged."""
+    if name_or_url.startswith(("http://", "https://")):
+        return name_or_url
+    return SEAWEEDFS_FILER_URL + quote(name_or_url.lstrip("/"))
+
+
+def name_from_url(url):
+    return url.rstrip("/").split("/")[-1]
+
+
+def register_upload_hook(hook):
+    """Call `hook(url)` after every successful upload (e.g. to drop cached copies of the old bytes)."""
+    _upload_hooks.append(hook)
+
+
+def _run_hooks(hooks, url, kind):
+    for hook in list(hooks):
+        try:
+            hook(url)
+        except Exception as e:
+            print(f"Blob {kind} hook failed for {url}: {e}")
+
+
+def register_delete_hook(hook):
+    """Call `hook(url)` after every successful delete (e.g. to drop cached copies)."""
+    _delete_hooks.append(hook)
+
+
+def _request(operation, method, url, **kwargs):
+    kwargs.setdefault("timeout", (BLOB_CONNECT_TIMEOUT, BLOB_READ_TIMEOUT))
+    started = time.perf_counter()
+    failed = True
+    try:
+        response = get_session().request(method, url, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with _stats_lock:
+            _latency[operation].append(elapsed_ms)
+            _counts[operation]["calls"] += 1
+            if failed:
+                _counts[operation]["errors"] += 1
+
+
+# === Operations ===
+def upload(name, data, content_type=None):
+    """Upload bytes or a file-like object as `name`; return its URL, or None if the filer refused it."""
+    url = url_for(name)
+    file_tuple = (name_from_url(url), data, content_type) if content_type else (name_from_url(url), data)
+    response = _request("upload", "POST", url, files={"file": file_tuple})
+    if response.status_code in (200, 201):
+        _run_hooks(_upload_hooks, url, "upload")
+        return url
+    print(f"Failed to upload {name} to SeaweedFS: {response.status_code}")
+    return None
+
+
+def download(name_or_url, **kwargs):
+    """GET a blob; returns the response so callers can check `.ok` and read `.content`."""
+    return _request("download", "GET", url_for(name_or_url), **kwargs)
+
+
+def exists(name_or_url):
+    return _request("exists", "HEAD", url_for(name_or_url)).status_code == 200
+
+
+def metadata(name_or_url):
+    """ETag, Last-Modified and size of a blob from a HEAD request, or None if it is missing."""
+    response = _request("head", "HEAD", url_for(name_or_url))
+    if response.status_code != 200:
+        return None
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "size": int(response.headers.get("Content-Length") or 0),
+    }
+
+
+def delete(name_or_url):
+    """DELETE a blob; returns the response. Delete hooks run when the blob is gone (2xx or 404)."""
+    url = url_for(name_or_url)
+    response = _request("delete", "DELETE", url)
+    if response.ok or response.status_code == 404:
+        _run_hooks(_delete_hooks, url, "delete")
+    return response
+
+
+def list_blobs(directory=""):
+    """Names of the files in a filer directory (the base directory by default)."""
+    url = url_for(directory) if directory else SEAWEEDFS_FILER_URL
+    response = _request("list", "GET", url.rstrip("/") + "/", headers={"Accept": "application/json"})
+    response.raise_for_status()
+    entries = response.json().get("Entries") or []
+    return [name_from_url(entry["FullPath"]) for entry in entries if "FullPath" in entry]
+
+
+def get_latency_stats():
+    """Per-operation call/error counts and latency percentiles (ms) over recent samples."""
+    stats = {}
+    with _stats_lock:
+        for operation, samples in _latency.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            stats[operation] = {
+                **_counts[operation],
+                "p50_ms": ordered[len(ordered) // 2],
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max_ms": ordered[-1],
+            }
+    return stats
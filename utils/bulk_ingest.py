@@ -0,0 +1,108 @@
+"""
+Helpers for loading large CSV files into Neo4j with batched `UNWIND` writes.
+
+The CSV is streamed in chunks, each batch of rows is sent as one parameter
+list inside an explicit write transaction, and an optional parallel mode
+partitions rows by the key of the node each row MERGEs (patient_id for the
+patient import, doctor_id for doctors) so no two workers ever MERGE the same
+node concurrently.
+"""
+import queue
+import threading
+import time
+import zlib
+
+import pandas as pd
+
+from utils.neo4j_repository import NEO4J_DATABASE
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_csv_batches(csv_file, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield lists of row dicts, reading the CSV `batch_size` rows at a time."""
+    for chunk in pd.read_csv(csv_file, chunksize=batch_size, dtype=str, keep_default_na=False):
+        yield chunk.to_dict("records")
+
+
+class IngestStats:
+    """Thread-safe row/batch counters with a rows-per-second rate."""
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, rows):
+        with self._lock:
+            self.rows += rows
+            self.batches += 1
+            rows_done, batches_done = self.rows, self.batches
+        elapsed = time.perf_counter() - self.started
+        print(f"  {self.label}: batch {batches_done} — {rows_done} rows ({rows_done / elapsed:,.0f} rows/s)")
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        print(f"✅ {self.label}: {self.rows} rows in {self.batches} batches, {elapsed:.1f}s ({rate:,.0f} rows/s)")
+        return {"rows": self.rows, "batches": self.batches, "seconds": elapsed, "rows_per_second": rate}
+
+
+def write_batches(driver, write_batch, batches, stats, workers=1, partition_key=None):
+    """
+    Send every batch through `session.execute_write(write_batch, rows)`.
+
+    With workers > 1, rows are partitioned by `partition_key` so each key is
+    always written by the same worker; each worker owns one session and
+    processes its partition's batches in order.
+    """
+    if workers <= 1 or not partition_key:
+        with driver.session(database=NEO4J_DATABASE) as session:
+            for rows in batches:
+                session.execute_write(write_batch, rows)
+                stats.add(len(rows))
+        return stats.report()
+
+    queues = [queue.Queue(maxsize=4) for _ in range(workers)]
+    errors = []
+
+    def worker(work_queue):
+        with driver.session(database=NEO4J_DATABASE) as session:
+            while True:
+                rows = work_queue.get()
+                if rows is None:
+                    return
+                if errors:
+                    continue  # drain the queue after a failure elsewhere
+                try:
+                    session.execute_write(write_batch, rows)
+                    stats.add(len(rows))
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(q,), daemon=True) for q in queues]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for rows in batches:
+            if errors:
+                break
+            partitions = [[] for _ in range(workers)]
+            for row in rows:
+                key = str(row.get(partition_key, ""))
+                partitions[zlib.crc32(key.encode("utf-8")) % workers].append(row)
+            for work_queue, partition in zip(queues, partitions):
+                if partition:
+                    work_queue.put(partition)
+    finally:
+        for work_queue in queues:
+            work_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return stats.report()
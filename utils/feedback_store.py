@@ -0,0 +1,237 @@
+"""
+Doctor feedback on generated insights, stored in SQLite (WAL mode).
+
+Replaces the append-only `feedback_store.jsonl`: lookups by
+(case_id, doctor_id) go through an index instead of parsing every line,
+concurrent writers are serialised by SQLite, and dashboards aggregate in
+SQL or stream rows in batches instead of loading the whole file.
+
+Each write also bumps a rollup row per (day, doctor, case) in the same
+transaction, so totals and trends (e.g. good-rate per week per doctor) are
+read from O(buckets) rows without rescanning the events.
+
+The legacy JSONL file is imported automatically the first time an empty
+store is opened; it can also be imported explicitly (re-importing is a no-op):
+
+    python -m utils.feedback_store --import feedback_store.jsonl
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# === Configuration ===
+FEEDBACK_DB_PATH = os.getenv("FEEDBACK_DB_PATH", "feedback.sqlite3")
+LEGACY_FEEDBACK_FILE = "feedback_store.jsonl"
+
+GOOD_RATING = "good"  # every other rating ("bad", "poor") counts as poor
+
+
+class FeedbackStore:
+    def __init__(self, db_path=FEEDBACK_DB_PATH):
+        self.db_path = db_path
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:  # commit on success, roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS feedback (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    case_id TEXT NOT NULL,
+                    doctor_id TEXT NOT NULL,
+                    is_good TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    UNIQUE (case_id, doctor_id, timestamp)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS feedback_timestamp ON feedback (timestamp)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS feedback_rollup (
+                    day TEXT NOT NULL,
+                    doctor_id TEXT NOT NULL,
+                    case_id TEXT NOT NULL,
+                    good INTEGER NOT NULL DEFAULT 0,
+                    poor INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, doctor_id, case_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS feedback_rollup_doctor ON feedback_rollup (doctor_id, day)")
+            if conn.execute("SELECT 1 FROM feedback_rollup LIMIT 1").fetchone() is None:
+                self._rebuild_rollup(conn)  # events stored before the rollup existed
+
+    @staticmethod
+    def _rebuild_rollup(conn):
+        conn.execute("DELETE FROM feedback_rollup")
+        conn.execute("""
+            INSERT INTO feedback_rollup (day, doctor_id, case_id, good, poor)
+            SELECT substr(timestamp, 1, 10), doctor_id, case_id,
+                   SUM(is_good = ?), SUM(is_good != ?)
+            FROM feedback GROUP BY substr(timestamp, 1, 10), doctor_id, case_id
+        """, (GOOD_RATING, GOOD_RATING))
+
+    @staticmethod
+    def _insert(conn, entry):
+        """Insert one event and bump its rollup bucket; returns 1 if inserted, 0 if already present."""
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO feedback (case_id, doctor_id, is_good, timestamp) "
+            "VALUES (:case_id, :doctor_id, :is_good, :timestamp)",
+            entry,
+        ).rowcount
+        if inserted:
+            good = int(entry["is_good"] == GOOD_RATING)
+            conn.execute(
+                "INSERT INTO feedback_rollup (day, doctor_id, case_id, good, poor) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, doctor_id, case_id) DO UPDATE SET good = good + excluded.good, poor = poor + excluded.poor",
+                (entry["timestamp"][:10], entry["doctor_id"], entry["case_id"], good, 1 - good),
+            )
+        return inserted
+
+    def add(self, case_id, doctor_id, is_good, timestamp=None):
+        """Record one rating ("good" / "bad"); returns the stored entry."""
+        entry = {
+            "case_id": case_id,
+            "doctor_id": doctor_id,
+            "is_good": is_good,
+            "timestamp": timestamp or datetime.now().isoformat(),
+        }
+        with self._connect() as conn:
+            self._insert(conn, entry)
+        return entry
+
+    def latest(self, case_id, doctor_id):
+        """Most recent rating by a doctor for a case, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT is_good, timestamp FROM feedback WHERE case_id = ? AND doctor_id = ? "
+                "ORDER BY timestamp DESC LIMIT 1",
+                (case_id, doctor_id),
+            ).fetchone()
+        return dict(row) if row else None
+
+    # === Rollups ===
+    def summary(self, doctor_id=None):
+        """{"good", "poor", "total", "good_rate"} from the rollup, optionally for one doctor."""
+        where, params = ("WHERE doctor_id = ?", (doctor_id,)) if doctor_id else ("", ())
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT COALESCE(SUM(good), 0) AS good, COALESCE(SUM(poor), 0) AS poor FROM feedback_rollup {where}", params
+            ).fetchone()
+        return _with_rate(dict(row))
+
+    def summary_by_doctor(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT doctor_id, SUM(good) AS good, SUM(poor) AS poor FROM feedback_rollup GROUP BY doctor_id ORDER BY doctor_id"
+            ).fetchall()
+        return [_with_rate(dict(row)) for row in rows]
+
+    def weekly_trend(self, doctor_id=None, weeks=12):
+        """Good/poor counts and good-rate per ISO week (Monday start) and doctor, newest `weeks` weeks."""
+        where, params = ("AND doctor_id = ?", (doctor_id,)) if doctor_id else ("", ())
+        with self._connect() as conn:
+            rows = conn.execute(f"""
+                SELECT date(day, '-6 days', 'weekday 1') AS week, doctor_id, SUM(good) AS good, SUM(poor) AS poor
+                FROM feedback_rollup
+                WHERE day >= date('now', ?) {where}
+                GROUP BY week, doctor_id
+                ORDER BY week, doctor_id
+            """, (f"-{weeks * 7} days", *params)).fetchall()
+        return [_with_rate(dict(row)) for row in rows]
+
+    def counts_by_rating(self):
+        """{"good": n, "bad": m, ...} aggregated in SQL."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT is_good, COUNT(*) AS n FROM feedback GROUP BY is_good").fetchall()
+        return {row["is_good"]: row["n"] for row in rows}
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+
+    def iter_entries(self, since=None, batch_size=1000):
+        """Stream entries in timestamp order, `batch_size` rows at a time."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT case_id, doctor_id, is_good, timestamp FROM feedback WHERE timestamp > ? ORDER BY timestamp",
+                (since or "",),
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+
+    def recent(self, limit=100, offset=0):
+        """A page of the newest entries, for raw-data views."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT case_id, doctor_id, is_good, timestamp FROM feedback ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_jsonl(self, path):
+        """Import a legacy feedback JSONL file; returns (imported, skipped). Safe to repeat."""
+        imported = skipped = 0
+        with open(path, "r", encoding="utf-8") as f, self._connect() as conn:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    inserted = self._insert(conn, {field: entry[field] for field in ("case_id", "doctor_id", "is_good", "timestamp")})
+                except (ValueError, KeyError):
+                    inserted = 0
+                imported += inserted
+                skipped += 1 - inserted
+        return imported, skipped
+
+
+def _with_rate(row):
+    row["total"] = row["good"] + row["poor"]
+    row["good_rate"] = row["good"] / row["total"] if row["total"] else None
+    return row
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_feedback_store():
+    """Process-wide store; imports the legacy JSONL file into a new, empty database once."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = FeedbackStore()
+                if store.count() == 0 and os.path.exists(LEGACY_FEEDBACK_FILE):
+                    imported, _ = store.import_jsonl(LEGACY_FEEDBACK_FILE)
+                    print(f"Imported {imported} feedback entries from {LEGACY_FEEDBACK_FILE}")
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Manage the feedback store.")
+    arg_parser.add_argument("--import", dest="import_path", help="import a legacy feedback JSONL file")
+    args = arg_parser.parse_args()
+    store = FeedbackStore()
+    if args.import_path:
+        imported, skipped = store.import_jsonl(args.import_path)
+        print(f"✅ Imported {imported} entries ({skipped} already present or invalid)")
+    print(f"Feedback entries: {store.count()} {store.counts_by_rating()}")
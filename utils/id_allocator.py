@@ -0,0 +1,128 @@
+"""
+Atomic C### / P### id allocation backed by counter nodes.
+
+Each sequence has one `(:IdSequence {name})` node whose `value` is the last
+number handed out. Allocation increments it inside a single write
+transaction, so concurrent sessions never receive the same id. Schema
+migration 5 seeds the counters from the highest existing ids; on a database
+without them, the first allocation seeds its counter the same way.
+
+An allocator can reserve a block of ids per round trip (ID_BLOCK_SIZE) and
+hand them out locally; ids left in a block when the process exits are simply
+skipped, so numbering may have gaps but never duplicates.
+"""
+import os
+import threading
+
+from neo4j.exceptions import ConstraintError
+
+from utils.neo4j_repository import read_single, write
+
+# === Configuration ===
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "1"))  # ids reserved per round trip
+
+# sequence name -> (label, id property, prefix)
+SEQUENCES = {
+    "case": ("Case", "case_id", "C"),
+    "patient": ("Patient", "id", "P"),
+}
+
+
+def seed_sequence_query(name):
+    """Cypher that creates the counter of `name` at the highest existing id, bound as `s`."""
+    label, id_property, prefix = SEQUENCES[name]
+    return f"""
+        OPTIONAL MATCH (n:{label})
+        WHERE n.{id_property} =~ '{prefix}[0-9]+'
+        WITH coalesce(max(toInteger(substring(n.{id_property}, {len(prefix)}))), 0) AS seed
+        MERGE (s:IdSequence {{name: '{name}'}})
+        ON CREATE SET s.value = seed
+    """
+
+
+def format_id(prefix, number):
+    return f"{prefix}{number:03d}"  # C001, C010, C123, C1000
+
+
+class IdAllocator:
+    """Hands out ids for one sequence, reserving `block_size` numbers at a time."""
+
+    def __init__(self, name, block_size=ID_BLOCK_SIZE, driver=None):
+        self.name = name
+        self.label, self.id_property, self.prefix = SEQUENCES[name]
+        self.block_size = max(1, block_size)
+        self.driver = driver
+        self._lock = threading.Lock()
+        self._next = 0  # next number to hand out from the local block
+        self._end = 0   # last number in the local block
+
+    def allocate(self):
+        """Return the next id, reserving a new block from Neo4j when the local one is used up."""
+        with self._lock:
+            if self._next == 0 or self._next > self._end:
+                self._end = self._reserve(self.block_size)
+                self._next = self._end - self.block_size + 1
+            number = self._next
+            self._next += 1
+        return format_id(self.prefix, number)
+
+    def peek(self):
+        """The id `allocate()` would most likely return next; nothing is reserved."""
+        with self._lock:
+            if self._next and self._next <= self._end:
+                return format_id(self.prefix, self._next)
+        record = read_single(
+            "MATCH (s:IdSequence {name: $name}) RETURN s.value AS value", {"name": self.name}, driver=self.driver
+        )
+        last = record["value"] if record else 0  # the counter is seeded by migration 5
+        return format_id(self.prefix, last + 1)
+
+    def _reserve(self, count):
+        """Advance the counter by `count` in one transaction; return the new last number."""
+        records = write("""
+            MATCH (s:IdSequence {name: $name})
+            SET s.value = s.value + $count
+            RETURN s.value AS value
+        """, {"name": self.name, "count": count}, driver=self.driver)
+        if records:
+            return records[0]["value"]
+
+        # First use: seed from the highest existing id. If another process
+        # creates the counter concurrently, the uniqueness constraint rejects
+        # this one and we fall back to the increment above.
+        try:
+            records = write(seed_sequence_query(self.name) + """
+                SET s.value = s.value + $count
+                RETURN s.value AS value
+            """, {"count": count}, driver=self.driver)
+        except ConstraintError:
+            return self._reserve(count)
+        return records[0]["value"]
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(name):
+    """Process-wide allocator for `name`, shared across Streamlit reruns."""
+    with _allocators_lock:
+        if name not in _allocators:
+            _allocators[name] = IdAllocator(name)
+        return _allocators[name]
+
+
+def next_case_id():
+    return get_allocator("case").allocate()
+
+
+def next_patient_id():
+    return get_allocator("patient").allocate()
+
+
+def preview_case_id():
+    return get_allocator("case").peek()
+
+
+def preview_patient_id():
+    return get_allocator("patient").peek()
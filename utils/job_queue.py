@@ -0,0 +1,309 @@
+"""
+Persistent background jobs backed by a SQLite table and a thread worker pool.
+
+Work submitted here survives Streamlit reruns and closed tabs: the page only
+stores a job id and polls `get_job()` for status, progress and the result.
+
+Statuses: queued -> running -> done | failed | cancelled. Failed attempts are
+re-queued with backoff until `max_attempts` is reached; a handler raises
+`JobFailed` for errors that retrying cannot fix. Submitting with an
+idempotency key returns the existing job for that key instead of creating a
+duplicate (re-queuing it if it was cancelled), so keys should include a
+fingerprint of the inputs; failed or cancelled jobs can be re-queued with
+`retry()`.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# === Configuration ===
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))  # seconds, doubled per attempt
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "600"))  # running jobs silent this long are re-queued
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when cancellation of its job was requested."""
+
+
+class JobFailed(Exception):
+    """Raised inside a handler to fail its job at once, without further attempts."""
+
+
+class JobContext:
+    """Handed to job handlers to report progress and observe cancellation."""
+
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self.job_id = job_id
+
+    def update_progress(self, progress):
+        self._queue._execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (progress, time.time(), self.job_id)
+        )
+
+    def cancelled(self):
+        row = self._queue._query_one("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,))
+        return bool(row and row[0])
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+
+class JobQueue:
+    def __init__(self, db_path=JOB_DB_PATH, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._init_db()
+
+    # === Storage ===
+    @contextmanager
+    def _connect(self, isolation_level=""):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=isolation_level)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:  # commit on success, roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    idempotency_key TEXT UNIQUE,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    run_after REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after)")
+
+    def _execute(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def _query_one(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    # === Public API ===
+    def register(self, kind, handler):
+        """`handler(payload, context)` runs a job of `kind` and returns a JSON-serialisable result."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, payload, idempotency_key=None, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Queue a job and return its id. A key that was already submitted returns
+        the existing job: a cancelled one is re-queued, while a done (or
+        failed) one is returned as-is, so the key must cover everything the
+        result depends on (e.g. a fingerprint of the inputs) for changed
+        inputs to produce a new job.
+        """
+        self.start()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        requeued = 0
+        with self._connect() as conn:
+            # INSERT OR IGNORE, then read back: concurrent submits of one key all get the winner's id
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, idempotency_key, payload, status, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, idempotency_key, json.dumps(payload), QUEUED, max_attempts, now, now, now),
+            ).rowcount
+            if not inserted:
+                job_id = conn.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()["id"]
+                # Submitting a cancelled job again means the caller wants it after all
+                requeued = conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = 0, cancel_requested = 0, error = NULL, progress = NULL, "
+                    "run_after = ?, finished_at = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                    (QUEUED, now, now, job_id, CANCELLED),
+                ).rowcount
+        if inserted or requeued:
+            self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id):
+        row = self._query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not row:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued job immediately, or ask a running one to stop at its next check."""
+        now = time.time()
+        if self._execute(
+            "UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, now, now, job_id, QUEUED),
+        ):
+            return True
+        return bool(self._execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?", (now, job_id, RUNNING)
+        ))
+
+    def retry(self, job_id):
+        """Re-queue a failed or cancelled job; no-op for jobs that are queued, running or done."""
+        now = time.time()
+        requeued = self._execute(
+            "UPDATE jobs SET status = ?, attempts = 0, cancel_requested = 0, error = NULL, progress = NULL, "
+            "run_after = ?, finished_at = NULL, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (QUEUED, now, now, job_id, FAILED, CANCELLED),
+        )
+        if requeued:
+            self.start()
+            self._wakeup.set()
+        return bool(requeued)
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # === Workers ===
+    def start(self):
+        """Start the worker threads once per process."""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._requeue_stale()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _requeue_stale(self):
+        # Jobs a crashed process left "running" without any recent progress.
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = ?, run_after = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+            (QUEUED, now, now, RUNNING, now - JOB_STALE_AFTER),
+        )
+
+    def _claim(self):
+        """Atomically move the oldest runnable queued job this process has a handler for to running and return it."""
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        with self._connect(isolation_level=None) as conn:
+            conn.execute("BEGIN IMMEDIATE")  # take the write lock before reading, so two workers can't claim one job
+            try:
+                # Other processes sharing the DB may queue kinds this one cannot run; leave those to them
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status = ? AND run_after <= ? AND kind IN ({', '.join('?' * len(kinds))}) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, *kinds),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, now, now, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue claim failed: {e}")
+                job = None
+            if job is None:
+                # Sleep until a submit wakes us, polling so other processes' jobs are seen too
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        context = JobContext(self, job["id"])
+        handler = self._handlers.get(job["kind"])
+        now = time.time()
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind '{job['kind']}'.")
+            context.check_cancelled()
+            result = handler(json.loads(job["payload"]), context)
+            self._execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ?, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), time.time(), job["id"]),
+            )
+        except JobCancelled:
+            self._execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                (CANCELLED, now, now, job["id"]),
+            )
+        except JobFailed as e:
+            self._execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                (FAILED, str(e), time.time(), time.time(), job["id"]),
+            )
+        except Exception as e:
+            if context.cancelled():
+                self._execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                    (CANCELLED, str(e), time.time(), time.time(), job["id"]),
+                )
+                return
+            attempts = job["attempts"] + 1  # the claim incremented it in the table
+            if attempts < job["max_attempts"]:
+                delay = JOB_RETRY_BACKOFF * (2 ** (attempts - 1))
+                self._execute(
+                    "UPDATE jobs SET status = ?, error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                    (QUEUED, str(e), time.time() + delay, time.time(), job["id"]),
+                )
+            else:
+                self._execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, str(e), time.time(), time.time(), job["id"]),
+                )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide job queue, shared across Streamlit reruns and sessions."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
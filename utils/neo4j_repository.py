@@ -0,0 +1,367 @@
+"""
+Shared Neo4j access for the Streamlit pages and scripts.
+
+One pooled driver is created per process and reused across Streamlit reruns
+and sessions. All queries go through managed transactions
+(`execute_read` / `execute_write`), so reads can be routed to followers when
+NEO4J_URI uses the cluster-aware `neo4j://` scheme.
+"""
+import atexit
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from neo4j import GraphDatabase, READ_ACCESS, WRITE_ACCESS
+
+# === Configuration ===
+load_dotenv()
+NEO4J_URI = os.getenv("NEO4J_URI")
+NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE")  # None -> server default database
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+NEO4J_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))  # seconds
+NEO4J_MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))  # seconds
+
+Record = Dict[str, Any]
+
+_driver = None
+_driver_lock = threading.Lock()
+
+
+def get_driver():
+    """Return the process-wide Neo4j driver, creating it on first use."""
+    global _driver
+    if _driver is None:
+        with _driver_lock:
+            if _driver is None:
+                _driver = GraphDatabase.driver(
+                    NEO4J_URI,
+                    auth=(NEO4J_USERNAME, NEO4J_PASSWORD),
+                    max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+                    connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+                    max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME,
+                )
+    return _driver
+
+
+def close_driver() -> None:
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+
+atexit.register(close_driver)
+
+
+# === Managed transaction helpers ===
+def read(query: str, params: Optional[Dict[str, Any]] = None, driver=None) -> List[Record]:
+    """Run a read query in a managed read transaction and return all records."""
+    driver = driver or get_driver()
+    with driver.session(database=NEO4J_DATABASE, default_access_mode=READ_ACCESS) as session:
+        return session.execute_read(lambda tx: tx.run(query, params or {}).data())
+
+
+def read_single(query: str, params: Optional[Dict[str, Any]] = None, driver=None) -> Optional[Record]:
+    """Run a read query and return the first record, or None."""
+    records = read(query, params, driver=driver)
+    return records[0] if records else None
+
+
+def write(query: str, params: Optional[Dict[str, Any]] = None, driver=None) -> List[Record]:
+    """Run a write query in a managed write transaction and return all records."""
+    driver = driver or get_driver()
+    with driver.session(database=NEO4J_DATABASE, default_access_mode=WRITE_ACCESS) as session:
+        return session.execute_write(lambda tx: tx.run(query, params or {}).data())
+
+
+# === Doctors ===
+def fetch_all_doctors() -> List[Record]:
+    return read("MATCH (d:Doctor) RETURN d.id AS id, d.name AS name, d.role AS role")
+
+
+def get_doctor_profile(doctor_id: str) -> Optional[Record]:
+    return read_single(
+        "MATCH (d:Doctor {id: $doctor_id}) RETURN d.name AS name, d.role AS role",
+        {"doctor_id": doctor_id},
+    )
+
+
+def get_doctor_name(doctor_id: str) -> str:
+    profile = get_doctor_profile(doctor_id)
+    return profile["name"] if profile else "Doctor"
+
+
+def doctor_exists(doctor_id: str) -> bool:
+    return read_single("MATCH (d:Doctor {id: $doctor_id}) RETURN d.id AS id", {"doctor_id": doctor_id}) is not None
+
+
+def is_doctor_registered(doctor_id: str) -> bool:
+    return read_single("MATCH (d:DoctorLogin {id: $doctor_id}) RETURN d.id AS id", {"doctor_id": doctor_id}) is not None
+
+
+def create_doctor_login(doctor_id: str, password: str) -> None:
+    write("CREATE (d:DoctorLogin {id: $doctor_id, password: $password})", {"doctor_id": doctor_id, "password": password})
+
+
+def validate_doctor_login(doctor_id: str, password: str) -> bool:
+    return read_single(
+        "MATCH (d:DoctorLogin {id: $doctor_id, password: $password}) RETURN d.id AS id",
+        {"doctor_id": doctor_id, "password": password},
+    ) is not None
+
+
+# === Patients ===
+def fetch_all_patients(doctor_id: str) -> List[Record]:
+    """All patients with at least one case handled by `doctor_id`."""
+    records = read("""
+        MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
+        WHERE p.id IS NOT NULL AND p.name IS NOT NULL AND trim(p.name) <> ''
+        RETURN DISTINCT p.id AS id, p.name AS name
+        ORDER BY p.name
+    """, {"doctor_id": doctor_id})
+    return [{"id": r["id"], "name": r["name"].strip()} for r in records if r["id"] and r["name"] and r["name"].strip()]
+
+
+def fetch_all_patients_with_cases(doctor_id: str) -> List[Record]:
+    """Patients handled by `doctor_id`, each with the list of their cases."""
+    records = read("""
+        MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
+        WHERE p.id IS NOT NULL AND p.name IS NOT NULL AND trim(p.name) <> ''
+        RETURN p.id AS patient_id,
+               p.name AS patient_name,
+               collect(DISTINCT {case_id: c.case_id, summary: c.case_summary, created_at: c.created_at}) AS cases
+        ORDER BY p.name
+    """, {"doctor_id": doctor_id})
+    return [
+        {"id": r["patient_id"], "name": r["patient_name"].strip(), "cases": r["cases"]}
+        for r in records
+        if r["patient_id"] and r["patient_name"] and r["patient_name"].strip()
+    ]
+
+
+def fetch_patient_name_by_id(patient_id: str) -> Optional[str]:
+    record = read_single("MATCH (p:Patient {id: $patient_id}) RETURN p.name AS name", {"patient_id": patient_id})
+    return record["name"] if record else None
+
+
+# === Cases ===
+def fetch_cases_for_doctor(doctor_id: str) -> List[Record]:
+    """All cases assigned to `doctor_id`, newest first."""
+    return read("""
+        MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
+        RETURN c.case_id AS CaseID,
+               p.id AS PatientID,
+               p.name AS PatientName,
+               c.case_summary AS Summary,
+               c.created_at AS CreatedAt
+        ORDER BY c.created_at DESC
+    """, {"doctor_id": doctor_id})
+
+
+def fetch_case_dashboard(doctor_id: str) -> List[Record]:
+    """
+    Every case of `doctor_id` with its summary and reports in a single round trip.
+
+    Besides the fields of `fetch_cases_for_doctor`, each record carries
+    `Reports` (all reports, newest first) and the same list split by type:
+    `LabReports`, `ScanReports` and `Insights`. Dictated voice notes are
+    transcribed into the case summary, so they arrive with `Summary`.
+    """
+    return read("""
+        MATCH (d:Doctor {id: $doctor_id})-[:HANDLES]->(c:Case)-[:BELONGS_TO]->(p:Patient)
+        OPTIONAL MATCH (c)-[:HAS_REPORT]->(r:UploadedReport)
+        WITH c, p, r
+        ORDER BY r.uploaded_at DESC
+        WITH c, p, collect(CASE WHEN r IS NULL THEN NULL
+                                ELSE {url: r.url, type: r.type, uploaded_at: r.uploaded_at} END) AS reports
+        RETURN c.case_id AS CaseID,
+               p.id AS PatientID,
+               p.name AS PatientName,
+               c.case_summary AS Summary,
+               c.created_at AS CreatedAt,
+               reports AS Reports,
+               [x IN reports WHERE x.type = "lab"] AS LabReports,
+               [x IN reports WHERE x.type = "scan"] AS ScanReports,
+               [x IN reports WHERE x.type = "prescription"] AS Insights
+        ORDER BY c.created_at DESC
+    """, {"doctor_id": doctor_id})
+
+
+def fetch_cases_for_insights() -> List[Record]:
+    """
+    Every case with a summary or at least one lab/scan report, with its latest
+    lab and scan URLs and whether its newest insight predates any input
+    (`NeedsInsight` is true when there is no insight yet).
+    """
+    return read("""
+        MATCH (c:Case)
+        OPTIONAL MATCH (c)-[:HAS_REPORT]->(r:UploadedReport)
+        WITH c, r
+        ORDER BY r.uploaded_at DESC
+        WITH c, collect(r) AS reports
+        WITH c,
+             [x IN reports WHERE x.type = "lab"][0] AS lab,
+             [x IN reports WHERE x.type = "scan"][0] AS scan,
+             [x IN reports WHERE x.type = "prescription"][0] AS insight
+        WHERE coalesce(c.case_summary, "") <> "" OR lab IS NOT NULL OR scan IS NOT NULL
+        RETURN c.case_id AS CaseID,
+               c.case_summary AS Summary,
+               lab.url AS LabUrl,
+               scan.url AS ScanUrl,
+               insight.input_fingerprint AS InsightFingerprint,
+               insight IS NULL
+                   OR any(t IN [c.modified_at, c.created_at, lab.uploaded_at, scan.uploaded_at]
+                          WHERE t IS NOT NULL AND t > insight.uploaded_at) AS NeedsInsight
+        ORDER BY c.case_id
+    """)
+
+
+def find_insight_by_fingerprint(case_id: str, fingerprint: str) -> Optional[Record]:
+    """Newest stored insight of `case_id` generated from inputs with this fingerprint."""
+    return read_single("""
+        MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport {type: "prescription"})
+        WHERE r.input_fingerprint = $fingerprint AND r.insight_text IS NOT NULL
+        RETURN r.url AS url, r.insight_text AS text, toString(r.uploaded_at) AS uploaded_at,
+               r.prompt_tokens AS prompt_tokens, r.prompt_trimmed AS prompt_trimmed
+        ORDER BY r.uploaded_at DESC
+        LIMIT 1
+    """, {"case_id": case_id, "fingerprint": fingerprint})
+
+
+def case_exists(case_id: str) -> bool:
+    return read_single("MATCH (c:Case {case_id: $case_id}) RETURN c.case_id AS case_id", {"case_id": case_id}) is not None
+
+
+def create_case(patient_id: str, patient_name: str, case_id: str, case_summary: str, doctor_id: str) -> None:
+    """Create a case (and the patient if new) linked to the doctor."""
+    write("""
+        MERGE (d:Doctor {id: $doctor_id}) // Ensure doctor exists or create if not (should exist from login)
+
+        MERGE (p:Patient {id: $patient_id}) // Create Patient if new, or use existing if ID matches
+        ON CREATE SET p.name = $patient_name // Only set name if patient is newly created
+
+        CREATE (c:Case {case_id: $case_id}) // Create a new Case node (ensured unique by the caller)
+        SET c.case_summary = $case_summary,
+            c.created_at = datetime() // Set creation timestamp
+
+        MERGE (d)-[:HANDLES]->(c) // Link Doctor to Case
+        MERGE (c)-[:BELONGS_TO]->(p) // Link Case to Patient
+    """, {
+        "doctor_id": doctor_id,
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "case_id": case_id,
+        "case_summary": case_summary,
+    })
+
+
+def get_case_summary(case_id: str) -> str:
+    record = read_single("""
+        MATCH (c:Case {case_id: $case_id})
+        RETURN c.case_summary AS summary
+    """, {"case_id": case_id})
+    return record["summary"] if record and record["summary"] else ""
+
+
+def update_case_summary(case_id: str, summary: str) -> None:
+    write("""
+        MATCH (c:Case {case_id: $case_id})
+        SET c.case_summary = $summary,
+            c.modified_at = datetime()
+    """, {"case_id": case_id, "summary": summary})
+
+
+def delete_case(case_id: str) -> None:
+    """Delete a case with its uploaded reports and feedback; the patient is kept."""
+    write("""
+        MATCH (c:Case {case_id: $case_id})
+        OPTIONAL MATCH (c)-[:HAS_REPORT]->(ur:UploadedReport)
+        OPTIONAL MATCH (c)-[:HAS_FEEDBACK]->(f:Feedback)
+        DETACH DELETE c, ur, f
+    """, {"case_id": case_id})
+
+
+def delete_patient(patient_id: str) -> int:
+    """Delete a patient with all their cases, reports and feedback. Returns the number of cases removed."""
+    record = read_single("""
+        MATCH (p:Patient {id: $patient_id})<-[:BELONGS_TO]-(c:Case)
+        RETURN count(c) AS case_count
+    """, {"patient_id": patient_id})
+    write("""
+        MATCH (p:Patient {id: $patient_id})
+        OPTIONAL MATCH (p)<-[:BELONGS_TO]-(c:Case)
+        OPTIONAL MATCH (c)-[:HAS_REPORT]->(ur:UploadedReport)
+        OPTIONAL MATCH (c)-[:HAS_FEEDBACK]->(f:Feedback)
+        DETACH DELETE p, c, ur, f
+    """, {"patient_id": patient_id})
+    return record["case_count"] if record else 0
+
+
+# === Uploaded reports ===
+def fetch_reports_for_case(case_id: str) -> List[Record]:
+    """Reports of a case, newest first."""
+    return read("""
+        MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(r:UploadedReport)
+        RETURN r.url AS url, r.type AS type, r.uploaded_at AS uploaded_at
+        ORDER BY r.uploaded_at DESC
+    """, {"case_id": case_id})
+
+
+def fetch_all_reports() -> List[Record]:
+    """Every uploaded report with its patient and case, newest first."""
+    return read("""
+        MATCH (p:Patient)<-[:BELONGS_TO]-(c:Case)-[:HAS_REPORT]->(r:UploadedReport)
+        RETURN p.name AS PatientName, p.id AS PatientID, c.case_id AS CaseID,
+            r.type AS Type, r.url AS URL, r.uploaded_at AS UploadedAt
+        ORDER BY r.uploaded_at DESC
+    """)
+
+
+def fetch_report_urls_for_case(case_id: str) -> List[str]:
+    records = read("""
+        MATCH (c:Case {case_id: $case_id})-[:HAS_REPORT]->(ur:UploadedReport)
+        RETURN ur.url AS url
+    """, {"case_id": case_id})
+    return [r["url"] for r in records if r["url"]]
+
+
+def fetch_report_urls_for_patient(patient_id: str) -> List[str]:
+    records = read("""
+        MATCH (p:Patient {id: $patient_id})<-[:BELONGS_TO]-(c:Case)-[:HAS_REPORT]->(ur:UploadedReport)
+        RETURN ur.url AS url
+    """, {"patient_id": patient_id})
+    return [r["url"] for r in records if r["url"]]
+
+
+def link_uploaded_report(case_id: str, url: str, report_type: str,
+                         properties: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Create (or refresh) the UploadedReport for `url` and link it to both the
+    case and its patient. Extra `properties` (e.g. the insight text) are set
+    on the report node.
+    """
+    write("""
+        MATCH (c:Case {case_id: $case_id})-[:BELONGS_TO]->(p:Patient)
+        MERGE (r:UploadedReport {url: $url})
+        SET r += $properties, r.type = $report_type, r.uploaded_at = datetime()
+        MERGE (c)-[:HAS_REPORT]->(r)
+        MERGE (p)-[:HAS_UPLOADED]->(r)
+    """, {"case_id": case_id, "url": url, "report_type": report_type, "properties": properties or {}})
+
+
+def delete_uploaded_report(url: str, report_type: Optional[str] = None) -> None:
+    """Delete an UploadedReport (optionally only if it has the given type) and its relationships."""
+    if report_type:
+        write("""
+            MATCH (r:UploadedReport {url: $url, type: $report_type})
+            DETACH DELETE r
+        """, {"url": url, "report_type": report_type})
+    else:
+        write("""
+            MATCH (r:UploadedReport {url: $url})
+            DETACH DELETE r
+        """, {"url": url})
@@ -0,0 +1,51 @@
+"""
+Process pools for CPU-heavy decoding (DICOM pixel data, PDF text) that must
+not block the Streamlit or worker threads.
+
+Workers are started with the "spawn" method: forking a multi-threaded
+process such as a Streamlit server can copy locks held by other threads into
+the child, which then deadlocks on them. The pool is created on first use.
+
+`run_all` waits for a batch of calls under one deadline. If the deadline
+passes (a hung call, or a worker that died mid-task), the pool's workers are
+terminated so nothing keeps its slot, and a fresh pool is started on next use.
+"""
+import multiprocessing
+import threading
+import time
+
+
+class SpawnPool:
+    def __init__(self, max_workers, name="process pool"):
+        self.max_workers = max_workers
+        self.name = name
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.get_context("spawn").Pool(self.max_workers)
+            return self._pool
+
+    def _terminate(self, pool):
+        """Kill `pool`'s workers and drop it so the next call starts a fresh one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
+
+    def run_all(self, calls, timeout):
+        """Results of `fn(*args)` for each (fn, args) in `calls`, in order, within `timeout` seconds overall."""
+        pool = self._get()
+        deadline = time.monotonic() + timeout
+        try:
+            pending = [pool.apply_async(fn, args) for fn, args in calls]
+            return [result.get(timeout=max(0, deadline - time.monotonic())) for result in pending]
+        except multiprocessing.TimeoutError:
+            self._terminate(pool)
+            raise TimeoutError(f"{self.name} took longer than {timeout:.0f}s")
+
+    def run(self, fn, *args, timeout):
+        """`fn(*args)` in the pool; see `run_all`."""
+        return self.run_all([(fn, args)], timeout)[0]
@@ -0,0 +1,127 @@
+"""
+Versioned, idempotent schema migrations for the clinical graph.
+
+Each migration is a list of Cypher statements that are safe to re-run
+(`IF NOT EXISTS`, MERGE-based cleanups). The highest applied version is
+recorded on a single `(:SchemaVersion {id: "graph"})` node, so startup only
+runs migrations the database has not seen yet.
+
+    python -m utils.schema            # apply pending migrations
+    python -m utils.schema --status   # print the current and latest version
+"""
+import argparse
+import logging
+import threading
+
+from utils.id_allocator import SEQUENCES, seed_sequence_query
+from utils.neo4j_repository import NEO4J_DATABASE, get_driver, read_single, write
+
+logger = logging.getLogger(__name__)
+
+# Two UploadedReport nodes may share a URL from older CREATE-based writes;
+# fold them into one before the uniqueness constraint is created.
+_MERGE_DUPLICATE_REPORTS = [
+    """
+    MATCH (r:UploadedReport) WHERE r.url IS NOT NULL
+    WITH r.url AS url, collect(r) AS nodes WHERE size(nodes) > 1
+    WITH head(nodes) AS keep, tail(nodes) AS dupes
+    UNWIND dupes AS dupe
+    OPTIONAL MATCH (c:Case)-[:HAS_REPORT]->(dupe)
+    OPTIONAL MATCH (p:Patient)-[:HAS_UPLOADED]->(dupe)
+    FOREACH (_ IN CASE WHEN c IS NULL THEN [] ELSE [1] END | MERGE (c)-[:HAS_REPORT]->(keep))
+    FOREACH (_ IN CASE WHEN p IS NULL THEN [] ELSE [1] END | MERGE (p)-[:HAS_UPLOADED]->(keep))
+    """,
+    """
+    MATCH (r:UploadedReport) WHERE r.url IS NOT NULL
+    WITH r.url AS url, collect(r) AS nodes WHERE size(nodes) > 1
+    UNWIND tail(nodes) AS dupe
+    DETACH DELETE dupe
+    """,
+]
+
+MIGRATIONS = [
+    (1, "uniqueness constraints on lookup keys", _MERGE_DUPLICATE_REPORTS + [
+        "CREATE CONSTRAINT case_id_unique IF NOT EXISTS FOR (c:Case) REQUIRE c.case_id IS UNIQUE",
+        "CREATE CONSTRAINT patient_id_unique IF NOT EXISTS FOR (p:Patient) REQUIRE p.id IS UNIQUE",
+        "CREATE CONSTRAINT doctor_id_unique IF NOT EXISTS FOR (d:Doctor) REQUIRE d.id IS UNIQUE",
+        "CREATE CONSTRAINT uploaded_report_url_unique IF NOT EXISTS FOR (r:UploadedReport) REQUIRE r.url IS UNIQUE",
+    ]),
+    (2, "range indexes for report filters and ordering", [
+        "CREATE RANGE INDEX uploaded_report_uploaded_at IF NOT EXISTS FOR (r:UploadedReport) ON (r.uploaded_at)",
+        "CREATE RANGE INDEX uploaded_report_type IF NOT EXISTS FOR (r:UploadedReport) ON (r.type)",
+        "CREATE INDEX doctor_login_index IF NOT EXISTS FOR (d:DoctorLogin) ON (d.id)",
+    ]),
+    (3, "uniqueness of id allocator counters", [
+        "CREATE CONSTRAINT id_sequence_name_unique IF NOT EXISTS FOR (s:IdSequence) REQUIRE s.name IS UNIQUE",
+    ]),
+    (4, "index for merging bulk-imported reports by URL", [
+        "CREATE INDEX report_url IF NOT EXISTS FOR (r:Report) ON (r.url)",
+    ]),
+    # Previews read the counters; without them each preview scanned every id
+    (5, "seed id allocator counters from existing ids", [seed_sequence_query(name) for name in SEQUENCES]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_ensured = False
+_ensure_lock = threading.Lock()
+
+
+def get_schema_version(driver=None):
+    """Highest migration version recorded in the graph (0 if none)."""
+    record = read_single(
+        "MATCH (s:SchemaVersion {id: 'graph'}) RETURN s.version AS version", driver=driver
+    )
+    return record["version"] if record and record["version"] is not None else 0
+
+
+def apply_migrations(driver=None):
+    """Apply every migration newer than the recorded version; return the versions applied."""
+    driver = driver or get_driver()
+    current = get_schema_version(driver)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"🛠️ Applying schema migration {version}: {description}")
+        # Schema commands can't share a transaction with data writes, so each
+        # statement runs in its own auto-commit transaction.
+        with driver.session(database=NEO4J_DATABASE) as session:
+            for statement in statements:
+                session.run(statement).consume()
+        write("""
+            MERGE (s:SchemaVersion {id: 'graph'})
+            SET s.version = $version, s.applied_at = datetime()
+        """, {"version": version}, driver=driver)
+        applied.append(version)
+    return applied
+
+
+def ensure_schema(driver=None):
+    """
+    Run pending migrations once per process. A failure is logged, not raised,
+    so the app still starts; the next call tries again.
+    """
+    global _ensured
+    if _ensured:
+        return
+    with _ensure_lock:
+        if _ensured:
+            return
+        try:
+            apply_migrations(driver)
+        except Exception:
+            logger.exception("❌ Schema migration failed; will retry on next start-up check")
+            return
+        _ensured = True
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Apply Neo4j schema migrations.")
+    arg_parser.add_argument("--status", action="store_true", help="only print the current schema version")
+    args = arg_parser.parse_args()
+    if args.status:
+        print(f"Schema version {get_schema_version()} (latest {LATEST_VERSION})")
+    else:
+        applied = apply_migrations()
+        print(f"✅ Schema at version {LATEST_VERSION}" + (f" (applied {applied})" if applied else " (up to date)"))
@@ -0,0 +1,170 @@
+"""
+Single-flight de-duplication: concurrent calls with the same key share one
+execution and all receive its result (or its exception).
+
+Within a process the first caller for a key becomes the leader and the
+others wait on it. With a SQLite path configured, leaders in different
+processes also coordinate through a lease row per key: a leader that finds
+another process working on the key waits for it to finish, then asks
+`lookup()` (typically a shared on-disk cache) for the result before doing
+the work itself. Results are not passed through the lease table, so if
+`lookup()` cannot see other processes' results, cross-process leases only
+serialise the work instead of de-duplicating it.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# === Configuration ===
+SINGLE_FLIGHT_DB = os.getenv("SINGLE_FLIGHT_DB")  # set to coordinate across processes
+SINGLE_FLIGHT_LEASE = float(os.getenv("SINGLE_FLIGHT_LEASE", "300"))  # seconds before a crashed owner's lease expires
+SINGLE_FLIGHT_POLL = 0.2  # seconds between checks while another process holds the lease
+
+
+class Flight:
+    """One in-flight execution shared by its leader and followers."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def resolve(self, result):
+        self._result = result
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """The shared result; re-raises the leader's exception."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for the in-flight call.")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    def __init__(self, db_path=SINGLE_FLIGHT_DB, lease=SINGLE_FLIGHT_LEASE):
+        self.db_path = db_path
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {"leaders": 0, "shared": 0, "shared_across_processes": 0}
+        if db_path:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS single_flight (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # === Cross-process lease ===
+    def _try_lease(self, key, owner):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM single_flight WHERE key = ? AND expires_at < ?", (key, now))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO single_flight (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + self.lease),
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        return acquired
+
+    def _lease_held(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT expires_at FROM single_flight WHERE key = ?", (key,)).fetchone()
+        return bool(row and row[0] >= time.time())
+
+    def _release_lease(self, key, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM single_flight WHERE key = ? AND owner = ?", (key, owner))
+
+    def _acquire_across_processes(self, key, owner, lookup):
+        """Take the lease for `key`, or return another process's result found via `lookup`."""
+        while not self._try_lease(key, owner):
+            while self._lease_held(key):
+                time.sleep(SINGLE_FLIGHT_POLL)
+            result = lookup() if lookup else None
+            if result is not None:
+                return result
+        return None
+
+    # === Public API ===
+    @contextmanager
+    def flight(self, key, lookup=None):
+        """
+        Join the flight for `key`; yields (flight, is_leader). Inside the block
+        the leader must call `flight.resolve(result)`; everyone else calls
+        `flight.wait()`. A leader that leaves without resolving fails the
+        flight for its followers.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight_is_new = False
+                self._stats["shared"] += 1
+            else:
+                flight = self._flights[key] = Flight()
+                flight_is_new = True
+
+        if not flight_is_new:
+            yield flight, False
+            return
+
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        leased = False
+        leader = True
+        try:
+            if self.db_path:
+                result = self._acquire_across_processes(key, owner, lookup)
+                if result is not None:
+                    leader = False
+                    flight.resolve(result)
+                    with self._lock:
+                        self._stats["shared_across_processes"] += 1
+                else:
+                    leased = True
+            if leader:
+                with self._lock:
+                    self._stats["leaders"] += 1
+            yield flight, leader
+            if not flight.done:
+                flight.fail(RuntimeError("The in-flight call finished without a result."))
+        except BaseException as e:
+            if not flight.done:
+                flight.fail(e if isinstance(e, Exception) else RuntimeError("The in-flight call was abandoned."))
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            if leased:
+                self._release_lease(key, owner)
+
+    def do(self, key, fn, lookup=None):
+        """Run `fn()` once for all concurrent callers of `key`; returns (result, shared)."""
+        with self.flight(key, lookup) as (flight, leader):
+            if leader:
+                flight.resolve(fn())
+            return flight.wait(), not leader
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}